@@ -1,18 +1,51 @@
-import os
-import psutil
 import spotipy
+# Import user modules
+import clock
+import process_watcher
 
 
 class ActivityCheck(object):
 
-    def __init__(self, logger, spotipy_obj):
+    def __init__(self, logger, spotipy_obj, request_counter=None,
+            device_cache_ttl_s=300, metrics_registry=None, clock_obj=None):
         self.logger = logger
         self.spotipy_obj = spotipy_obj
+        # Optional function which is called for every Spotify API request made
+        self.request_counter = request_counter
+        # Cache of the user's Spotify devices, indexed by device ID
+        self.device_cache = None
+        self.device_cache_time = 0
+        self.device_cache_ttl_s = device_cache_ttl_s
+        # Clock from which the age of the device cache is read
+        self.clock = clock_obj
+        if clock_obj == None:
+            self.clock = clock.Clock()
+        # Watcher which tracks the Spotify process once it has been found
+        self.spotify_watcher = process_watcher.ProcessWatcher("spotify",
+            metrics_registry=metrics_registry)
+
+    def __request_devices(self):
+        if self.request_counter != None:
+            self.request_counter()
+        return self.spotipy_obj.devices()['devices']
+
+    def invalidate_device_cache(self):
+        self.device_cache = None
+
+    def __get_cached_devices(self):
+        # Refresh the device cache if it is empty or has gone stale
+        if self.device_cache == None or self.clock.monotonic() - \
+                self.device_cache_time > self.device_cache_ttl_s:
+            spotify_devices = self.__request_devices()
+            self.device_cache = {device['id']: device for device in spotify_devices
+                if device.get('id') != None}
+            self.device_cache_time = self.clock.monotonic()
+        return self.device_cache
 
     def is_target_device_active(self, target_device_name):
         # Attempt to extract information about user's Spotify devices
         try:
-            spotify_devices = self.spotipy_obj.devices()['devices']
+            spotify_devices = self.__request_devices()
         # Report specific Spotify API error
         except spotipy.client.SpotifyException as ex:
             self.logger.write("Error: {HTTP status = %d; HTTP message = %s;}" %
@@ -28,58 +61,37 @@ class ActivityCheck(object):
                 return device['is_active']
         return False
 
-    def is_spotify_active(self):
-        is_active = False
-        # Iterate through all active processes
-        for p in psutil.process_iter(attrs=['name']):
-            # Check if Spotify is present in list of active processes
-            #   or otherwise running, sleeping, or a state in between
-            if "spotify" in p.name().lower().split('.')[0] and \
-                    (p.status() == psutil.STATUS_RUNNING or
-                    p.status() == psutil.STATUS_SLEEPING or
-                    p.status() == psutil.STATUS_WAKING):
-                is_active = True
-                break
-        return is_active
-
-    def lock_activities(self, lock_file_path):
-        # Check if lock file already exists
-        if os.path.isfile(lock_file_path) == True:
-            # If it exists, read the PID contained within
-            try:
-                lock_file = open(lock_file_path, "r")
-                for line in lock_file:
-                    pid = int(line)
-                    break
-            except Exception as ex:
-                self.logger.write("Error: Could not read lock file '%s': %s" %
-                    (lock_file_path, str(ex)))
-                exit(1)
-            # Check if the process that created the lock file still exists based on
-            #   its PID and return False if so, otherwise, remove the lock file
-            if psutil.pid_exists(pid) == True:
-                lock_file.close()
-                return False
-            else:
-                lock_file.close()
-                os.remove(lock_file_path)
-        # If no other instance of this program is running, create a lock file
+    def is_playback_device_target(self, playback_state, target_device_name):
+        # Use the active device which is reported along with the playback state
+        device = playback_state.get('device')
+        if device == None:
+            return False
+        # Restricted devices may be reported without an ID, which the device
+        #   list cannot confirm either, so they are matched on the name reported
+        #   along with the playback state only
+        if device.get('id') == None:
+            return device['name'].lower() == target_device_name and \
+                device['is_active']
+        # Only request the user's Spotify devices if the cache went stale or if
+        #   the playback state names a device that is unknown to the cache
         try:
-            lock_file = open(lock_file_path, "w")
-            lock_file.write(str(os.getpid()))
-            lock_file.close()
-            return True
+            if device['id'] not in self.__get_cached_devices():
+                self.invalidate_device_cache()
+                if device['id'] not in self.__get_cached_devices():
+                    self.logger.write("Error: Unknown device '%s' is active" %
+                        device['name'])
+                    return False
+        # Report specific Spotify API error
+        except spotipy.client.SpotifyException as ex:
+            self.logger.write("Error: {HTTP status = %d; HTTP message = %s;}" %
+                (ex.http_status, ex.msg))
+            return False
+        # Report any other random error
         except Exception as ex:
-            self.logger.write("Error: Could not read lock file '%s': %s" %
-                (lock_file_path, str(ex)))
-            exit(1)
+            self.logger.write("Error: unexpected error occurred: %s" % str(ex))
+            return False
+        return device['name'].lower() == target_device_name and \
+            device['is_active']
 
-    def unlock_activities(self, lock_file_path):
-        # Check if this program's lock file still exists, and if so remove it
-        if os.path.isfile(lock_file_path) == True:
-            try:
-                os.remove(lock_file_path)
-            except Exception as ex:
-                self.logger.write("Error: Could not find lock file to delete '%s': %s" %
-                    (lock_file_path, str(ex)))
-                exit(1)
+    def is_spotify_active(self):
+        return self.spotify_watcher.is_alive()
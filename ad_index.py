@@ -0,0 +1,214 @@
+import collections
+import json
+import os
+import threading
+import time
+
+
+class AdIndex(object):
+
+    # Weight of a new sample in the running averages of the ad block statistics
+    __AVERAGE_WEIGHT = 0.2
+
+    def __init__(self, index_file_path=None, max_ad_count=512, max_account_count=64):
+        self.index_file_path = index_file_path
+        # Recently seen ads indexed by item ID, in least recently used order, of
+        #   which only the duration and the number of times played are kept
+        self.max_ad_count = max_ad_count
+        self.ads = collections.OrderedDict()
+        # Per hour of the day, the number of track ends and the number of those
+        #   which were followed by an ad
+        self.track_end_counts = [0] * 24
+        self.ad_follow_counts = [0] * 24
+        # Per account, in least recently used order, the running average of the
+        #   ad block length and of the interval between ad blocks
+        self.max_account_count = max_account_count
+        self.accounts = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.is_modified = False
+        if index_file_path != None:
+            self.load()
+
+    # Load the index from its file, of which the whole document is validated
+    #   before any state is replaced. Start with an empty index if it does not
+    #   exist yet, cannot be read or is invalid
+    def load(self):
+        try:
+            with open(self.index_file_path, "r") as index_file:
+                index = json.load(index_file)
+            ads, track_end_counts, ad_follow_counts, accounts = \
+                self.__parse_index(index)
+        except Exception:
+            return
+        with self.lock:
+            self.ads = ads
+            self.track_end_counts = track_end_counts
+            self.ad_follow_counts = ad_follow_counts
+            self.accounts = accounts
+
+    def __is_number(self, value, is_optional=False):
+        if value == None:
+            return is_optional
+        return isinstance(value, (int, float)) and isinstance(value, bool) == False
+
+    def __parse_hourly_counts(self, counts):
+        if isinstance(counts, list) == False or len(counts) != 24:
+            raise ValueError("hourly counts do not have 24 entries")
+        for count in counts:
+            if isinstance(count, int) == False or isinstance(count, bool) or \
+                    count < 0:
+                raise ValueError("hourly count is not a non-negative integer")
+        return counts
+
+    # Parse a list of (key, entry) pairs into entries in least recently used
+    #   order, of which only the given number of most recently used ones is kept
+    def __parse_entries(self, pairs, max_count, is_valid_entry):
+        if isinstance(pairs, list) == False:
+            raise ValueError("entries are not a list")
+        entries = collections.OrderedDict()
+        for pair in pairs:
+            if isinstance(pair, list) == False or len(pair) != 2 or \
+                    isinstance(pair[0], str) == False or \
+                    isinstance(pair[1], dict) == False or \
+                    is_valid_entry(pair[1]) == False:
+                raise ValueError("invalid entry: %s" % str(pair))
+            entries[pair[0]] = pair[1]
+            entries.move_to_end(pair[0])
+        while len(entries) > max_count:
+            entries.popitem(last=False)
+        return entries
+
+    def __is_valid_ad(self, entry):
+        return set(entry) == set(['duration_ms', 'count']) and \
+            self.__is_number(entry['duration_ms'], True) and \
+            isinstance(entry['count'], int) and entry['count'] >= 0
+
+    # The interval between blocks is only known after a block with a length and
+    #   a start time was recorded
+    def __is_valid_account(self, entry):
+        if set(entry) != set(['block_length_s', 'block_interval_s',
+                'last_block_timestamp']):
+            return False
+        if entry['last_block_timestamp'] == None:
+            return entry['block_length_s'] == None and \
+                entry['block_interval_s'] == None
+        return self.__is_number(entry['block_length_s']) and \
+            self.__is_number(entry['block_interval_s'], True) and \
+            self.__is_number(entry['last_block_timestamp'])
+
+    def __parse_index(self, index):
+        if isinstance(index, dict) == False:
+            raise ValueError("index is not an object")
+        return (
+            self.__parse_entries(index['ads'], self.max_ad_count,
+                self.__is_valid_ad),
+            self.__parse_hourly_counts(index['track_end_counts']),
+            self.__parse_hourly_counts(index['ad_follow_counts']),
+            self.__parse_entries(index['accounts'], self.max_account_count,
+                self.__is_valid_account))
+
+    # Write the index to a temporary file first and then replace the old index,
+    #   such that an interrupted write never corrupts it. The lock is held until
+    #   the index is replaced, as the polling loops of several accounts share the
+    #   index and its temporary file
+    def save(self):
+        if self.index_file_path == None:
+            return
+        with self.lock:
+            if self.is_modified == False:
+                return
+            index = {
+                'ads': list(self.ads.items()),
+                'track_end_counts': self.track_end_counts,
+                'ad_follow_counts': self.ad_follow_counts,
+                'accounts': list(self.accounts.items())}
+            temporary_file_path = "%s.tmp" % self.index_file_path
+            with open(temporary_file_path, "w") as index_file:
+                json.dump(index, index_file)
+            os.replace(temporary_file_path, self.index_file_path)
+            self.is_modified = False
+
+    def __touch(self, entries, key, max_count, default):
+        # Move the entry to the most recently used end, evicting the least
+        #   recently used entry if the maximum number of entries is exceeded
+        entry = entries.get(key)
+        if entry == None:
+            entry = default
+            entries[key] = entry
+            if len(entries) > max_count:
+                entries.popitem(last=False)
+        else:
+            entries.move_to_end(key)
+        return entry
+
+    def __average(self, average, sample):
+        if average == None:
+            return sample
+        return average + self.__AVERAGE_WEIGHT * (sample - average)
+
+    def record_ad(self, ad_id, duration_ms):
+        if ad_id == None:
+            return
+        with self.lock:
+            entry = self.__touch(self.ads, ad_id, self.max_ad_count,
+                {'duration_ms': duration_ms, 'count': 0})
+            if duration_ms != None:
+                entry['duration_ms'] = duration_ms
+            entry['count'] += 1
+            self.is_modified = True
+
+    def get_ad_duration_ms(self, ad_id):
+        with self.lock:
+            entry = self.ads.get(ad_id)
+            return entry['duration_ms'] if entry != None else None
+
+    # Record the end of a track and whether the next item was an ad
+    def record_track_end(self, is_followed_by_ad, timestamp=None):
+        hour = time.localtime(timestamp).tm_hour
+        with self.lock:
+            self.track_end_counts[hour] += 1
+            if is_followed_by_ad == True:
+                self.ad_follow_counts[hour] += 1
+            self.is_modified = True
+
+    # Record a block of consecutive ads which was played on an account
+    def record_ad_block(self, account, start_timestamp, length_s):
+        with self.lock:
+            entry = self.__touch(self.accounts, account, self.max_account_count,
+                {'block_length_s': None, 'block_interval_s': None,
+                    'last_block_timestamp': None})
+            entry['block_length_s'] = self.__average(entry['block_length_s'],
+                length_s)
+            if entry['last_block_timestamp'] != None:
+                entry['block_interval_s'] = self.__average(entry['block_interval_s'],
+                    start_timestamp - entry['last_block_timestamp'])
+            entry['last_block_timestamp'] = start_timestamp
+            self.is_modified = True
+
+    def get_ad_block_length_s(self, account):
+        with self.lock:
+            entry = self.accounts.get(account)
+            return entry['block_length_s'] if entry != None else None
+
+    # Estimate the probability that the next item after the current track is an
+    #   ad, based on the time of day and the time since the previous ad block
+    def get_ad_probability(self, account, timestamp=None):
+        if timestamp == None:
+            timestamp = time.time()
+        hour = time.localtime(timestamp).tm_hour
+        with self.lock:
+            # Use a prior of one track end of each kind for hours without history
+            probability = (self.ad_follow_counts[hour] + 1) / \
+                (self.track_end_counts[hour] + 2)
+            # The next block is due once the typical time between the end of a
+            #   block and the start of the next one has passed since the previous
+            #   block ended, which raises the probability from the prior towards 1
+            entry = self.accounts.get(account)
+            if entry != None and entry['block_interval_s'] != None:
+                gap_s = entry['block_interval_s'] - entry['block_length_s']
+                if gap_s > 0:
+                    interval_probability = min([1, max([0,
+                        (timestamp - entry['last_block_timestamp'] -
+                        entry['block_length_s']) / gap_s])])
+                    probability += (1 - probability) * interval_probability
+        return probability
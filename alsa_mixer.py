@@ -0,0 +1,94 @@
+import ctypes
+import ctypes.util
+
+
+class AlsaMixer(object):
+
+    # Channel index of the front left channel, see 'snd_mixer_selem_channel_id_t'
+    __FRONT_LEFT = 0
+
+    def __init__(self, control_name="Master", card_name="default"):
+        self.control_name = control_name
+        self.card_name = card_name
+        # Load the ALSA library in-process instead of forking 'amixer' per call
+        library_path = ctypes.util.find_library("asound")
+        if library_path == None:
+            raise OSError("ALSA library 'libasound' could not be found")
+        self.lib = ctypes.CDLL(library_path)
+        self.lib.snd_strerror.restype = ctypes.c_char_p
+        self.lib.snd_mixer_find_selem.restype = ctypes.c_void_p
+        self.lib.snd_mixer_find_selem.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        # Open a mixer handle once and keep it open for the program's lifetime
+        self.mixer = ctypes.c_void_p()
+        self.__check(self.lib.snd_mixer_open(ctypes.byref(self.mixer), 0),
+            "open mixer")
+        try:
+            self.__check(self.lib.snd_mixer_attach(self.mixer,
+                self.card_name.encode()), "attach to card '%s'" % self.card_name)
+            self.__check(self.lib.snd_mixer_selem_register(self.mixer, None, None),
+                "register simple element class")
+            self.__check(self.lib.snd_mixer_load(self.mixer), "load mixer elements")
+            # Find the simple mixer control by name
+            selem_id = ctypes.c_void_p()
+            self.__check(self.lib.snd_mixer_selem_id_malloc(ctypes.byref(selem_id)),
+                "allocate simple element identifier")
+            try:
+                self.lib.snd_mixer_selem_id_set_index(selem_id, 0)
+                self.lib.snd_mixer_selem_id_set_name(selem_id,
+                    self.control_name.encode())
+                self.elem = self.lib.snd_mixer_find_selem(self.mixer, selem_id)
+            finally:
+                self.lib.snd_mixer_selem_id_free(selem_id)
+            if self.elem == None:
+                raise OSError("ALSA mixer control '%s' could not be found" %
+                    self.control_name)
+            self.elem = ctypes.c_void_p(self.elem)
+            # Retrieve the raw volume range once, used to convert to percentages
+            volume_min = ctypes.c_long()
+            volume_max = ctypes.c_long()
+            self.__check(self.lib.snd_mixer_selem_get_playback_volume_range(
+                self.elem, ctypes.byref(volume_min), ctypes.byref(volume_max)),
+                "get volume range")
+            self.volume_min = volume_min.value
+            self.volume_max = volume_max.value
+        except OSError:
+            self.close()
+            raise
+
+    def __del__(self):
+        self.close()
+
+    def __check(self, result, action):
+        # ALSA library functions return a negative error code on failure
+        if result < 0:
+            raise OSError("Could not %s: %s" %
+                (action, self.lib.snd_strerror(result).decode()))
+
+    def close(self):
+        if getattr(self, 'mixer', None) != None and self.mixer.value != None:
+            self.lib.snd_mixer_close(self.mixer)
+            self.mixer = None
+
+    # Get the volume percentage of the front left channel, rounded similar to
+    #   'amixer'
+    def get_volume(self):
+        # Process pending events such that changes made by other programs (e.g.
+        #   the user changing the volume) are reflected in the cached value
+        self.__check(self.lib.snd_mixer_handle_events(self.mixer),
+            "handle mixer events")
+        volume = ctypes.c_long()
+        self.__check(self.lib.snd_mixer_selem_get_playback_volume(
+            self.elem, self.__FRONT_LEFT, ctypes.byref(volume)), "get volume")
+        volume_range = self.volume_max - self.volume_min
+        if volume_range <= 0:
+            return 0
+        return int(round((volume.value - self.volume_min) * 100 / volume_range))
+
+    # Set the volume percentage of all channels, the call returns once the
+    #   mixer has applied the new value
+    def set_volume(self, volume):
+        volume = min([100, max([0, volume])])
+        raw_volume = self.volume_min + \
+            int(round(volume * (self.volume_max - self.volume_min) / 100))
+        self.__check(self.lib.snd_mixer_selem_set_playback_volume_all(
+            self.elem, ctypes.c_long(raw_volume)), "set volume")
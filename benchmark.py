@@ -0,0 +1,757 @@
+# Import python libraries
+import argparse
+import asyncio
+import os
+import random
+import spotipy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+# Import user modules
+import activity_check
+import ad_index
+import config_watcher
+import daemon
+import fake_pulse_server
+import fake_spotify_server
+import http_session
+import instance_lock
+import logger
+import metrics
+import poll_loop
+import process_watcher
+import program_config
+import pulse_mixer
+import recorder
+import replay
+import scheduler
+import spotify_ad_muter
+import volume_control
+
+
+# Scripted timelines of the fake Spotify API used by the latency benchmark
+LATENCY_SCENARIOS = {
+    'short': [("track", 8), ("ad", 6), ("ad", 4), ("track", 8), ("pause", 4),
+        ("track", 6), ("rate_limit", 3), ("track", 6), ("ad", 5), ("track", 6)],
+    'full': [("track", 20), ("ad", 15), ("ad", 10), ("track", 15), ("pause", 8),
+        ("track", 10), ("idle", 10), ("track", 12), ("rate_limit", 5), ("track", 10),
+        ("timeout", 8), ("track", 15), ("ad", 12), ("track", 10), ("ad", 30),
+        ("track", 15)]}
+
+
+class FakeProcess(object):
+
+    def __init__(self, pid, name, status, end_time=None):
+        self.pid = pid
+        self.info = {'name': name, 'status': status}
+        # Monotonic time at which the process exits, or None if it never exits
+        self.end_time = end_time
+
+    def is_running(self):
+        return self.end_time == None or time.monotonic() < self.end_time
+
+    def status(self):
+        return self.info['status']
+
+
+class NullLogger(object):
+
+    def write(self, message):
+        pass
+
+
+class FakeVolumeControl(object):
+
+    def __init__(self, volume=50):
+        self.volume = volume
+        self.write_count = 0
+        # Monotonic times at which the volume was changed, and the new volumes
+        self.writes = []
+
+    def get_system_volume(self):
+        return self.volume
+
+    def set_system_volume(self, volume):
+        self.volume = volume
+        self.write_count += 1
+        self.writes.append((time.monotonic(), volume))
+
+
+class FakeAccountConfig(object):
+
+    def __init__(self, name, target_device_name, automatic_closing=False,
+            poll_mode="single"):
+        self.NAME = name
+        self.AUTOMATIC_CLOSING = automatic_closing
+        self.POLL_MODE = poll_mode
+        self.AD_VOLUME_PERCENTAGE = 10
+        self.TARGET_DEVICE_NAME = target_device_name
+
+
+def measure_latencies(function, iterations):
+    latencies_s = []
+    for i in range(iterations):
+        start_time = time.perf_counter()
+        function(i)
+        latencies_s.append(time.perf_counter() - start_time)
+    return latencies_s
+
+
+def report_latencies(name, latencies_s):
+    latencies_s = sorted(latencies_s)
+    mean_s = sum(latencies_s) / len(latencies_s)
+    p50_s = latencies_s[len(latencies_s) // 2]
+    p99_s = latencies_s[min([len(latencies_s) - 1, int(len(latencies_s) * 0.99)])]
+    print("%-40s mean = %9.3f ms; p50 = %9.3f ms; p99 = %9.3f ms" %
+        (name, mean_s * 1000, p50_s * 1000, p99_s * 1000))
+
+
+# Compare the per-call latency of the in-process ALSA mixer with that of
+#   forking the 'amixer' binary for every call
+def benchmark_mixer(args):
+    log = logger.Logger(None)
+    volume_controller = volume_control.VolumeControl(log)
+    if volume_controller.alsa_mixer == None:
+        print("Error: in-process ALSA mixer is unavailable")
+        exit(1)
+    alsa_mixer = volume_controller.alsa_mixer
+    normal_volume = volume_controller.get_system_volume()
+    # Alternate between two nearby volume levels around the current one
+    volumes = [normal_volume, max([0, normal_volume - 1])]
+    try:
+        for name, mixer in [("in-process", alsa_mixer), ("amixer fork", None)]:
+            volume_controller.alsa_mixer = mixer
+            report_latencies("%s get_system_volume" % name, measure_latencies(
+                lambda i: volume_controller.get_system_volume(), args.iterations))
+            report_latencies("%s set_system_volume" % name, measure_latencies(
+                lambda i: volume_controller.set_system_volume(volumes[i % 2]),
+                args.iterations))
+    finally:
+        volume_controller.alsa_mixer = alsa_mixer
+        volume_controller.set_system_volume(normal_volume)
+
+
+# Measure the per-call latency and the number of sound server requests of a
+#   volume controller with the given sound server client
+def measure_pulse_backend(name, log, client, iterations, request_count=None):
+    volume_controller = volume_control.VolumeControl(log, backend="pulse",
+        stream_client=client)
+    normal_volume = volume_controller.get_system_volume()
+    volumes = [normal_volume, max([0, normal_volume - 1])]
+    try:
+        for operation, function in [
+                ("get_system_volume",
+                    lambda i: volume_controller.get_system_volume()),
+                ("set_system_volume",
+                    lambda i: volume_controller.set_system_volume(volumes[i % 2]))]:
+            start_count = request_count() if request_count != None else None
+            report_latencies("%s %s" % (name, operation),
+                measure_latencies(function, iterations))
+            if start_count != None:
+                print("%-40s %.2f requests per call" % ("", (request_count() -
+                    start_count) / iterations))
+    finally:
+        volume_controller.set_system_volume(normal_volume)
+    return volume_controller
+
+
+# Compare the per-call latency of changing only Spotify's stream through a
+#   persistent sound server connection with that of forking 'amixer', against a
+#   local fake sound server and, if available, the real sound server
+def benchmark_pulse(args):
+    log = logger.Logger(None)
+    server = fake_pulse_server.FakePulseServer()
+    server.start()
+    try:
+        other_index = server.add_stream("firefox", "Firefox")
+        spotify_index = server.add_stream("spotify", "Spotify")
+        client = fake_pulse_server.FakePulseClient(server.socket_path)
+        volume_controller = measure_pulse_backend("fake pulse", log, client,
+            args.iterations, lambda: server.request_count)
+        # Only Spotify's stream is changed, and a new stream of Spotify, e.g.
+        #   after a restart, is resolved on the next call
+        volume_controller.set_system_volume(10)
+        print("Other stream volume after ducking Spotify: %d%%" %
+            round(server.streams[other_index]['volumes'][0] * 100))
+        server.remove_stream(spotify_index)
+        server.add_stream("spotify", "Spotify")
+        volume_controller.set_system_volume(20)
+        print("Volume of the restarted Spotify stream: %d%%; resolved %d times" %
+            (volume_controller.get_system_volume(),
+                volume_controller.stream_mixer.resolve_count))
+        client.close()
+    finally:
+        server.stop()
+    # The real sound server, if 'pulsectl' is installed and a server is running
+    try:
+        client = pulse_mixer.PulsectlClient()
+    except Exception as ex:
+        print("%-40s unavailable: %s" % ("pulsectl", str(ex)))
+    else:
+        try:
+            if len([stream for stream in client.list_streams()
+                    if "spotify" in stream.process_name.lower()]) == 0:
+                print("%-40s unavailable: no Spotify stream" % "pulsectl")
+            else:
+                measure_pulse_backend("pulsectl", log, client, args.iterations)
+        finally:
+            client.close()
+    # The 'amixer' binary, which is forked for every call, of which forking a
+    #   trivial binary is a lower bound
+    report_latencies("fork lower bound (/bin/true)", measure_latencies(
+        lambda i: subprocess.run(["/bin/true"]), args.iterations // 10 + 1))
+    if os.path.exists("/usr/bin/amixer") == False:
+        print("%-40s unavailable: /usr/bin/amixer not found" % "amixer fork")
+        return
+    volume_controller = volume_control.VolumeControl(log, backend="alsa")
+    volume_controller.alsa_mixer = None
+    normal_volume = volume_controller.get_system_volume()
+    volumes = [normal_volume, max([0, normal_volume - 1])]
+    try:
+        report_latencies("amixer fork get_system_volume", measure_latencies(
+            lambda i: volume_controller.get_system_volume(), args.iterations))
+        report_latencies("amixer fork set_system_volume", measure_latencies(
+            lambda i: volume_controller.set_system_volume(volumes[i % 2]),
+            args.iterations))
+    finally:
+        volume_controller.set_system_volume(normal_volume)
+
+
+# Compare the cost of a Spotify liveness check with a full process table scan
+#   against that of the process watcher, for synthetic process tables
+def benchmark_process(args):
+    for table_size in [100, 1000, 10000]:
+        # Use PIDs above the kernel's maximum PID such that no pidfd can be opened
+        #   and the watcher uses its psutil fallback path
+        process_table = [FakeProcess(2 ** 22 + pid, "process-%d" % pid, "sleeping")
+            for pid in range(table_size - 1)]
+        process_table.append(FakeProcess(2 ** 22 + table_size, "spotify", "sleeping"))
+        process_iter = lambda attrs: iter(process_table)
+        report_latencies("full scan (%d processes)" % table_size, measure_latencies(
+            lambda i: process_watcher.ProcessWatcher(
+                process_iter=process_iter).is_alive(), args.iterations))
+        watcher = process_watcher.ProcessWatcher(process_iter=process_iter)
+        report_latencies("watcher (%d processes)" % table_size, measure_latencies(
+            lambda i: watcher.is_alive(), args.iterations))
+
+
+# Run the daemon against a local fake Spotify API server with many accounts,
+#   each playing its own timeline of tracks and ads
+def benchmark_daemon(args):
+    server = fake_spotify_server.FakeSpotifyServer()
+    server.start()
+    session = http_session.HttpSession(pool_maxsize=args.workers)
+    poll_loops = {}
+    volume_controllers = {}
+    for i in range(args.accounts):
+        name = "account-%d" % i
+        server.add_player(name, fake_spotify_server.FakePlayer("device-%d" % i,
+            [("track", random.uniform(6, 10)), ("ad", random.uniform(3, 5))],
+            start_time=time.monotonic() - random.uniform(0, 10)))
+        sp = spotipy.Spotify(auth=name, requests_session=session.session,
+            requests_timeout=session.timeout)
+        sp.prefix = server.prefix
+        poll_scheduler = scheduler.PollScheduler()
+        volume_controllers[name] = FakeVolumeControl()
+        poll_loops[name] = poll_loop.PollLoop(
+            FakeAccountConfig(name, "device-%d" % i), sp, NullLogger(),
+            activity_check.ActivityCheck(NullLogger(), sp,
+                request_counter=poll_scheduler.record_api_call),
+            volume_controllers[name], poll_scheduler, session)
+    # Sample the number of threads while the daemon is running
+    thread_counts = []
+    is_running = True
+    def sample_threads():
+        while is_running == True:
+            thread_counts.append(threading.active_count())
+            time.sleep(0.1)
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+    daemon_obj = daemon.Daemon(NullLogger(), poll_loops, args.workers)
+    start_time = time.monotonic()
+    asyncio.run(daemon_obj.run(args.duration))
+    elapsed_s = time.monotonic() - start_time
+    is_running = False
+    server.stop()
+    # Report the load on the fake server and the responsiveness of the daemon
+    request_count = sum(server.request_counts.values())
+    poll_schedulers = [loop.poll_scheduler for loop in poll_loops.values()]
+    mute_count = sum(poll_scheduler.mute_count for poll_scheduler in poll_schedulers)
+    print("daemon: %s" % daemon_obj.format_statistics())
+    print("server: %d requests in %.1f s (%.1f requests/s): %s" % (request_count,
+        elapsed_s, request_count / elapsed_s, server.request_counts))
+    print("http: %s" % session.format_statistics())
+    print("threads: max = %d" % max(thread_counts))
+    if mute_count > 0:
+        print("mutes: %d; latency mean = %.3f s; max = %.3f s" % (mute_count,
+            sum(poll_scheduler.mute_latency_sum_s
+                for poll_scheduler in poll_schedulers) / mute_count,
+            max(poll_scheduler.mute_latency_max_s
+                for poll_scheduler in poll_schedulers)))
+
+
+# Merge the adjacent intervals of consecutive segments into blocks
+def merge_intervals(intervals):
+    blocks = []
+    for start_time, end_time in intervals:
+        if len(blocks) > 0 and blocks[-1][1] == start_time:
+            blocks[-1] = (blocks[-1][0], end_time)
+        else:
+            blocks.append((start_time, end_time))
+    return blocks
+
+
+# Get the time within the given interval during which the volume was at most the
+#   ad volume, based on the volume writes
+def get_muted_time(writes, initial_volume, ad_volume, start_time, end_time):
+    muted_time_s = 0
+    volume = initial_volume
+    segment_start_time = start_time
+    for write_time, next_volume in writes + [(end_time, None)]:
+        write_time = min([max([write_time, start_time]), end_time])
+        if volume <= ad_volume:
+            muted_time_s += write_time - segment_start_time
+        segment_start_time = write_time
+        if next_volume != None:
+            volume = next_volume
+    return muted_time_s
+
+
+# Run the real polling loop against a scripted timeline on the local fake
+#   Spotify API and report how quickly ads are muted and unmuted
+def benchmark_latency(args):
+    server = fake_spotify_server.FakeSpotifyServer()
+    server.start()
+    player = fake_spotify_server.FakePlayer("harness-device",
+        LATENCY_SCENARIOS[args.scenario], start_time=time.monotonic() + 0.5,
+        is_looping=False)
+    server.add_player("harness", player)
+    metrics_registry = metrics.MetricsRegistry() if args.metrics == True else None
+    session = http_session.HttpSession(
+        connect_timeout_s=spotify_ad_muter.HTTP_CONNECT_TIMEOUT_S,
+        read_timeout_s=spotify_ad_muter.HTTP_READ_TIMEOUT_S,
+        metrics_registry=metrics_registry)
+    sp = spotipy.Spotify(auth="harness", requests_session=session.session,
+        requests_timeout=session.timeout)
+    sp.prefix = server.prefix
+    # Optionally record the responses, such that the run can be replayed offline
+    capture_recorder = None
+    if args.record_file_path != None:
+        capture_recorder = recorder.Recorder(args.record_file_path)
+        sp = recorder.RecordingClient(sp, capture_recorder, "harness",
+            "harness-device")
+    # Use the program's scheduler settings, such that changes to them are measured
+    poll_scheduler = spotify_ad_muter.create_poll_scheduler(
+        metrics_registry=metrics_registry)
+    log = logger.Logger(None) if args.verbose == True else NullLogger()
+    activity_checker = activity_check.ActivityCheck(log, sp,
+        request_counter=poll_scheduler.record_api_call)
+    # Let the loop stop once the timeline has ended, as if Spotify was closed
+    spotify_process = FakeProcess(2 ** 22, "spotify", "sleeping", player.get_end_time())
+    activity_checker.spotify_watcher = process_watcher.ProcessWatcher(
+        process_iter=lambda attrs: iter([spotify_process]
+            if spotify_process.is_running() == True else []))
+    volume_controller = FakeVolumeControl()
+    initial_volume = volume_controller.volume
+    config = FakeAccountConfig("harness", "harness-device", automatic_closing=True,
+        poll_mode=args.poll_mode)
+    # Optionally pre-mute likely ads using an in-memory ad index, which learns
+    #   the ad frequency from the timeline itself
+    index = ad_index.AdIndex() if args.ad_index == True else None
+    loop = poll_loop.PollLoop(config, sp, log, activity_checker, volume_controller,
+        poll_scheduler, session, ad_index=index)
+    start_time = time.monotonic()
+    if args.run_mode == "async":
+        asyncio.run(loop.run_async())
+    else:
+        loop.run()
+    elapsed_s = time.monotonic() - start_time
+    server.stop()
+    if capture_recorder != None:
+        capture_recorder.close()
+    # Report the latencies per block of consecutive ads
+    writes = volume_controller.writes
+    ad_volume = config.AD_VOLUME_PERCENTAGE
+    missed_ad_s = 0
+    for block_start_time, block_end_time in merge_intervals(player.get_intervals("ad")):
+        mute_times = [write_time for write_time, volume in writes
+            if block_start_time <= write_time < block_end_time and volume <= ad_volume]
+        unmute_times = [write_time for write_time, volume in writes
+            if write_time >= block_end_time and volume > ad_volume]
+        block_missed_s = block_end_time - block_start_time - get_muted_time(writes,
+            initial_volume, ad_volume, block_start_time, block_end_time)
+        missed_ad_s += block_missed_s
+        print("ad block at %6.1f s (%4.1f s): time-to-mute = %s; " % (
+            block_start_time - player.start_time, block_end_time - block_start_time,
+            "%.2f s" % (mute_times[0] - block_start_time) if len(mute_times) > 0
+                else "never") +
+            "time-to-unmute = %s; missed = %.2f s" % (
+            "%.2f s" % (unmute_times[0] - block_end_time) if len(unmute_times) > 0
+                else "never", block_missed_s))
+    request_count = sum(server.request_counts.values())
+    print("missed ad seconds = %.2f s" % missed_ad_s)
+    print("api calls = %d; api calls per hour = %.0f: %s" % (request_count,
+        request_count * 3600 / elapsed_s, server.request_counts))
+    print("scheduler: %s" % poll_scheduler.format_statistics())
+    if metrics_registry != None:
+        print(metrics_registry.format_text(), end="")
+
+
+# Write a capture of the scripted timeline played in a loop for the given
+#   number of hours, sampled at a fixed period as if recorded by the polling loop
+def write_synthetic_capture(capture_file_path, scenario, duration_h, sample_period_s,
+        start_timestamp):
+    player = fake_spotify_server.FakePlayer("harness-device", scenario,
+        start_time=0)
+    capture_recorder = recorder.Recorder(capture_file_path)
+    capture_recorder.write("harness", recorder.KIND_START, "harness-device",
+        start_timestamp)
+    for i in range(int(duration_h * 3600 / sample_period_s) + 1):
+        now = i * sample_period_s
+        segment_type = player.get_segment(now)[1]
+        if segment_type == "rate_limit":
+            body = {'error': 429, 'retry_after': "1"}
+        elif segment_type == "timeout":
+            body = {'error': 503}
+        else:
+            body = recorder.compact_playback_state(player.get_playback_state(now))
+        capture_recorder.write("harness", recorder.KIND_PLAYBACK, body,
+            start_timestamp + now)
+    capture_recorder.close()
+
+
+# Replay a synthetic capture of many hours against the polling loop in virtual
+#   time, and compare the program's polling periods with a relaxed strategy
+def benchmark_replay(args):
+    capture_file_path = os.path.join(tempfile.mkdtemp(), "capture.jsonl")
+    write_synthetic_capture(capture_file_path, LATENCY_SCENARIOS[args.scenario],
+        args.hours, args.sample_period, time.time() - args.hours * 3600)
+    start_time = time.perf_counter()
+    timelines = replay.load_timelines(capture_file_path)
+    load_time_s = time.perf_counter() - start_time
+    print("capture: %.1f h; %d kB; %d segments; loaded in %.2f s" % (args.hours,
+        os.path.getsize(capture_file_path) / 1024,
+        sum(len(timeline.segments) for timeline in timelines), load_time_s))
+    results = [replay.replay_timelines(timelines, "defaults"),
+        replay.replay_timelines(timelines, "defaults + ad index",
+            is_ad_index_enabled=True),
+        replay.replay_timelines(timelines, "relaxed probing",
+            program_config.parse_config_settings(
+                {'probe_lead_s': 0.5, 'sleep_period_probe_s': 1}))]
+    replay.print_results(results)
+    for result in results:
+        print("%-24s replayed %.1f h in %.2f s (%.0fx real time)" % (result.name,
+            result.duration_s / 3600, result.replay_time_s,
+            result.duration_s / max([1e-9, result.replay_time_s])))
+    os.remove(capture_file_path)
+
+
+# Parse the output of '-X importtime' into the cumulative import time in
+#   microseconds per top-level import
+def parse_import_times(output):
+    import_times_us = {}
+    for line in output.splitlines():
+        if line.startswith("import time:") == False:
+            continue
+        fields = line[len("import time:"):].split("|")
+        # Skip the header and imports nested in other imports
+        if len(fields) != 3 or fields[1].strip().isdigit() == False or \
+                fields[2].startswith("  "):
+            continue
+        import_times_us[fields[2].strip()] = int(fields[1])
+    return import_times_us
+
+
+def run_startup(command, runs):
+    latencies_s = []
+    for i in range(runs):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime"] + command,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        latencies_s.append(time.perf_counter() - start_time)
+    return latencies_s, parse_import_times(result.stderr)
+
+
+def report_import_times(name, import_times_us):
+    slowest = sorted(import_times_us.items(), key=lambda item: -item[1])[0:5]
+    print("%-40s imports = %7.1f ms; slowest: %s" % (name,
+        sum(import_times_us.values()) / 1000, ", ".join("%s %.1f ms" %
+            (module, time_us / 1000) for module, time_us in slowest)))
+
+
+# Measure the memory allocated while handling a steady-state playback state, of
+#   a track which keeps playing, as the peak of the traced memory per poll
+def benchmark_allocations(args):
+    config = FakeAccountConfig("benchmark", "benchmark-device")
+    loop = poll_loop.PollLoop(config, None, NullLogger(), None, FakeVolumeControl(),
+        spotify_ad_muter.create_poll_scheduler())
+    # Create the samples up front, such that only the polling loop is measured
+    samples = [{
+        'currently_playing_type': "track",
+        'is_playing': True,
+        'progress_ms': 10000 + i * 10,
+        'timestamp': 0,
+        'item': {'id': "track-0", 'type': "track", 'duration_ms': 3600000}}
+        for i in range(args.iterations + 1)]
+    loop.handle_playback_state(samples[0])
+    allocated_sizes = [0] * args.iterations
+    tracemalloc.start()
+    for i in range(args.iterations):
+        current_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        loop.handle_playback_state(samples[i + 1])
+        allocated_sizes[i] = tracemalloc.get_traced_memory()[1] - current_size
+    retained_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    allocated_sizes.sort()
+    print("allocated per poll: mean = %.0f B; p50 = %d B; max = %d B" % (
+        sum(allocated_sizes) / len(allocated_sizes),
+        allocated_sizes[len(allocated_sizes) // 2], allocated_sizes[-1]))
+    print("retained after %d polls: %d B" % (len(allocated_sizes), retained_size))
+
+
+# Measure the time from writing the configuration file until the reloaded
+#   configuration is applied, and the cost of the reload itself, alternating
+#   between editing the file in place and replacing it
+def benchmark_reload(args):
+    directory = tempfile.mkdtemp()
+    config_file_path = os.path.join(directory, "config.json")
+    with open(config_file_path, "w") as config_file:
+        config_file.write("{}")
+    config = program_config.ProgramConfig(False, 10, None,
+        os.path.join(directory, ".cache"), os.path.join(directory, "log"),
+        config_file_path=config_file_path)
+    poll_scheduler = spotify_ad_muter.create_poll_scheduler(config)
+    reload_times_s = []
+    reloaded_event = threading.Event()
+    def on_change():
+        reload_times_s.append(spotify_ad_muter.reload_config(config,
+            [poll_scheduler], NullLogger()))
+        reloaded_event.set()
+    watcher = config_watcher.ConfigWatcher(config_file_path, on_change,
+        poll_period_s=args.poll_period, is_inotify_enabled=not args.no_inotify)
+    watcher.start()
+    latencies_s = []
+    for i in range(args.runs):
+        reloaded_event.clear()
+        probe_lead_s = 1 + (i + 1) / 1000
+        start_time = time.perf_counter()
+        if i % 2 == 0:
+            with open(config_file_path, "w") as config_file:
+                config_file.write("{\"probe_lead_s\": %s}" % probe_lead_s)
+        else:
+            with open(config_file_path + ".tmp", "w") as config_file:
+                config_file.write("{\"probe_lead_s\": %s}" % probe_lead_s)
+            os.replace(config_file_path + ".tmp", config_file_path)
+        if reloaded_event.wait(args.poll_period * 2 + 1) == False or \
+                poll_scheduler.probe_lead_s != probe_lead_s:
+            print("Error: change %d was not applied" % (i + 1))
+            exit(1)
+        latencies_s.append(time.perf_counter() - start_time)
+    print("watching with %s" % ("inotify" if watcher.is_using_inotify() == True
+        else "modification time polling"))
+    watcher.stop()
+    report_latencies("write to applied", latencies_s)
+    report_latencies("reload", reload_times_s)
+
+
+# Compare the cost of updating metrics when they are enabled against when they
+#   are disabled, and the cost of formatting them for a scrape
+def benchmark_metrics(args):
+    for name, registry in [("disabled", metrics.NullRegistry()),
+            ("enabled", metrics.MetricsRegistry())]:
+        counter = registry.counter("polls_total", "Polls", ("state",))
+        histogram = registry.histogram("api_request_seconds", "Latency",
+            ("endpoint", "status"))
+        report_latencies("%s counter inc" % name, measure_latencies(
+            lambda i: counter.inc(("track",)), args.iterations))
+        report_latencies("%s histogram observe" % name, measure_latencies(
+            lambda i: histogram.observe(0.05, ("/v1/me/player", 200)),
+            args.iterations))
+        report_latencies("%s format" % name, measure_latencies(
+            lambda i: registry.format_text(), args.iterations))
+
+
+# Program run by each concurrent launcher of the lock stress test, which tries
+#   to take the lock at a common start time and, if it wins, holds it until its
+#   standard input is closed
+LOCK_LAUNCHER = """
+import sys, time, instance_lock
+lock = instance_lock.InstanceLock(sys.stderr, sys.argv[1])
+time.sleep(max([0, float(sys.argv[2]) - time.time()]))
+print("locked" if lock.lock() == True else "busy", flush=True)
+sys.stdin.read()
+"""
+
+
+def start_lock_launcher(lock_file_path, start_time):
+    return subprocess.Popen([sys.executable, "-c", LOCK_LAUNCHER, lock_file_path,
+        str(start_time)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+# Spawn many concurrent launchers which race for the instance lock and check
+#   that exactly one of them wins, and that the lock of a killed instance is
+#   released right away
+def benchmark_lock(args):
+    lock_file_path = os.path.join(tempfile.mkdtemp(), "spotify-ad-muter.lock")
+    lock = instance_lock.InstanceLock(NullLogger(), lock_file_path)
+    report_latencies("lock and unlock", measure_latencies(
+        lambda i: (lock.lock(), lock.unlock()), args.iterations))
+    failure_count = 0
+    for i in range(args.rounds):
+        # Give all launchers time to start before racing for the lock
+        start_time = time.time() + 0.5 + 0.02 * args.launchers
+        launchers = [start_lock_launcher(lock_file_path, start_time)
+            for j in range(args.launchers)]
+        # Let the winner hold the lock until every launcher has tried to take it
+        results = [launcher.stdout.readline().strip() for launcher in launchers]
+        for launcher in launchers:
+            launcher.communicate()
+        locked_count = results.count("locked")
+        if locked_count != 1:
+            failure_count += 1
+        print("round %d: %d of %d launchers took the lock" %
+            (i + 1, locked_count, args.launchers))
+    # Kill an instance holding the lock, without any cleanup, after which a new
+    #   instance must be able to take it
+    holder = start_lock_launcher(lock_file_path, 0)
+    is_holder_locked = holder.stdout.readline().strip() == "locked"
+    holder.kill()
+    holder.wait()
+    launcher = start_lock_launcher(lock_file_path, 0)
+    is_relocked = launcher.communicate()[0].strip() == "locked"
+    if is_holder_locked == False or is_relocked == False:
+        failure_count += 1
+    print("lock released after kill: %s" % ("yes" if is_relocked == True else "no"))
+    if failure_count > 0:
+        print("Error: %d lock stress test checks failed" % failure_count)
+        exit(1)
+
+
+# Measure the cold-start time of the program for a duplicate instance, which
+#   must exit right after the lock check, and the imports and authentication
+#   manager set-up of a normal start
+def benchmark_startup(args):
+    directory = tempfile.mkdtemp()
+    arguments = ["-p", os.path.join(directory, ".cache"),
+        "-l", os.path.join(directory, "spotify-ad-muter.log")]
+    config = program_config.ProgramConfig(False, 10, None,
+        os.path.join(directory, ".cache"), os.path.join(directory, "log"))
+    # Hold the lock with this process, unless another instance already does
+    lock = instance_lock.InstanceLock(NullLogger(), config.LOCK_FILE_PATH)
+    lock.lock()
+    try:
+        latencies_s, import_times_us = run_startup(
+            ["spotify_ad_muter.py"] + arguments, args.runs)
+    finally:
+        lock.unlock()
+    report_latencies("duplicate instance", latencies_s)
+    report_import_times("duplicate instance", import_times_us)
+    # Import everything a normal start imports and create the authentication
+    #   manager, without starting to poll the Spotify API
+    latencies_s, import_times_us = run_startup(["-c",
+        "import spotify_ad_muter, asyncio, spotipy, activity_check, ad_index, " +
+        "daemon, http_session, poll_loop, volume_control, program_config; " +
+        "program_config.create_client_credential_manager('%s', '%s')" %
+        (config.SCOPE, config.AUTH_CACHE_PATH)], args.runs)
+    report_latencies("normal start", latencies_s)
+    report_import_times("normal start", import_times_us)
+
+
+if __name__ == "__main__":
+    # Specify the format of the command line arguments
+    arg_parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Microbenchmarks for the components of Spotify Ad Muter.")
+    arg_parser.add_argument('-n', '--iterations',
+        default=200, type=int,
+        help="Number of iterations per measurement",
+        dest='iterations')
+    subparsers = arg_parser.add_subparsers(required=True, dest='benchmark')
+    subparsers.add_parser('mixer',
+        help="Per-call latency of the ALSA mixer against forking 'amixer'"
+        ).set_defaults(function=benchmark_mixer)
+    subparsers.add_parser('pulse',
+        help="Per-call latency of changing Spotify's stream on the sound " +
+            "server against forking 'amixer'"
+        ).set_defaults(function=benchmark_pulse)
+    subparsers.add_parser('process',
+        help="Spotify liveness check against synthetic process table sizes"
+        ).set_defaults(function=benchmark_process)
+    daemon_parser = subparsers.add_parser('daemon',
+        help="Load test of the daemon mode against a local fake Spotify API")
+    daemon_parser.add_argument('--accounts', default=50, type=int,
+        help="Number of accounts to watch", dest='accounts')
+    daemon_parser.add_argument('--workers', default=8, type=int,
+        help="Number of worker threads of the daemon", dest='workers')
+    daemon_parser.add_argument('--duration', default=30, type=float,
+        help="Duration of the load test in seconds", dest='duration')
+    daemon_parser.set_defaults(function=benchmark_daemon)
+    latency_parser = subparsers.add_parser('latency',
+        help="Mute and unmute latency of the polling loop against a scripted " +
+            "timeline on a local fake Spotify API")
+    latency_parser.add_argument('--scenario', default="full",
+        choices=sorted(LATENCY_SCENARIOS.keys()),
+        help="Scripted timeline of tracks, ads, pauses and errors", dest='scenario')
+    latency_parser.add_argument('--poll_mode', default="single",
+        choices=["single", "dual"], help="Polling mode", dest='poll_mode')
+    latency_parser.add_argument('--run_mode', default="async",
+        choices=["async", "sync"], help="Run mode", dest='run_mode')
+    latency_parser.add_argument('--ad_index', action='store_true',
+        help="Pre-mute likely ads using an ad index learned during the run")
+    latency_parser.add_argument('--metrics', action='store_true',
+        help="Print the collected metrics after the run", dest='metrics')
+    latency_parser.add_argument('--record', default=None,
+        help="File path of a capture file to which to append the responses",
+        dest='record_file_path')
+    latency_parser.add_argument('--verbose', action='store_true',
+        help="Print the log output of the polling loop", dest='verbose')
+    latency_parser.set_defaults(function=benchmark_latency)
+    reload_parser = subparsers.add_parser('reload',
+        help="Latency and cost of reloading the configuration file")
+    reload_parser.add_argument('--runs', default=50, type=int,
+        help="Number of changes to the configuration file", dest='runs')
+    reload_parser.add_argument('--poll_period', default=2, type=float,
+        help="Period of the modification time checks in seconds",
+        dest='poll_period')
+    reload_parser.add_argument('--no_inotify', action='store_true',
+        help="Only check the modification time, without inotify",
+        dest='no_inotify')
+    reload_parser.set_defaults(function=benchmark_reload)
+    replay_parser = subparsers.add_parser('replay',
+        help="Speed of replaying a synthetic capture in virtual time")
+    replay_parser.add_argument('--scenario', default="full",
+        choices=sorted(LATENCY_SCENARIOS.keys()),
+        help="Scripted timeline which is played in a loop", dest='scenario')
+    replay_parser.add_argument('--hours', default=10, type=float,
+        help="Duration of the capture in hours", dest='hours')
+    replay_parser.add_argument('--sample_period', default=1, type=float,
+        help="Period at which the capture is sampled in seconds",
+        dest='sample_period')
+    replay_parser.set_defaults(function=benchmark_replay)
+    subparsers.add_parser('allocations',
+        help="Memory allocated per steady-state poll of the polling loop"
+        ).set_defaults(function=benchmark_allocations)
+    subparsers.add_parser('metrics',
+        help="Cost of updating and formatting metrics, enabled and disabled"
+        ).set_defaults(function=benchmark_metrics)
+    lock_parser = subparsers.add_parser('lock',
+        help="Stress test of the instance lock with concurrent launchers")
+    lock_parser.add_argument('--launchers', default=32, type=int,
+        help="Number of concurrent launchers per round", dest='launchers')
+    lock_parser.add_argument('--rounds', default=5, type=int,
+        help="Number of rounds of concurrent launchers", dest='rounds')
+    lock_parser.set_defaults(function=benchmark_lock)
+    startup_parser = subparsers.add_parser('startup',
+        help="Cold-start time of a duplicate instance and of a normal start")
+    startup_parser.add_argument('--runs', default=10, type=int,
+        help="Number of program starts per measurement", dest='runs')
+    startup_parser.set_defaults(function=benchmark_startup)
+    # Parse the command line arguments and run the selected benchmark
+    args = arg_parser.parse_args()
+    args.function(args)
@@ -0,0 +1,21 @@
+import time
+
+
+# Clock of the polling loop, which reads the real time and suspends the calling
+#   thread. It is replaced by a virtual clock when replaying a recorded capture,
+#   see 'replay'
+class Clock(object):
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, period_s):
+        time.sleep(period_s)
+
+    # Wait until the event is set or the period has passed, and return whether
+    #   the event was set
+    def wait(self, event, period_s):
+        return event.wait(period_s)
@@ -0,0 +1,122 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+
+# Watcher which calls a function whenever a file is changed, notified by the
+#   kernel through inotify on Linux, or otherwise by polling the file's
+#   modification time
+class ConfigWatcher(object):
+
+    # inotify flags, see 'inotify(7)'
+    __IN_MODIFY = 0x00000002
+    __IN_CLOSE_WRITE = 0x00000008
+    __IN_MOVED_TO = 0x00000080
+    __IN_CREATE = 0x00000100
+    __IN_NONBLOCK = 0o4000
+    __IN_CLOEXEC = 0o2000000
+    # Size of the fixed part of an inotify event: wd, mask, cookie and len
+    __EVENT_SIZE = struct.calcsize("iIII")
+
+    def __init__(self, file_path, on_change, poll_period_s=2, settle_period_s=0.05,
+            is_inotify_enabled=True):
+        self.file_path = os.path.abspath(file_path)
+        self.on_change = on_change
+        # Period at which the modification time is checked without inotify
+        self.poll_period_s = poll_period_s
+        # Time to wait after a change for the rest of an editor's writes
+        self.settle_period_s = settle_period_s
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.fd = None
+        self.change_count = 0
+        # Watch the directory rather than the file itself, as editors often
+        #   replace the file with a new one instead of writing to it
+        if is_inotify_enabled == True:
+            try:
+                self.fd = self.__open_inotify(os.path.dirname(self.file_path))
+            except Exception:
+                self.fd = None
+        self.file_state = self.__get_file_state()
+
+    def __open_inotify(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(self.__IN_NONBLOCK | self.__IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, directory.encode(), self.__IN_MODIFY |
+                self.__IN_CLOSE_WRITE | self.__IN_MOVED_TO | self.__IN_CREATE) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+        return fd
+
+    def is_using_inotify(self):
+        return self.fd != None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread != None:
+            self.thread.join()
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __get_file_state(self):
+        try:
+            stat = os.stat(self.file_path)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            return None
+
+    # Read all pending inotify events and return if any concerns the file
+    def __read_events(self):
+        is_changed = False
+        file_name = os.path.basename(self.file_path).encode()
+        while True:
+            try:
+                buffer = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return is_changed
+            offset = 0
+            while offset + self.__EVENT_SIZE <= len(buffer):
+                _, _, _, name_length = struct.unpack_from("iIII", buffer, offset)
+                offset += self.__EVENT_SIZE
+                name = buffer[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if name == file_name:
+                    is_changed = True
+
+    # Wait until the file may have changed, or until the next periodic check
+    def __wait_for_change(self):
+        if self.fd == None:
+            self.stop_event.wait(self.poll_period_s)
+            return
+        readable, _, _ = select.select([self.fd], [], [], self.poll_period_s)
+        if len(readable) == 0 or self.__read_events() == False:
+            return
+        # Let an editor finish writing the file, and drop the events of those
+        #   writes, before reading it
+        self.stop_event.wait(self.settle_period_s)
+        self.__read_events()
+
+    def __run(self):
+        while self.stop_event.is_set() == False:
+            self.__wait_for_change()
+            # Also check the file after each periodic wake-up, such that a missed
+            #   event only delays a reload, and only report a change if the
+            #   file's contents may have changed
+            file_state = self.__get_file_state()
+            if file_state == self.file_state or file_state == None or \
+                    self.stop_event.is_set() == True:
+                continue
+            self.file_state = file_state
+            self.change_count += 1
+            self.on_change()
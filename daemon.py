@@ -0,0 +1,105 @@
+import asyncio
+import concurrent.futures
+import heapq
+import time
+
+
+class Daemon(object):
+
+    def __init__(self, log, poll_loops, worker_count=8):
+        self.log = log
+        # Polling loops of the watched accounts, indexed by account name
+        self.poll_loops = poll_loops
+        # All blocking API requests and volume changes share a bounded pool of
+        #   worker threads, instead of using one thread per account
+        self.worker_count = worker_count
+        # Heap of the monotonic times at which each account is polled next
+        self.wake_heap = []
+        self.wake_event = None
+        # Statistics for reporting the daemon's load
+        self.poll_count = 0
+        # Running totals of how late polls are dispatched, which are kept
+        #   instead of every sample as the daemon runs indefinitely
+        self.dispatch_count = 0
+        self.dispatch_lateness_sum_s = 0.0
+        self.dispatch_lateness_max_s = 0.0
+
+    async def __poll(self, name, wake_time):
+        lateness_s = time.monotonic() - wake_time
+        self.dispatch_count += 1
+        self.dispatch_lateness_sum_s += lateness_s
+        self.dispatch_lateness_max_s = max([self.dispatch_lateness_max_s,
+            lateness_s])
+        loop = self.poll_loops[name]
+        try:
+            sleep_period_s = await loop.poll_async()
+        except Exception as ex:
+            loop.log.write("Error: unexpected error occurred: %s" % str(ex))
+            sleep_period_s = loop.poll_scheduler.next_error_sleep_period(ex)
+        self.poll_count += 1
+        # Schedule the next poll of this account and wake up the dispatcher
+        if sleep_period_s != None:
+            heapq.heappush(self.wake_heap,
+                (time.monotonic() + sleep_period_s, name))
+            self.wake_event.set()
+
+    # Poll all accounts from a single dispatcher, which waits for the earliest
+    #   scheduled poll, until the given duration has passed or forever
+    async def run(self, duration_s=None):
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.worker_count)
+        asyncio.get_running_loop().set_default_executor(executor)
+        for loop in self.poll_loops.values():
+            loop.volume_executor = executor
+        self.wake_event = asyncio.Event()
+        start_time = time.monotonic()
+        self.wake_heap = [(start_time, name) for name in self.poll_loops]
+        heapq.heapify(self.wake_heap)
+        tasks = set()
+        try:
+            while duration_s == None or time.monotonic() - start_time < duration_s:
+                timeout_s = None
+                if duration_s != None:
+                    timeout_s = start_time + duration_s - time.monotonic()
+                if len(self.wake_heap) > 0:
+                    wake_time = self.wake_heap[0][0]
+                    if wake_time <= time.monotonic():
+                        # Dispatch the poll of the account which is due
+                        _, name = heapq.heappop(self.wake_heap)
+                        task = asyncio.ensure_future(self.__poll(name, wake_time))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        continue
+                    timeout_s = wake_time - time.monotonic() if timeout_s == None \
+                        else min([timeout_s, wake_time - time.monotonic()])
+                # Wait for the next scheduled poll or for a poll to be rescheduled
+                self.wake_event.clear()
+                try:
+                    await asyncio.wait_for(self.wake_event.wait(), timeout_s)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Return the volume of every account to normal
+            for name, loop in self.poll_loops.items():
+                await loop.stop_async()
+                self.log.write("Account '%s' polling statistics: %s" %
+                    (name, loop.poll_scheduler.format_statistics()))
+            executor.shutdown(wait=False)
+
+    def get_statistics(self):
+        statistics = {
+            'accounts': len(self.poll_loops),
+            'polls': self.poll_count}
+        if self.dispatch_count > 0:
+            statistics['dispatch_lateness_mean_s'] = \
+                self.dispatch_lateness_sum_s / self.dispatch_count
+            statistics['dispatch_lateness_max_s'] = self.dispatch_lateness_max_s
+        return statistics
+
+    def format_statistics(self):
+        statistics = self.get_statistics()
+        return ", ".join(
+            ("%s = %.4f" if isinstance(value, float) else "%s = %d") %
+            (name, value) for name, value in statistics.items())
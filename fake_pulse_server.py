@@ -0,0 +1,131 @@
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+# Import user modules
+import pulse_mixer
+
+
+# Fake PulseAudio/PipeWire sound server on a local Unix socket, which answers
+#   requests for its streams' volumes with one JSON line per request
+class FakePulseServer(object):
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path
+        if socket_path == None:
+            self.socket_path = os.path.join(tempfile.mkdtemp(), "pulse-native")
+        # Streams indexed by their sink input index, of which the index is never
+        #   reused, like the sound server does
+        self.streams = {}
+        self.next_index = 0
+        self.request_count = 0
+        # Open client connections, which are closed when the server stops, like
+        #   the sound server's connections are when it restarts
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path,
+            self.__create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def add_stream(self, process_name, application_name, channel_count=2,
+            volume=1.0):
+        with self.lock:
+            index = self.next_index
+            self.next_index += 1
+            self.streams[index] = {
+                'process_name': process_name,
+                'application_name': application_name,
+                'volumes': [volume] * channel_count}
+        return index
+
+    def remove_stream(self, index):
+        with self.lock:
+            del self.streams[index]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.connections.clear()
+        os.remove(self.socket_path)
+
+    # Answer a request and return the response, or an error if a stream is gone
+    def handle_request(self, request):
+        with self.lock:
+            self.request_count += 1
+            if request['method'] == "list":
+                return {'streams': [[index, stream['process_name'],
+                    stream['application_name'], len(stream['volumes'])]
+                    for index, stream in self.streams.items()]}
+            stream = self.streams.get(request['index'])
+            if stream == None:
+                return {'error': "No such entity"}
+            if request['method'] == "get":
+                return {'volumes': stream['volumes']}
+            if request['method'] == "set":
+                stream['volumes'] = request['volumes']
+                return {}
+            return {'error': "Unknown method"}
+
+    def __create_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                with server.lock:
+                    server.connections.add(self.connection)
+                for line in self.rfile:
+                    response = server.handle_request(json.loads(line))
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+
+            def finish(self):
+                with server.lock:
+                    server.connections.discard(self.connection)
+                socketserver.StreamRequestHandler.finish(self)
+
+        return Handler
+
+
+# Client of the fake sound server, with the interface of 'PulsectlClient', which
+#   keeps one connection open and makes a single round trip per request
+class FakePulseClient(object):
+
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile("rwb")
+
+    def __request(self, request):
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if 'error' in response:
+            raise OSError(response['error'])
+        return response
+
+    def list_streams(self):
+        return [pulse_mixer.PulseStream(*stream)
+            for stream in self.__request({'method': "list"})['streams']]
+
+    def get_stream_volume(self, index):
+        return self.__request({'method': "get", 'index': index})['volumes']
+
+    def set_stream_volume(self, index, channel_volumes):
+        self.__request({'method': "set", 'index': index, 'volumes': channel_volumes})
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
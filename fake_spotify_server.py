@@ -0,0 +1,187 @@
+import http.server
+import json
+import math
+import threading
+import time
+
+
+class FakePlayer(object):
+
+    # Progress and duration reported for a paused track
+    __PAUSED_PROGRESS_MS = 60000
+    __PAUSED_DURATION_MS = 180000
+
+    def __init__(self, device_name, timeline, start_time=None, is_looping=True,
+            timeout_delay_s=15):
+        self.device = {
+            'id': "device-%s" % device_name,
+            'name': device_name,
+            'is_active': True,
+            'type': "Computer"}
+        # Timeline of (type, duration) segments which is played once or in a loop,
+        #   where type is one of:
+        #   > 'track', 'episode' or 'ad': the item is playing
+        #   > 'pause': a track is paused
+        #   > 'idle': nothing is playing
+        #   > 'rate_limit': all requests are answered with HTTP status 429
+        #   > 'timeout': all requests are answered only after a long delay
+        self.timeline = timeline
+        self.timeline_duration_s = sum(duration_s for _, duration_s in timeline)
+        self.is_looping = is_looping
+        self.timeout_delay_s = timeout_delay_s
+        self.start_time = start_time
+        if start_time == None:
+            self.start_time = time.monotonic()
+
+    # Find the segment playing at the given time and the progress within it, or
+    #   None if the timeline has not started yet or if a timeline which is played
+    #   once has ended
+    def get_segment(self, now):
+        position_s = now - self.start_time
+        if position_s < 0:
+            return None
+        if self.is_looping == True:
+            position_s %= self.timeline_duration_s
+        elif position_s >= self.timeline_duration_s:
+            return None
+        for index, (segment_type, duration_s) in enumerate(self.timeline):
+            if position_s < duration_s:
+                return index, segment_type, duration_s, position_s
+            position_s -= duration_s
+        return index, segment_type, duration_s, duration_s
+
+    # Get the start and end times of all segments of the given type, for a
+    #   timeline which is played once
+    def get_intervals(self, segment_type):
+        intervals = []
+        segment_start_time = self.start_time
+        for timeline_type, duration_s in self.timeline:
+            if timeline_type == segment_type:
+                intervals.append((segment_start_time, segment_start_time + duration_s))
+            segment_start_time += duration_s
+        return intervals
+
+    def get_end_time(self):
+        return self.start_time + self.timeline_duration_s
+
+    def get_playback_state(self, now):
+        segment = self.get_segment(now)
+        if segment == None or segment[1] == "idle":
+            return None
+        index, segment_type, duration_s, progress_s = segment
+        cycle = int((now - self.start_time) // self.timeline_duration_s)
+        if segment_type == "pause":
+            return {
+                'device': self.device,
+                'currently_playing_type': "track",
+                'is_playing': False,
+                'progress_ms': self.__PAUSED_PROGRESS_MS,
+                'timestamp': int(time.time() * 1000),
+                'item': {
+                    'id': "track-%d-%d" % (cycle, index),
+                    'type': "track",
+                    'duration_ms': self.__PAUSED_DURATION_MS}}
+        return {
+            'device': self.device,
+            'currently_playing_type': segment_type,
+            'is_playing': True,
+            'progress_ms': int(progress_s * 1000),
+            'timestamp': int(time.time() * 1000),
+            'item': {
+                'id': "%s-%d-%d" % (segment_type, cycle, index),
+                'type': segment_type,
+                'duration_ms': int(duration_s * 1000)}}
+
+
+class FakeSpotifyServer(object):
+
+    def __init__(self, host="127.0.0.1", port=0):
+        # Players indexed by the bearer token which identifies their account
+        self.players = {}
+        # Number of requests served per endpoint
+        self.request_counts = {}
+        self.lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer((host, port),
+            self.__create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def prefix(self):
+        return "http://%s:%d/v1/" % self.server.server_address[0:2]
+
+    def add_player(self, token, player):
+        self.players[token] = player
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __count_request(self, path):
+        with self.lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def __error(self, status, message, headers=None):
+        return status, {'error': {'status': status, 'message': message}}, headers
+
+    # Answer a request and return its HTTP status, JSON payload and headers
+    def handle_request(self, path, token):
+        self.__count_request(path)
+        player = self.players.get(token)
+        if player == None:
+            return self.__error(401, "Invalid access token")
+        now = time.monotonic()
+        segment = player.get_segment(now)
+        if segment != None and segment[1] == "rate_limit":
+            _, _, duration_s, progress_s = segment
+            return self.__error(429, "API rate limit exceeded",
+                {'Retry-After': str(max([1, math.ceil(duration_s - progress_s)]))})
+        if segment != None and segment[1] == "timeout":
+            time.sleep(player.timeout_delay_s)
+            return self.__error(503, "Service unavailable")
+        if path == "/v1/me/player/devices":
+            return 200, {'devices': [player.device]}, None
+        if path == "/v1/me/player" or path == "/v1/me/player/currently-playing":
+            playback_state = player.get_playback_state(now)
+            if playback_state == None:
+                return 204, None, None
+            if path == "/v1/me/player/currently-playing":
+                del playback_state['device']
+            return 200, playback_state, None
+        return self.__error(404, "Service not found")
+
+    def __create_handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            # Keep connections alive, like the Spotify API does
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                token = self.headers.get('Authorization', "")[len("Bearer "):]
+                status, payload, headers = server.handle_request(
+                    self.path.split('?')[0], token)
+                body = b""
+                if payload != None:
+                    body = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in (headers or {}).items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Type', "application/json")
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                # The client may have closed the connection after a timeout
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
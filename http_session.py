@@ -0,0 +1,64 @@
+import requests
+import requests.adapters
+import urllib.parse
+
+
+class HttpSession(object):
+
+    def __init__(self,
+            pool_connections=2,
+            pool_maxsize=4,
+            connect_timeout_s=3.05,
+            read_timeout_s=6,
+            metrics_registry=None):
+        # Create a session which keeps connections to the Spotify API alive in a
+        #   pool, such that consecutive polls reuse the same TLS connection
+        self.session = requests.Session()
+        self.session.headers['Connection'] = "keep-alive"
+        # Retries are not done by the connection pool, but by the poll scheduler's
+        #   backoff policy, which keeps the timeouts separate from the retries
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=0)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        # Timeouts for establishing a connection and for reading a response
+        self.timeout = (connect_timeout_s, read_timeout_s)
+        # Measure the latency of every response per endpoint, if enabled
+        if metrics_registry != None:
+            self.request_histogram = metrics_registry.histogram(
+                "api_request_seconds", "Latency of Spotify API requests",
+                ("endpoint", "status"))
+            self.session.hooks['response'].append(self.__observe_response)
+
+    def __observe_response(self, response, *args, **kwargs):
+        self.request_histogram.observe(response.elapsed.total_seconds(),
+            (urllib.parse.urlsplit(response.url).path, response.status_code))
+
+    def close(self):
+        self.session.close()
+
+    def get_statistics(self):
+        # Sum the number of connections opened and requests made over all pools
+        connection_count = 0
+        request_count = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool != None:
+                connection_count += pool.num_connections
+                request_count += pool.num_requests
+        connection_reuse = 0.0
+        if request_count > 0:
+            connection_reuse = 1 - connection_count / request_count
+        return {
+            'http_requests': request_count,
+            'http_connections': connection_count,
+            'http_connection_reuse': connection_reuse}
+
+    def format_statistics(self):
+        statistics = self.get_statistics()
+        return ", ".join(
+            ("%s = %.2f" if isinstance(value, float) else "%s = %d") %
+            (name, value) for name, value in statistics.items())
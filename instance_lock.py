@@ -0,0 +1,55 @@
+import os
+import platform
+if platform.system().lower() == "windows":
+    import msvcrt
+else:
+    import fcntl
+
+
+# Lock file which prevents more than one instance of this program from running,
+#   kept free of heavy imports such that a duplicate instance exits quickly
+class InstanceLock(object):
+
+    def __init__(self, logger, lock_file_path):
+        self.logger = logger
+        self.lock_file_path = lock_file_path
+        self.lock_file = None
+
+    # Take an advisory lock on the lock file, which the kernel releases when this
+    #   process exits in any way, such that a stale lock file never blocks a new
+    #   instance and no cleanup on exit is needed
+    def lock(self):
+        # Open the lock file without truncating it, as another instance may hold
+        #   the lock and have written its PID to it
+        try:
+            lock_file = open(self.lock_file_path, "a+")
+        except Exception as ex:
+            self.logger.write("Error: Could not open lock file '%s': %s" %
+                (self.lock_file_path, str(ex)))
+            exit(1)
+        try:
+            if platform.system().lower() == "windows":
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Another instance holds the lock
+        except OSError:
+            lock_file.close()
+            return False
+        # Keep the lock file open for as long as this process runs, and store the
+        #   PID in it for information only
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self.lock_file = lock_file
+        return True
+
+    # Release the lock before this process exits, which is not needed on exit
+    #   itself; the lock file is left in place, since removing it would let
+    #   another instance lock a new file while this one is still locked
+    def unlock(self):
+        if self.lock_file != None:
+            self.lock_file.close()
+            self.lock_file = None
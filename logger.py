@@ -1,27 +1,164 @@
-import datetime
+import atexit
+import os
+import queue
 import sys
+import threading
+import time
 
 
 class Logger(object):
 
-    def __init__(self, log_file):
+    def __init__(self, log_file,
+            max_file_size=1024 * 1024,
+            rotation_period_s=24 * 3600,
+            backup_count=3,
+            queue_size=1024,
+            flush_period_s=5,
+            coalesce_period_s=60):
+        self.log_file = log_file
         self.log = None
+        # Rotate the log file once it exceeds the maximum size or once the
+        #   rotation period has passed, keeping a number of old log files
+        self.max_file_size = max_file_size
+        self.rotation_period_s = rotation_period_s
+        self.backup_count = backup_count
+        # Flush the outputs at most once per flush period, and summarize repeated
+        #   identical messages at least once per coalesce period
+        self.flush_period_s = flush_period_s
+        self.coalesce_period_s = coalesce_period_s
         if log_file != None:
             try:
-                self.log = open(log_file, "w", buffering=1)
+                self.__open()
             except Exception as ex:
                 print("Error: Could not create or open log file '%s': %s" %
                     (log_file, str(ex)))
                 exit(1)
         self.terminal = sys.stdout
+        # Hand messages to a background writer thread through a bounded queue,
+        #   such that writing a message never blocks on disk
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped_count = 0
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+        # Write out all queued messages when the program exits
+        atexit.register(self.close)
 
-    def __del__(self):
+    def write(self, message):
+        try:
+            self.queue.put_nowait((time.time(), message))
+        except queue.Full:
+            self.dropped_count += 1
+
+    def close(self):
+        if self.thread.is_alive() == True:
+            self.queue.put(None)
+            self.thread.join()
         if self.log != None:
             self.log.close()
+            self.log = None
 
-    def write(self, message):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        total_message = "%s:  %s\n" % (timestamp, message)
-        self.terminal.write(total_message)
+    def __open(self):
+        # Append to the log file, such that a restart does not wipe earlier logs
+        self.log = open(self.log_file, "a")
+        self.log_size = self.log.tell()
+        self.log_open_time = time.time()
+
+    def __rotate(self):
+        self.log.close()
+        # Shift the old log files, dropping the oldest one
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists("%s.%d" % (self.log_file, i)) == True:
+                os.replace("%s.%d" % (self.log_file, i),
+                    "%s.%d" % (self.log_file, i + 1))
+        if self.backup_count > 0:
+            os.replace(self.log_file, "%s.1" % self.log_file)
+        else:
+            os.remove(self.log_file)
+        self.__open()
+
+    def __format(self, timestamp, message):
+        return "%s:  %s\n" % (
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), message)
+
+    def __output(self, text):
+        self.terminal.write(text)
+        if self.log != None:
+            self.log.write(text)
+            self.log_size += len(text)
+            if self.log_size >= self.max_file_size or \
+                    time.time() - self.log_open_time >= self.rotation_period_s:
+                self.__rotate()
+
+    def __flush(self):
+        self.terminal.flush()
         if self.log != None:
-            self.log.write(total_message)
+            self.log.flush()
+
+    def __run(self):
+        last_message = None
+        repeat_count = 0
+        repeat_time = 0
+        last_flush_time = time.monotonic()
+        is_closing = False
+        while is_closing == False:
+            # Wait for a message, waking up periodically to flush the outputs
+            try:
+                records = [self.queue.get(timeout=self.flush_period_s)]
+            except queue.Empty:
+                records = []
+            # Take all other queued messages as a single batch
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in records:
+                if record == None:
+                    is_closing = True
+                    continue
+                timestamp, message = record
+                # Coalesce identical consecutive messages into a count
+                if message == last_message:
+                    if repeat_count == 0:
+                        repeat_time = timestamp
+                    repeat_count += 1
+                    if timestamp - repeat_time < self.coalesce_period_s:
+                        continue
+                if repeat_count > 0:
+                    lines.append(self.__format(timestamp,
+                        "previous message repeated %d times" % repeat_count))
+                    repeat_count = 0
+                if message != last_message:
+                    lines.append(self.__format(timestamp, message))
+                last_message = message
+            if is_closing == True and repeat_count > 0:
+                lines.append(self.__format(time.time(),
+                    "previous message repeated %d times" % repeat_count))
+            if self.dropped_count > 0:
+                lines.append(self.__format(time.time(),
+                    "Error: %d log messages were dropped" % self.dropped_count))
+                self.dropped_count = 0
+            try:
+                if len(lines) > 0:
+                    self.__output("".join(lines))
+                # Flush the outputs once per flush period, or when closing
+                if is_closing == True or \
+                        time.monotonic() - last_flush_time >= self.flush_period_s:
+                    self.__flush()
+                    last_flush_time = time.monotonic()
+            except Exception as ex:
+                self.terminal.write("Error: Could not write to log file '%s': %s\n" %
+                    (self.log_file, str(ex)))
+
+
+# Logger which prefixes each message, used to tell apart the messages of
+#   different accounts in daemon mode
+class PrefixLogger(object):
+
+    def __init__(self, logger, prefix):
+        self.logger = logger
+        self.prefix = prefix
+
+    def write(self, message):
+        self.logger.write("[%s] %s" % (self.prefix, message))
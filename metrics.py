@@ -0,0 +1,236 @@
+import bisect
+import os
+import threading
+
+
+# Default histogram buckets in seconds, from API requests and mixer calls of a
+#   millisecond up to ramps and backoff of several seconds
+DEFAULT_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(label_names, label_values, extra_label=None):
+    labels = ["%s=\"%s\"" % (name, str(value).replace("\\", "\\\\")
+        .replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in zip(label_names, label_values)]
+    if extra_label != None:
+        labels.append(extra_label)
+    if len(labels) == 0:
+        return ""
+    return "{%s}" % ",".join(labels)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        # Value per tuple of label values
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def format_text(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text),
+            "# TYPE %s counter" % self.name]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append("%s%s %s" % (self.name,
+                    format_labels(self.label_names, label_values),
+                    format_value(value)))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS_S):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = sorted(buckets)
+        # Per tuple of label values, the non-cumulative count per bucket, with a
+        #   last bucket for values above the largest bound, and the sum of values
+        self.counts = {}
+        self.sums = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_values=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.get(label_values)
+            if counts == None:
+                counts = [0] * (len(self.buckets) + 1)
+                self.counts[label_values] = counts
+                self.sums[label_values] = 0
+            counts[index] += 1
+            self.sums[label_values] += value
+
+    def format_text(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text),
+            "# TYPE %s histogram" % self.name]
+        with self.lock:
+            for label_values, counts in sorted(self.counts.items()):
+                cumulative_count = 0
+                for bound, count in zip(self.buckets + [float("inf")], counts):
+                    cumulative_count += count
+                    lines.append("%s_bucket%s %d" % (self.name,
+                        format_labels(self.label_names, label_values,
+                            "le=\"%s\"" % format_value(bound)),
+                        cumulative_count))
+                labels = format_labels(self.label_names, label_values)
+                lines.append("%s_sum%s %s" % (self.name, labels,
+                    format_value(float(self.sums[label_values]))))
+                lines.append("%s_count%s %d" % (self.name, labels, cumulative_count))
+        return lines
+
+
+class MetricsRegistry(object):
+
+    def __init__(self, prefix="spotify_ad_muter_"):
+        self.prefix = prefix
+        # Metrics indexed by name, such that components which are created once
+        #   per account in daemon mode share the same metrics
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def __get_or_create(self, name, create):
+        with self.lock:
+            metric = self.metrics.get(self.prefix + name)
+            if metric == None:
+                metric = create(self.prefix + name)
+                self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.__get_or_create(name,
+            lambda full_name: Counter(full_name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS_S):
+        return self.__get_or_create(name,
+            lambda full_name: Histogram(full_name, help_text, label_names, buckets))
+
+    # Format all metrics in the Prometheus text exposition format
+    def format_text(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.format_text())
+        return "\n".join(lines) + "\n"
+
+
+# Metric and registry which do nothing, used when metrics are disabled such that
+#   instrumented code only pays for a call to an empty method
+class NullMetric(object):
+
+    def inc(self, label_values=(), amount=1):
+        pass
+
+    def observe(self, value, label_values=()):
+        pass
+
+
+class NullRegistry(object):
+
+    __NULL_METRIC = NullMetric()
+
+    def counter(self, name, help_text, label_names=()):
+        return self.__NULL_METRIC
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS_S):
+        return self.__NULL_METRIC
+
+    def format_text(self):
+        return ""
+
+
+# Serve the metrics in the Prometheus text format over HTTP, on localhost only
+#   by default
+class MetricsServer(object):
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        # Import 'http.server' only when the metrics are served, as it pulls in
+        #   the email and HTML modules, which slow down startup
+        import http.server
+        self.http_server = http.server
+        self.registry = registry
+        self.server = http.server.ThreadingHTTPServer((host, port),
+            self.__create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __create_handler(self):
+        registry = self.registry
+
+        class Handler(self.http_server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.format_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', "text/plain; version=0.0.4")
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# Periodically write the metrics in the Prometheus text format to a file, e.g.
+#   for the textfile collector of the Prometheus node exporter
+class MetricsFileWriter(object):
+
+    def __init__(self, registry, metrics_file_path, period_s=15):
+        self.registry = registry
+        self.metrics_file_path = metrics_file_path
+        self.period_s = period_s
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread != None:
+            self.thread.join()
+        self.write()
+
+    # Write to a temporary file first and then replace the old file, such that
+    #   a reader never sees a partially written file
+    def write(self):
+        temporary_file_path = "%s.tmp" % self.metrics_file_path
+        with open(temporary_file_path, "w") as metrics_file:
+            metrics_file.write(self.registry.format_text())
+        os.replace(temporary_file_path, self.metrics_file_path)
+
+    def __run(self):
+        while self.stop_event.wait(self.period_s) == False:
+            try:
+                self.write()
+            except Exception:
+                pass
@@ -0,0 +1,80 @@
+class PlaybackState(object):
+
+    # States of the playback state machine
+    TRACK = "track"
+    AD = "ad"
+    PAUSED = "paused"
+    IDLE = "idle"
+    ERROR = "error"
+
+    # Flags of the changes compared to the previous sample, combined in the
+    #   value returned when updating the playback state
+    STATE_CHANGED = 1
+    ITEM_CHANGED = 2
+
+    # Only the fields used by the polling loop are kept, in a fixed set of slots,
+    #   and updated in place such that a steady-state poll allocates no objects
+    __slots__ = ('state', 'item_type', 'item_id', 'progress_ms', 'duration_ms',
+        'previous_state', 'previous_item_type', 'previous_item_id')
+
+    def __init__(self):
+        self.state = self.IDLE
+        self.item_type = None
+        self.item_id = None
+        self.progress_ms = None
+        self.duration_ms = None
+        self.previous_state = None
+        self.previous_item_type = None
+        self.previous_item_id = None
+
+    def is_track(self):
+        return self.item_type == "track" or self.item_type == "episode"
+
+    def is_ad(self):
+        return self.item_type == "ad"
+
+    def is_playing(self):
+        return self.state == self.TRACK or self.state == self.AD
+
+    # Update the state from a playback state returned by the Spotify API, and
+    #   return the changes compared to the previous sample
+    def update(self, playback_state):
+        self.previous_state = self.state
+        self.previous_item_type = self.item_type
+        self.previous_item_id = self.item_id
+        # Nothing is playing on any device
+        if playback_state == None:
+            self.state = self.IDLE
+            return self.__get_changes()
+        item = playback_state['item']
+        self.item_type = playback_state['currently_playing_type']
+        self.item_id = item.get('id') if item != None else None
+        self.progress_ms = playback_state['progress_ms']
+        self.duration_ms = item.get('duration_ms') if item != None else None
+        if self.is_track() == False and self.is_ad() == False:
+            self.state = self.ERROR
+        elif playback_state['is_playing'] == False:
+            self.state = self.PAUSED
+        elif self.is_ad() == True:
+            self.state = self.AD
+        else:
+            self.state = self.TRACK
+        return self.__get_changes()
+
+    # Enter the error state, keeping the last known item such that the item
+    #   after the error is compared to the item before it
+    def set_error(self):
+        self.previous_state = self.state
+        self.previous_item_type = self.item_type
+        self.previous_item_id = self.item_id
+        self.state = self.ERROR
+        return self.__get_changes()
+
+    def __get_changes(self):
+        changes = 0
+        if self.state != self.previous_state:
+            changes |= self.STATE_CHANGED
+        if self.item_id != self.previous_item_id or \
+                self.item_type != self.previous_item_type:
+            changes |= self.ITEM_CHANGED
+        return changes
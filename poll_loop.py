@@ -0,0 +1,434 @@
+import asyncio
+import concurrent.futures
+import spotipy
+# Import user modules
+import clock
+import playback_state
+import volume_control
+
+
+# Set the deadlines of the concurrent tasks in the asynchronous run loop
+DEADLINE_API_REQUEST_S = 10
+DEADLINE_PROCESS_CHECK_S = 5
+DEADLINE_VOLUME_CHANGE_S = 5
+# Set the volume ramps used when muting and restoring the volume, and the lag of
+#   the playback on the device compared to the Spotify API
+RAMP_CURVE = "s-curve"
+RAMP_STEP_COUNT = 10
+RAMP_DOWN_DURATION_S = 0.25
+RAMP_UP_DURATION_S = 1.5
+PLAYBACK_LAG_S = 1
+# Set the time after the predicted end of a track after which a reduced volume
+#   is restored if no ad followed
+PREMUTE_GRACE_S = 2
+
+
+class PollLoop(object):
+
+    def __init__(self, config, sp, log, activity_checker, volume_controller,
+            poll_scheduler, http_session=None, volume_executor=None, ad_index=None,
+            clock_obj=None):
+        self.config = config
+        self.sp = sp
+        self.log = log
+        self.activity_checker = activity_checker
+        self.volume_controller = volume_controller
+        self.poll_scheduler = poll_scheduler
+        # Optional connection-pooled session used by the Spotify client
+        self.http_session = http_session
+        # Clock from which the time is read and with which the synchronous run
+        #   loop sleeps, which is virtual when replaying a recorded capture
+        self.clock = clock_obj
+        if clock_obj == None:
+            self.clock = clock.Clock()
+        # Get initial system volume
+        self.normal_volume = volume_controller.get_system_volume()
+        self.is_ad = False
+        self.volume_ramp = volume_control.VolumeRamp(volume_controller,
+            RAMP_STEP_COUNT, self.clock)
+        # Volume changes are executed in worker threads in the asynchronous run
+        #   loop, chained such that they are applied in order. Without a given
+        #   executor, a single worker is started by the run loop
+        self.volume_executor = volume_executor
+        self.volume_future = None
+        # Optional index of previously seen ads, used to reduce the volume at the
+        #   predicted end of a track if an ad is likely to follow
+        self.ad_index = ad_index
+        self.premute_time = None
+        self.premute_item_id = None
+        # Playback state of the latest poll, updated in place and compared to the
+        #   previous poll, and the wall clock time at which the current block of
+        #   ads started
+        self.playback = playback_state.PlaybackState()
+        self.ad_block_timestamp = None
+
+    # Immediately restore the normal volume, stopping any running ramp
+    def restore_volume(self):
+        is_ramp_cancelled = self.volume_ramp.cancel()
+        if self.is_ad == True or is_ramp_cancelled == True or \
+                self.premute_time != None:
+            self.volume_controller.set_system_volume(self.normal_volume)
+            self.is_ad = False
+            self.premute_time = None
+
+    # Reduce the volume at the predicted end of the current track, such that it
+    #   reaches the ad volume by the time the next item starts
+    def premute_volume(self, item_id):
+        if self.volume_ramp.cancel() == False:
+            self.normal_volume = self.volume_controller.get_system_volume()
+        self.premute_time = self.poll_scheduler.boundary_time
+        self.premute_item_id = item_id
+        self.volume_ramp.start(self.config.AD_VOLUME_PERCENTAGE,
+            RAMP_DOWN_DURATION_S, RAMP_CURVE, start_volume=self.normal_volume,
+            start_time=self.premute_time - RAMP_DOWN_DURATION_S)
+
+    # Update the ad index with the transition from the previous item to the
+    #   current one
+    def update_ad_index(self):
+        playback = self.playback
+        if self.ad_index == None:
+            return
+        item_start_timestamp = self.clock.time() - playback.progress_ms / 1000
+        if playback.is_ad() == True:
+            self.ad_index.record_ad(playback.item_id, playback.duration_ms)
+        if playback.previous_item_type == "track" or \
+                playback.previous_item_type == "episode":
+            self.ad_index.record_track_end(playback.is_ad(), item_start_timestamp)
+            if playback.is_ad() == True:
+                self.ad_block_timestamp = item_start_timestamp
+        elif playback.previous_item_type == "ad" and playback.is_track() == True and \
+                self.ad_block_timestamp != None:
+            self.ad_index.record_ad_block(self.config.NAME, self.ad_block_timestamp,
+                item_start_timestamp - self.ad_block_timestamp)
+            self.ad_block_timestamp = None
+            self.save_ad_index()
+
+    # Write the ad index to its file, of which a failure does not interrupt the
+    #   handling of the playback state
+    def save_ad_index(self):
+        try:
+            self.ad_index.save()
+        except Exception as ex:
+            self.log.write("Warning: Could not save ad index: %s" % str(ex))
+
+    # Handle a volume ramp which failed in its thread by setting its target
+    #   volume directly, which exits the program if the mixer still fails
+    def check_volume_ramp(self):
+        error = self.volume_ramp.pop_error()
+        if error == None:
+            return
+        # The mixer already reported why it exited
+        reason = "mixer failure" if isinstance(error, SystemExit) else str(error)
+        self.log.write("Error: volume ramp to %d%% failed, retrying: %s" %
+            (self.volume_ramp.target_volume, reason))
+        self.volume_controller.set_system_volume(self.volume_ramp.target_volume)
+
+    # Forget the playing item and restore the volume, as the playback state is
+    #   unknown or nothing is playing on the target device
+    def __reset_playback(self, message):
+        self.check_volume_ramp()
+        if self.playback.state != self.playback.IDLE:
+            self.playback.set_error()
+        self.restore_volume()
+        self.log.write(message)
+
+    # Back off after a failed request or an unexpected playback state
+    def handle_error(self, message, ex=None):
+        self.__reset_playback(message)
+        return self.poll_scheduler.next_error_sleep_period(ex)
+
+    # Poll at a relaxed rate if the target device is inactive or nothing is
+    #   playing, which is not an error
+    def handle_inactive(self, message):
+        self.__reset_playback(message)
+        return self.poll_scheduler.next_inactive_sleep_period()
+
+    def describe_error(self, ex):
+        # Report specific Spotify API error
+        if isinstance(ex, spotipy.client.SpotifyException):
+            return "Error: {HTTP status = %d; HTTP message = %s;}" % \
+                (ex.http_status, ex.msg)
+        # Report a task which did not finish before its deadline
+        if isinstance(ex, asyncio.TimeoutError):
+            return "Error: request did not complete before its deadline"
+        # Report any other random error
+        return "Error: unexpected error occurred: %s" % str(ex)
+
+    def is_target_device_active(self):
+        return self.activity_checker.is_target_device_active(
+            self.config.TARGET_DEVICE_NAME)
+
+    # In single request mode, check if the target device is the active device
+    #   reported along with the playback state
+    def is_playback_device_target(self, playback_state):
+        if self.config.POLL_MODE != "single" or playback_state == None:
+            return True
+        return self.activity_checker.is_playback_device_target(
+            playback_state, self.config.TARGET_DEVICE_NAME)
+
+    # Extract current playback state information, which in single request
+    #   mode includes the active device
+    def fetch_playback_state(self):
+        self.poll_scheduler.record_api_call()
+        if self.config.POLL_MODE == "single":
+            return self.sp.current_playback(additional_types='track,episode')
+        return self.sp.currently_playing(additional_types='track,episode')
+
+    # Act on a playback state and return the period until the next poll
+    def handle_playback_state(self, playback_state):
+        self.check_volume_ramp()
+        playback = self.playback
+        changes = playback.update(playback_state)
+        # Print error if playback state is empty
+        if playback.state == playback.IDLE:
+            return self.handle_inactive("No playback state found")
+        if playback.state == playback.ERROR:
+            self.log.write("Error: Unknown type playing")
+            return self.poll_scheduler.next_error_sleep_period()
+        is_playing = playback.is_playing()
+        progress_ms = playback.progress_ms
+        duration_ms = playback.duration_ms
+        if changes & playback.ITEM_CHANGED:
+            self.update_ad_index()
+        # If Spotify is currently playing a track...
+        if playback.is_track() == True:
+            # If the volume was reduced at the predicted end of the previous track
+            #   but no ad followed, restore the volume right away
+            if self.premute_time != None and \
+                    (playback.item_id != self.premute_item_id or
+                    self.clock.monotonic() > self.premute_time + PREMUTE_GRACE_S):
+                self.restore_volume()
+                self.poll_scheduler.record_premute(False)
+            # If on the iteration before an ad was playing, ramp the system volume
+            #   back up
+            if self.is_ad == True:
+                # Start the ramp at the predicted end of the ad, or if unknown, the
+                #   end of the ad derived from the track's progress. Playback on
+                #   the device may lag slightly compared to the Spotify API requests
+                ad_end_time = self.poll_scheduler.boundary_time
+                if ad_end_time == None:
+                    ad_end_time = self.clock.monotonic() - progress_ms / 1000
+                self.volume_ramp.start(self.normal_volume, RAMP_UP_DURATION_S,
+                    RAMP_CURVE, start_volume=self.config.AD_VOLUME_PERCENTAGE,
+                    start_time=ad_end_time + PLAYBACK_LAG_S)
+                self.is_ad = False
+                self.poll_scheduler.record_unmute(progress_ms)
+            # Set sleep period based on if track is paused or, if active, the
+            #   predicted end of the track and the likelihood of an ad following
+            ad_probability = 0.5
+            if self.ad_index != None:
+                ad_probability = self.ad_index.get_ad_probability(self.config.NAME,
+                    self.clock.time())
+            sleep_period_s = self.poll_scheduler.next_track_sleep_period(
+                progress_ms, duration_ms, is_playing, ad_probability)
+            # Reduce the volume at the predicted end of the track if an ad is
+            #   likely to follow
+            if is_playing == True and self.premute_time == None and \
+                    self.ad_index != None and \
+                    self.poll_scheduler.should_premute(ad_probability) == True:
+                self.premute_volume(playback.item_id)
+            # Only report a new track or a change between playing and paused
+            if changes == 0:
+                pass
+            elif is_playing == False:
+                self.log.write("track is active, but paused")
+            else:
+                self.log.write("track is active, with %ds remaining" %
+                    ((duration_ms - progress_ms) / 1000))
+            return sleep_period_s
+        # If Spotify is currently playing an ad...
+        # If on the iteration before a track was playing, reduce the system volume
+        if self.is_ad == False and self.premute_time != None:
+            # The volume was already reduced at the predicted end of the
+            #   previous track, the ad was only audible if it started earlier
+            ad_start_time = self.clock.monotonic() - progress_ms / 1000
+            mute_latency_s = max([0, self.premute_time - ad_start_time])
+            self.poll_scheduler.record_mute(mute_latency_s * 1000)
+            self.poll_scheduler.record_premute(True,
+                max([0, progress_ms / 1000 - mute_latency_s]))
+            self.premute_time = None
+            self.is_ad = True
+        elif self.is_ad == False:
+            # Save the current volume to restore later after ads are done
+            #   playing, unless the ad interrupted the ramp restoring it
+            if self.volume_ramp.cancel() == False:
+                self.normal_volume = self.volume_controller.get_system_volume()
+            self.volume_ramp.start(self.config.AD_VOLUME_PERCENTAGE,
+                RAMP_DOWN_DURATION_S, RAMP_CURVE)
+            self.poll_scheduler.record_mute(progress_ms)
+            self.is_ad = True
+        # Fill in the duration of a previously seen ad if the API leaves it out,
+        #   and estimate the rest of the block of ads from its typical length
+        block_remaining_s = None
+        if self.ad_index != None:
+            if duration_ms == None:
+                duration_ms = self.ad_index.get_ad_duration_ms(playback.item_id)
+            block_length_s = self.ad_index.get_ad_block_length_s(self.config.NAME)
+            if block_length_s != None and self.ad_block_timestamp != None:
+                block_remaining_s = block_length_s - \
+                    (self.clock.time() - self.ad_block_timestamp)
+        # Set sleep period based on if ad is paused or, if active, the
+        #   predicted end of the ad and of the block of ads
+        sleep_period_s = self.poll_scheduler.next_ad_sleep_period(
+            progress_ms, duration_ms, is_playing, block_remaining_s)
+        # Only report a new ad or a change between playing and paused
+        if changes == 0:
+            pass
+        elif is_playing == False:
+            self.log.write("ad is active, but paused")
+        else:
+            self.log.write("ad is active")
+        return sleep_period_s
+
+    # Perform a single iteration of the synchronous run loop and return the
+    #   period until the next one
+    def poll(self):
+        self.poll_scheduler.record_iteration()
+        # In dual request mode, first check if target device is currently active
+        if self.config.POLL_MODE == "dual" and self.is_target_device_active() == False:
+            return self.handle_inactive("Error: Target device is not currently active")
+        # Attempt to extract current playback state information
+        try:
+            playback_state = self.fetch_playback_state()
+        except Exception as ex:
+            return self.handle_error(self.describe_error(ex), ex)
+        if self.is_playback_device_target(playback_state) == False:
+            return self.handle_inactive("Error: Target device is not currently active")
+        return self.handle_playback_state(playback_state)
+
+    def run(self):
+        while self.config.AUTOMATIC_CLOSING == False or \
+                self.activity_checker.is_spotify_active() == True:
+            # Suspend program for the determined period
+            self.clock.sleep(self.poll())
+        self.quit()
+
+    # Run a blocking function in a worker thread, raising 'asyncio.TimeoutError'
+    #   if it does not complete before the deadline
+    async def __run_with_deadline(self, deadline_s, function, *args, executor=None):
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, function, *args), deadline_s)
+
+    # Run a function which changes the volume in a volume worker thread, after
+    #   the previous volume change completed, and return the period until the
+    #   next poll
+    async def __run_volume_task(self, function, *args):
+        loop = asyncio.get_running_loop()
+        previous_future = self.volume_future
+        async def run_in_order():
+            if previous_future != None:
+                await asyncio.wait([previous_future])
+            return await loop.run_in_executor(self.volume_executor, function, *args)
+        self.volume_future = asyncio.ensure_future(run_in_order())
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.volume_future),
+                DEADLINE_VOLUME_CHANGE_S)
+        except asyncio.TimeoutError:
+            self.log.write("Error: volume change did not complete before its " +
+                "deadline")
+            return self.poll_scheduler.next_error_sleep_period()
+
+    # Perform a single iteration of the asynchronous run loop and return the
+    #   period until the next one, or None if Spotify is no longer active
+    async def poll_async(self):
+        self.poll_scheduler.record_iteration()
+        # Start the process check, device check and playback state request as
+        #   concurrent tasks, each with its own deadline
+        process_task = None
+        if self.config.AUTOMATIC_CLOSING == True:
+            process_task = asyncio.ensure_future(self.__run_with_deadline(
+                DEADLINE_PROCESS_CHECK_S, self.activity_checker.is_spotify_active))
+        device_task = None
+        if self.config.POLL_MODE == "dual":
+            device_task = asyncio.ensure_future(self.__run_with_deadline(
+                DEADLINE_API_REQUEST_S, self.is_target_device_active))
+        playback_task = asyncio.ensure_future(self.__run_with_deadline(
+            DEADLINE_API_REQUEST_S, self.fetch_playback_state))
+        pending_tasks = [task for task in [process_task, device_task, playback_task]
+            if task != None]
+        try:
+            # Stop if Spotify is no longer active, a process check which did not
+            #   finish in time does not stop the program
+            if process_task != None:
+                try:
+                    if await process_task == False:
+                        return None
+                except asyncio.TimeoutError:
+                    self.log.write("Error: process check did not complete " +
+                        "before its deadline")
+            # In dual request mode, check if target device is currently active
+            if device_task != None:
+                try:
+                    is_device_active = await device_task
+                except asyncio.TimeoutError as ex:
+                    return await self.__run_volume_task(self.handle_error,
+                        self.describe_error(ex), ex)
+                if is_device_active == False:
+                    return await self.__run_volume_task(self.handle_inactive,
+                        "Error: Target device is not currently active")
+            # Restore the volume right away if the playback state request fails or
+            #   hangs past its deadline
+            try:
+                playback_state = await playback_task
+            except Exception as ex:
+                return await self.__run_volume_task(self.handle_error,
+                    self.describe_error(ex), ex)
+            # The device check may need to refresh the device cache, so it runs
+            #   outside of the volume worker thread as well
+            try:
+                is_device_active = await self.__run_with_deadline(
+                    DEADLINE_API_REQUEST_S, self.is_playback_device_target,
+                    playback_state)
+            except asyncio.TimeoutError as ex:
+                return await self.__run_volume_task(self.handle_error,
+                    self.describe_error(ex), ex)
+            if is_device_active == False:
+                return await self.__run_volume_task(self.handle_inactive,
+                    "Error: Target device is not currently active")
+            return await self.__run_volume_task(self.handle_playback_state,
+                playback_state)
+        finally:
+            for task in pending_tasks:
+                task.cancel()
+
+    async def run_async(self):
+        # Start a single volume worker, unless an executor was given, which is
+        #   left to its owner
+        volume_executor = None
+        if self.volume_executor == None:
+            volume_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.volume_executor = volume_executor
+        try:
+            while True:
+                sleep_period_s = await self.poll_async()
+                if sleep_period_s == None:
+                    break
+                # Suspend the loop for the determined period
+                await asyncio.sleep(sleep_period_s)
+            await self.__run_volume_task(self.quit)
+        finally:
+            if volume_executor != None:
+                volume_executor.shutdown(wait=False)
+                self.volume_executor = None
+
+    async def stop_async(self):
+        await self.__run_volume_task(self.stop)
+
+    # Return the system volume to normal
+    def stop(self):
+        self.volume_ramp.cancel()
+        self.volume_controller.set_system_volume(self.normal_volume)
+        if self.ad_index != None:
+            self.save_ad_index()
+
+    # Exit gracefully if Spotify is not running on this device by returning
+    #   the system volume to normal
+    def quit(self):
+        self.log.write("Spotify is not a running process; quitting...")
+        self.log.write("Polling statistics: %s" %
+            self.poll_scheduler.format_statistics())
+        if self.http_session != None:
+            self.log.write("HTTP statistics: %s" %
+                self.http_session.format_statistics())
+        self.stop()
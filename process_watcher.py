@@ -0,0 +1,101 @@
+import os
+import psutil
+import select
+import time
+# Import user modules
+import metrics
+
+
+class ProcessWatcher(object):
+
+    __ACTIVE_STATUSES = [psutil.STATUS_RUNNING, psutil.STATUS_SLEEPING,
+        psutil.STATUS_WAKING]
+
+    def __init__(self, process_name="spotify", process_iter=None,
+            metrics_registry=None):
+        self.process_name = process_name
+        # Function used to iterate over the process table, 'psutil.process_iter'
+        #   by default
+        self.process_iter = process_iter
+        if process_iter == None:
+            self.process_iter = psutil.process_iter
+        # Currently tracked process, and if supported by the kernel, a file
+        #   descriptor which becomes readable once the process exits
+        self.process = None
+        self.pidfd = None
+        # Number of full scans of the process table performed
+        self.scan_count = 0
+        if metrics_registry == None:
+            metrics_registry = metrics.NullRegistry()
+        self.scan_histogram = metrics_registry.histogram("process_scan_seconds",
+            "Duration of a full scan of the process table")
+
+    def __del__(self):
+        self.__untrack()
+
+    def __is_target_name(self, name):
+        return name != None and self.process_name in name.lower().split('.')[0]
+
+    def __track(self, process):
+        self.process = process
+        # Prefer to be notified of the process exit by the kernel through a pidfd
+        #   (Linux 5.3+), which also guards against PID reuse
+        if hasattr(os, 'pidfd_open'):
+            try:
+                self.pidfd = os.pidfd_open(process.pid)
+            except OSError:
+                self.pidfd = None
+
+    def __untrack(self):
+        if getattr(self, 'pidfd', None) != None:
+            os.close(self.pidfd)
+        self.pidfd = None
+        self.process = None
+
+    def __scan(self):
+        self.scan_count += 1
+        start_time = time.perf_counter()
+        is_found = False
+        # Iterate through all active processes, prefetching the name and status
+        #   of each process in one go
+        for p in self.process_iter(attrs=['name', 'status']):
+            # Check if Spotify is present in list of active processes
+            #   and otherwise running, sleeping, or a state in between
+            if self.__is_target_name(p.info['name']) and \
+                    p.info['status'] in self.__ACTIVE_STATUSES:
+                self.__track(p)
+                is_found = True
+                break
+        self.scan_histogram.observe(time.perf_counter() - start_time)
+        return is_found
+
+    def __is_tracked_process_alive(self):
+        # A pidfd becomes readable once the process has exited, so polling it
+        #   with a zero timeout is a single syscall
+        if self.pidfd != None:
+            readable, _, _ = select.select([self.pidfd], [], [], 0)
+            return len(readable) == 0
+        # Otherwise check the tracked process only, 'is_running' also compares
+        #   the process creation time to detect PID reuse
+        try:
+            return self.process.is_running() and \
+                self.process.status() in self.__ACTIVE_STATUSES
+        except psutil.Error:
+            return False
+
+    # Return the PID of the tracked process, or None if no process is tracked
+    def get_pid(self):
+        process = self.process
+        if process == None:
+            return None
+        return process.pid
+
+    def is_alive(self):
+        # Fast path: check the liveness of the tracked process only
+        if self.process != None:
+            if self.__is_tracked_process_alive() == True:
+                return True
+            self.__untrack()
+        # Fall back to a full scan of the process table if no process is tracked
+        #   or if the tracked process died
+        return self.__scan()
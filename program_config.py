@@ -1,8 +1,97 @@
 import getpass
+import json
 import os
 import platform
 import socket
-import spotipy
+
+
+# Default polling periods, which may be overridden by the configuration file
+SLEEP_PERIOD_ERROR_MIN_S = 1
+SLEEP_PERIOD_ERROR_S = 60
+SLEEP_PERIOD_INACTIVE_S = 60
+SLEEP_PERIOD_PAUSED_MIN_S = 5
+SLEEP_PERIOD_PAUSED_MAX_S = 20
+# A playing track is polled at least this often, also far from its predicted
+#   end, such that a skipped or seeked track is noticed within this period
+SLEEP_PERIOD_PLAYING_TRACK_MAX_S = 10
+SLEEP_PERIOD_PLAYING_AD_S = 1
+SLEEP_PERIOD_PROBE_S = 0.5
+PROBE_LEAD_S = 1
+
+# Settings which may be changed by the configuration file while the program is
+#   running, indexed by their key in the file
+CONFIG_FILE_SETTINGS = {
+    'ad_volume_percentage': 'AD_VOLUME_PERCENTAGE',
+    'target_device_name': 'TARGET_DEVICE_NAME',
+    'sleep_period_error_min_s': 'SLEEP_PERIOD_ERROR_MIN_S',
+    'sleep_period_error_s': 'SLEEP_PERIOD_ERROR_S',
+    'sleep_period_inactive_s': 'SLEEP_PERIOD_INACTIVE_S',
+    'sleep_period_paused_min_s': 'SLEEP_PERIOD_PAUSED_MIN_S',
+    'sleep_period_paused_max_s': 'SLEEP_PERIOD_PAUSED_MAX_S',
+    'sleep_period_playing_track_max_s': 'SLEEP_PERIOD_PLAYING_TRACK_MAX_S',
+    'sleep_period_playing_ad_s': 'SLEEP_PERIOD_PLAYING_AD_S',
+    'sleep_period_probe_s': 'SLEEP_PERIOD_PROBE_S',
+    'probe_lead_s': 'PROBE_LEAD_S'}
+
+
+# Read a configuration file in the JSON or, if its extension is '.toml', the
+#   TOML format
+def read_config_file(config_file_path):
+    if config_file_path.lower().endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError("TOML configuration files require Python 3.11+")
+        with open(config_file_path, "rb") as config_file:
+            return tomllib.load(config_file)
+    with open(config_file_path, "r") as config_file:
+        values = json.load(config_file)
+    if isinstance(values, dict) == False:
+        raise ValueError("configuration file does not contain an object")
+    return values
+
+
+# Validate the settings of a configuration file and return them indexed by their
+#   attribute name, checking the bounds against the given configuration, or the
+#   default polling periods, for the settings which the file does not contain
+def parse_config_settings(values, config=None):
+    settings = {}
+    for key, value in values.items():
+        name = CONFIG_FILE_SETTINGS.get(key)
+        if name == None:
+            raise ValueError("unknown setting '%s'" % key)
+        if name == 'TARGET_DEVICE_NAME':
+            if isinstance(value, str) == False:
+                raise ValueError("setting '%s' is not a string" % key)
+            settings[name] = value.lower()
+            continue
+        if isinstance(value, (int, float)) == False or isinstance(value, bool):
+            raise ValueError("setting '%s' is not a number" % key)
+        if name == 'AD_VOLUME_PERCENTAGE':
+            settings[name] = min([100, max([0, round(value)])])
+        # A polling period of zero would poll the Spotify API in a busy loop, the
+        #   probe window may be left out
+        elif value < 0 or (name != 'PROBE_LEAD_S' and value == 0):
+            raise ValueError("setting '%s' is out of range" % key)
+        else:
+            settings[name] = value
+    # Check that the lower bounds do not exceed the upper bounds
+    for minimum_name, maximum_name in [
+            ('SLEEP_PERIOD_ERROR_MIN_S', 'SLEEP_PERIOD_ERROR_S'),
+            ('SLEEP_PERIOD_PAUSED_MIN_S', 'SLEEP_PERIOD_PAUSED_MAX_S'),
+            ('SLEEP_PERIOD_PROBE_S', 'SLEEP_PERIOD_PLAYING_TRACK_MAX_S')]:
+        if settings.get(minimum_name, get_setting(config, minimum_name)) > \
+                settings.get(maximum_name, get_setting(config, maximum_name)):
+            raise ValueError("setting '%s' exceeds '%s'" %
+                (minimum_name.lower(), maximum_name.lower()))
+    return settings
+
+
+# Get a setting of the given configuration, or its default polling period
+def get_setting(config, name):
+    if config == None:
+        return globals()[name]
+    return getattr(config, name)
 
 
 class ProgramConfig(object):
@@ -12,7 +101,15 @@ class ProgramConfig(object):
             ad_volume_percentage=0,
             target_device_name="",
             auth_cache_path="",
-            log_file_path=""):
+            log_file_path="",
+            poll_mode="single",
+            run_mode="async",
+            accounts_file_path=None,
+            metrics_port=None,
+            metrics_file_path=None,
+            config_file_path=None,
+            volume_backend="auto",
+            record_file_path=None):
         # Get general system information
         username_str = getpass.getuser()
         hostname_str = socket.gethostname()
@@ -26,10 +123,35 @@ class ProgramConfig(object):
         self.AD_VOLUME_PERCENTAGE = \
             min([100, max([0, round(ad_volume_percentage, 0)])])
 
+        # Set the polling mode, which either requests the playback state and the
+        #   active device at once ('single') or in separate requests ('dual')
+        if poll_mode not in ["single", "dual"]:
+            print("Error: unknown polling mode: %s" % poll_mode)
+            exit(1)
+        self.POLL_MODE = poll_mode
+
+        # Set the run mode, which either runs the loop's requests, process checks
+        #   and volume changes as concurrent tasks ('async') or serially ('sync')
+        if run_mode not in ["async", "sync"]:
+            print("Error: unknown run mode: %s" % run_mode)
+            exit(1)
+        self.RUN_MODE = run_mode
+
+        # Set the volume backend on Linux, which either changes only the volume
+        #   of Spotify's streams on the PulseAudio or PipeWire sound server
+        #   ('pulse'), that of the ALSA mixer control ('alsa'), or the former if
+        #   a sound server is running and the latter otherwise ('auto')
+        if volume_backend not in ["auto", "pulse", "alsa"]:
+            print("Error: unknown volume backend: %s" % volume_backend)
+            exit(1)
+        self.VOLUME_BACKEND = volume_backend
+
         # Set the target device name as the host's name by default
         self.TARGET_DEVICE_NAME = target_device_name
         if target_device_name == None:
             self.TARGET_DEVICE_NAME = socket.gethostname().lower()
+        # Name the single account after its target device in the ad index
+        self.NAME = self.TARGET_DEVICE_NAME
 
         # Set default location for Spotify authorization information storage
         self.AUTH_CACHE_PATH = auth_cache_path
@@ -51,6 +173,9 @@ class ProgramConfig(object):
             exit(1)
         # Make the authentication cache path absolute
         self.AUTH_CACHE_PATH = os.path.abspath(self.AUTH_CACHE_PATH)
+        # Store the index of previously seen ads next to the authentication cache
+        self.AD_INDEX_PATH = os.path.join(os.path.dirname(self.AUTH_CACHE_PATH),
+            ".spotify-ad-muter-index.json")
 
         # Set default location for log file
         self.LOG_FILE_PATH = log_file_path
@@ -73,6 +198,33 @@ class ProgramConfig(object):
         # Make the log file path absolute
         self.LOG_FILE_PATH = os.path.abspath(self.LOG_FILE_PATH)
 
+        # Set the local port on which metrics are served and the file to which
+        #   they are written, metrics are disabled if neither is specified
+        self.METRICS_PORT = metrics_port
+        if metrics_port != None and (metrics_port < 1 or metrics_port > 65535):
+            print("Error: invalid metrics port: %d" % metrics_port)
+            exit(1)
+        self.METRICS_FILE_PATH = metrics_file_path
+        if metrics_file_path != None:
+            dirname = os.path.dirname(os.path.abspath(metrics_file_path))
+            if os.path.exists(dirname) == False:
+                print("Error: specified metrics directory does not exist: %s" %
+                      dirname)
+                exit(1)
+            self.METRICS_FILE_PATH = os.path.abspath(metrics_file_path)
+        self.METRICS_ENABLED = metrics_port != None or metrics_file_path != None
+
+        # Set the file to which the playback state and device responses are
+        #   appended, for replaying them offline, see 'replay'
+        self.RECORD_FILE_PATH = record_file_path
+        if record_file_path != None:
+            dirname = os.path.dirname(os.path.abspath(record_file_path))
+            if os.path.exists(dirname) == False:
+                print("Error: specified capture directory does not exist: %s" %
+                      dirname)
+                exit(1)
+            self.RECORD_FILE_PATH = os.path.abspath(record_file_path)
+
         # set location for the lock file
         if kernel_str == "linux":
             self.LOCK_FILE_PATH = "/tmp/spotify-ad-muter.lock"
@@ -88,11 +240,144 @@ class ProgramConfig(object):
         # Store custom Spotify App information
         self.SCOPE = "user-read-playback-state"
 
-        # Initialize spotify authentication manager, which shows a browser login dialog
-        #   if not already logged in
-        self.CLIENT_CREDENTIAL_MANAGER = spotipy.oauth2.SpotifyPKCE(
-                scope = self.SCOPE,
-                open_browser = True,
-                cache_handler=spotipy.CacheFileHandler(
-                    cache_path=self.AUTH_CACHE_PATH)
-            )    
+        # The spotify authentication manager is only created once it is first used,
+        #   after the lock check, see 'CLIENT_CREDENTIAL_MANAGER'
+        self.__client_credential_manager = None
+
+        # Set the default polling periods
+        self.SLEEP_PERIOD_ERROR_MIN_S = SLEEP_PERIOD_ERROR_MIN_S
+        self.SLEEP_PERIOD_ERROR_S = SLEEP_PERIOD_ERROR_S
+        self.SLEEP_PERIOD_INACTIVE_S = SLEEP_PERIOD_INACTIVE_S
+        self.SLEEP_PERIOD_PAUSED_MIN_S = SLEEP_PERIOD_PAUSED_MIN_S
+        self.SLEEP_PERIOD_PAUSED_MAX_S = SLEEP_PERIOD_PAUSED_MAX_S
+        self.SLEEP_PERIOD_PLAYING_TRACK_MAX_S = SLEEP_PERIOD_PLAYING_TRACK_MAX_S
+        self.SLEEP_PERIOD_PLAYING_AD_S = SLEEP_PERIOD_PLAYING_AD_S
+        self.SLEEP_PERIOD_PROBE_S = SLEEP_PERIOD_PROBE_S
+        self.PROBE_LEAD_S = PROBE_LEAD_S
+
+        # Override the settings which are specified in the configuration file,
+        #   keeping the values from the command line and the default polling
+        #   periods for the settings which are removed from the file later on
+        self.config_file_defaults = dict((name, getattr(self, name))
+            for name in CONFIG_FILE_SETTINGS.values())
+        self.CONFIG_FILE_PATH = None
+        if config_file_path != None:
+            self.CONFIG_FILE_PATH = os.path.abspath(config_file_path)
+            try:
+                self.load_config_file()
+            except Exception as ex:
+                print("Error: Could not load configuration file '%s': %s" %
+                    (config_file_path, str(ex)))
+                exit(1)
+
+        # Load the accounts and devices to watch in daemon mode, if specified
+        self.ACCOUNTS = None
+        if accounts_file_path != None:
+            try:
+                with open(accounts_file_path, "r") as accounts_file:
+                    accounts = json.load(accounts_file)
+                self.ACCOUNTS = [AccountConfig(self, **account) for account in accounts]
+                names = [account.NAME for account in self.ACCOUNTS]
+                for name in names:
+                    if names.count(name) > 1:
+                        raise ValueError("account name '%s' is not unique" % name)
+            except Exception as ex:
+                print("Error: Could not load accounts file '%s': %s" %
+                    (accounts_file_path, str(ex)))
+                exit(1)
+
+    # Apply the settings of the configuration file in place, returning settings
+    #   which it does not contain to their value from the command line or their
+    #   default. All settings are validated before any is applied, such that an
+    #   invalid file changes nothing
+    def load_config_file(self):
+        settings = parse_config_settings(read_config_file(self.CONFIG_FILE_PATH))
+        for name, value in self.config_file_defaults.items():
+            setattr(self, name, settings.get(name, value))
+
+    # Initialize spotify authentication manager, which shows a browser login dialog
+    #   if not already logged in
+    @property
+    def CLIENT_CREDENTIAL_MANAGER(self):
+        if self.__client_credential_manager == None:
+            self.__client_credential_manager = create_client_credential_manager(
+                self.SCOPE, self.AUTH_CACHE_PATH)
+        return self.__client_credential_manager
+
+
+class AccountConfig(object):
+
+    def __init__(self,
+            program_config,
+            name="",
+            target_device_name="",
+            auth_cache_path="",
+            volume_sink="Master",
+            volume_backend="alsa",
+            ad_volume_percentage=None):
+        # Each account is identified by its name in the logs and the ad index
+        if name == "":
+            raise ValueError("account without a name")
+        self.NAME = name
+
+        # A daemon watches remote devices as well, so it does not close itself if
+        #   Spotify is not an active process on this machine
+        self.AUTOMATIC_CLOSING = False
+        self.POLL_MODE = program_config.POLL_MODE
+
+        # Set the ad volume to a round integer and within the range [0-100], or
+        #   use the program's ad volume by default, see 'AD_VOLUME_PERCENTAGE'
+        self.program_config = program_config
+        self.ad_volume_percentage = None
+        if ad_volume_percentage != None:
+            self.ad_volume_percentage = \
+                min([100, max([0, round(ad_volume_percentage, 0)])])
+
+        self.TARGET_DEVICE_NAME = target_device_name.lower()
+
+        # Set the volume sink (e.g. the ALSA mixer control) which is turned down
+        #   when an ad is playing on this account's device
+        self.VOLUME_SINK = volume_sink
+        # Accounts of remote devices turn down a mixer control by default, as
+        #   Spotify's stream on this machine does not play their ads
+        if volume_backend not in ["auto", "pulse", "alsa"]:
+            raise ValueError("unknown volume backend of account '%s': %s" %
+                (name, volume_backend))
+        self.VOLUME_BACKEND = volume_backend
+
+        # Each account has its own authentication information cache
+        if auth_cache_path == "":
+            raise ValueError("account '%s' has no authentication cache path" % name)
+        dirname = os.path.dirname(os.path.abspath(auth_cache_path))
+        if os.path.exists(dirname) == False:
+            raise ValueError("authentication cache directory of account '%s' " %
+                name + "does not exist: %s" % dirname)
+        self.AUTH_CACHE_PATH = os.path.abspath(auth_cache_path)
+        self.SCOPE = program_config.SCOPE
+        self.__client_credential_manager = None
+
+    # Follow the program's ad volume, which may be changed by reloading the
+    #   configuration file, unless the account has its own ad volume
+    @property
+    def AD_VOLUME_PERCENTAGE(self):
+        if self.ad_volume_percentage != None:
+            return self.ad_volume_percentage
+        return self.program_config.AD_VOLUME_PERCENTAGE
+
+    @property
+    def CLIENT_CREDENTIAL_MANAGER(self):
+        if self.__client_credential_manager == None:
+            self.__client_credential_manager = create_client_credential_manager(
+                self.SCOPE, self.AUTH_CACHE_PATH)
+        return self.__client_credential_manager
+
+
+# Create a spotify authentication manager, importing 'spotipy' only when needed
+def create_client_credential_manager(scope, auth_cache_path):
+    import spotipy
+    return spotipy.oauth2.SpotifyPKCE(
+            scope = scope,
+            open_browser = True,
+            cache_handler=spotipy.CacheFileHandler(
+                cache_path=auth_cache_path)
+        )
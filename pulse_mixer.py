@@ -0,0 +1,143 @@
+# Audio stream of an application on the PulseAudio or PipeWire sound server
+class PulseStream(object):
+
+    def __init__(self, index, process_name, application_name, channel_count):
+        # Index of the stream's sink input on the sound server
+        self.index = index
+        self.process_name = process_name
+        self.application_name = application_name
+        self.channel_count = channel_count
+
+
+# Client of the sound server using 'pulsectl', which keeps its connection to the
+#   server's control socket open for the lifetime of the client
+class PulsectlClient(object):
+
+    def __init__(self, client_name="spotify-ad-muter"):
+        # Import 'pulsectl' only when this backend is used, as it is optional
+        import pulsectl
+        self.pulsectl = pulsectl
+        self.pulse = pulsectl.Pulse(client_name)
+
+    def list_streams(self):
+        return [PulseStream(sink_input.index,
+            sink_input.proplist.get('application.process.binary', ""),
+            sink_input.proplist.get('application.name', ""),
+            len(sink_input.volume.values))
+            for sink_input in self.pulse.sink_input_list()]
+
+    # Get the volume of each channel of a stream, as fractions of 100%
+    def get_stream_volume(self, index):
+        return self.pulse.sink_input_info(index).volume.values
+
+    # Set the volume of all channels of a stream in a single request
+    def set_stream_volume(self, index, channel_volumes):
+        self.pulse.sink_input_volume_set(index,
+            self.pulsectl.PulseVolumeInfo(channel_volumes))
+
+    def close(self):
+        self.pulse.close()
+
+
+# Mixer which changes the volume of only the streams of one application, such
+#   that other sounds on the machine keep their volume
+class PulseStreamMixer(object):
+
+    def __init__(self, process_name="spotify", client=None, client_factory=None):
+        self.process_name = process_name
+        # Client of the sound server, 'PulsectlClient' by default, and the
+        #   function which connects a new client once the connection is lost, e.g.
+        #   because the sound server restarted. A given client is not replaced
+        #   unless a function to replace it is given as well
+        self.client = client
+        self.client_factory = client_factory
+        if client == None:
+            if client_factory == None:
+                self.client_factory = PulsectlClient
+            self.client = self.client_factory()
+        # Resolved streams of the application, which are looked up again once
+        #   a request on them fails
+        self.streams = None
+        # Volume to apply to the application's streams, which is applied once
+        #   they appear if the application has no stream yet
+        self.volume = 100
+        self.is_volume_pending = False
+        # Number of times the streams were listed to resolve them, and the number
+        #   of times the client connected again
+        self.resolve_count = 0
+        self.reconnect_count = 0
+
+    def __is_target_stream(self, stream):
+        return self.process_name in stream.process_name.lower() or \
+            self.process_name in stream.application_name.lower()
+
+    # Connect a new client to the sound server, closing the old connection
+    def __reconnect(self):
+        self.reconnect_count += 1
+        try:
+            self.client.close()
+        except Exception:
+            pass
+        self.client = self.client_factory()
+
+    # List the streams on the sound server, connecting again once if the
+    #   request fails, as the connection is lost if the sound server restarts
+    def __list_streams(self):
+        try:
+            return self.client.list_streams()
+        except Exception:
+            if self.client_factory == None:
+                raise
+            self.__reconnect()
+            return self.client.list_streams()
+
+    def __resolve(self):
+        self.resolve_count += 1
+        self.streams = [stream for stream in self.__list_streams()
+            if self.__is_target_stream(stream) == True]
+        if len(self.streams) == 0:
+            self.streams = None
+        elif self.is_volume_pending == True:
+            self.is_volume_pending = False
+            self.__set_stream_volumes(self.volume)
+
+    def __set_stream_volumes(self, volume):
+        for stream in self.streams:
+            self.client.set_stream_volume(stream.index,
+                [volume / 100] * stream.channel_count)
+        return True
+
+    # Call a function on the resolved streams, resolving them again if there
+    #   are none yet or if the call fails, e.g. because a stream was closed
+    def __call(self, function):
+        if self.streams == None:
+            self.__resolve()
+            if self.streams == None:
+                return None
+            return function()
+        try:
+            return function()
+        except Exception:
+            self.__resolve()
+            if self.streams == None:
+                return None
+            return function()
+
+    # Get the volume as the mean of all channels of the application's first
+    #   stream, or the last set volume if the application has no stream
+    def get_volume(self):
+        def get_stream_volume():
+            channel_volumes = self.client.get_stream_volume(self.streams[0].index)
+            return int(round(sum(channel_volumes) / len(channel_volumes) * 100))
+        volume = self.__call(get_stream_volume)
+        if volume != None:
+            self.volume = volume
+        return self.volume
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.__call(lambda: self.__set_stream_volumes(volume)) == None:
+            self.is_volume_pending = True
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+
+
+# Kinds of the records in a capture file, of which each line is a JSON array of
+#   the wall clock time of the record, the account and the kind and body of the
+#   record:
+#   > 's': a recording client was created, the body is the target device name
+#   > 'p': a response to 'current_playback', including the active device
+#   > 'c': a response to 'currently_playing'
+#   > 'd': a response to 'devices'
+#   A failed request is recorded with a body of the form {'error': <HTTP status>}
+KIND_START = "s"
+KIND_PLAYBACK = "p"
+KIND_CURRENTLY_PLAYING = "c"
+KIND_DEVICES = "d"
+
+
+# Keep only the fields of a device which are used by the activity checker
+def compact_device(device):
+    return {
+        'id': device['id'],
+        'name': device['name'],
+        'is_active': device['is_active']}
+
+
+# Keep only the fields of a playback state which are used by the polling loop,
+#   which leaves out the track's metadata
+def compact_playback_state(playback_state):
+    if playback_state == None:
+        return None
+    item = playback_state.get('item')
+    compact_state = {
+        'currently_playing_type': playback_state.get('currently_playing_type'),
+        'is_playing': playback_state.get('is_playing'),
+        'progress_ms': playback_state.get('progress_ms'),
+        'item': None if item == None else {
+            'id': item.get('id'),
+            'duration_ms': item.get('duration_ms')}}
+    if playback_state.get('device') != None:
+        compact_state['device'] = compact_device(playback_state['device'])
+    return compact_state
+
+
+def compact_error(ex):
+    error = {'error': getattr(ex, 'http_status', None)}
+    headers = getattr(ex, 'headers', None)
+    if headers != None and headers.get('Retry-After') != None:
+        error['retry_after'] = headers.get('Retry-After')
+    return error
+
+
+# Read all records of a capture file as (timestamp, account, kind, body) tuples,
+#   skipping a partially written last line
+def read_capture(capture_file_path):
+    records = []
+    with open(capture_file_path, "r") as capture_file:
+        for line in capture_file:
+            try:
+                records.append(tuple(json.loads(line)))
+            except ValueError:
+                continue
+    return records
+
+
+# Append-only writer of a capture file, shared by the recording clients of all
+#   accounts
+class Recorder(object):
+
+    def __init__(self, capture_file_path):
+        # Write whole lines to a line buffered file, such that a record is
+        #   written out once complete and an interrupted program loses at most
+        #   its last record
+        self.capture_file = open(capture_file_path, "a", buffering=1)
+        self.lock = threading.Lock()
+        self.record_count = 0
+        self.dropped_count = 0
+
+    # Append a record, dropping it if it cannot be written, as recording must
+    #   never stop the polling loop
+    def write(self, account, kind, body, timestamp=None):
+        if timestamp == None:
+            timestamp = time.time()
+        line = json.dumps([round(timestamp, 3), account, kind, body],
+            separators=(",", ":"))
+        with self.lock:
+            try:
+                self.capture_file.write(line + "\n")
+                self.record_count += 1
+            except Exception:
+                self.dropped_count += 1
+
+    def close(self):
+        with self.lock:
+            self.capture_file.close()
+
+
+# Spotify client which records every response to the playback state and device
+#   requests of the polling loop, and passes all other calls to the wrapped client
+class RecordingClient(object):
+
+    def __init__(self, spotipy_obj, recorder, account, target_device_name):
+        self.spotipy_obj = spotipy_obj
+        self.recorder = recorder
+        self.account = account
+        recorder.write(account, KIND_START, target_device_name)
+
+    def __record(self, kind, request, compact):
+        try:
+            response = request()
+        except Exception as ex:
+            self.recorder.write(self.account, kind, compact_error(ex))
+            raise
+        self.recorder.write(self.account, kind, compact(response))
+        return response
+
+    def current_playback(self, *args, **kwargs):
+        return self.__record(KIND_PLAYBACK,
+            lambda: self.spotipy_obj.current_playback(*args, **kwargs),
+            compact_playback_state)
+
+    def currently_playing(self, *args, **kwargs):
+        return self.__record(KIND_CURRENTLY_PLAYING,
+            lambda: self.spotipy_obj.currently_playing(*args, **kwargs),
+            compact_playback_state)
+
+    def devices(self):
+        return self.__record(KIND_DEVICES, self.spotipy_obj.devices,
+            lambda response: {'devices':
+                [compact_device(device) for device in response['devices']]})
+
+    def __getattr__(self, name):
+        return getattr(self.spotipy_obj, name)
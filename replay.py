@@ -0,0 +1,543 @@
+# Import python libraries
+import argparse
+import bisect
+import os
+import random
+import spotipy
+import time
+# Import user modules
+import activity_check
+import ad_index
+import poll_loop
+import program_config
+import recorder
+import scheduler
+import spotify_ad_muter
+import volume_control
+
+
+# Largest difference between the start times of an item derived from two
+#   samples, for which both samples belong to the same playthrough of the item
+SAME_PLAYTHROUGH_TOLERANCE_S = 2
+# Volumes of the replayed mixer
+NORMAL_VOLUME = 50
+AD_VOLUME_PERCENTAGE = 10
+
+
+# Clock of which the time only advances when the polling loop sleeps, or when a
+#   simulated request takes time
+class VirtualClock(object):
+
+    def __init__(self, start_time=0):
+        self.now = start_time
+
+    def monotonic(self):
+        return self.now
+
+    # The recorded wall clock times are used as the virtual time, such that the
+    #   ad index sees the recorded time of day
+    def time(self):
+        return self.now
+
+    def sleep(self, period_s):
+        self.now += max([0, period_s])
+
+    def wait(self, event, period_s):
+        if event.is_set() == False:
+            self.sleep(period_s)
+        return event.is_set()
+
+
+# Span of a timeline during which the same item, pause, error or idle state was
+#   reported
+class Segment(object):
+
+    def __init__(self, begin_time, origin_time, key, body, sample_time):
+        # Time from which the segment is reported
+        self.begin_time = begin_time
+        # Time at which the progress of a playing item was zero
+        self.origin_time = origin_time
+        # Item type, ID and whether it is playing, or the error or idle state
+        self.key = key
+        self.body = body
+        # Time of the last sample of the segment
+        self.last_sample_time = sample_time
+
+    def is_playing_item(self):
+        return self.key[0] not in ["error", "idle"] and self.key[2] == True
+
+    def is_ad(self):
+        return self.key[0] == "ad" and self.key[2] == True
+
+    def is_track(self):
+        return (self.key[0] == "track" or self.key[0] == "episode") and \
+            self.key[2] == True
+
+
+# Timeline of a single recorded session of an account, reconstructed from the
+#   recorded samples such that it can be sampled at any other time
+class Timeline(object):
+
+    def __init__(self, account, target_device_name, start_time):
+        self.account = account
+        self.target_device_name = target_device_name
+        self.start_time = start_time
+        self.end_time = start_time
+        self.playback_samples = []
+        self.device_samples = []
+        self.segments = []
+        self.begin_times = []
+        self.device_times = []
+        # Devices reported along with the playback states, which are listed if
+        #   the capture holds no device list, and the target device, which is
+        #   added to playback states which do not report a device
+        self.playback_devices = {}
+        self.device = {
+            'id': "replay-%s" % target_device_name,
+            'name': target_device_name,
+            'is_active': True}
+
+    def add_sample(self, timestamp, kind, body):
+        if kind == recorder.KIND_DEVICES:
+            self.device_samples.append((timestamp, body))
+        else:
+            self.playback_samples.append((timestamp, body))
+        self.end_time = max([self.end_time, timestamp])
+
+    # Merge consecutive samples of the same playthrough of an item, or of the
+    #   same error or idle state, into segments
+    def build(self):
+        self.playback_samples.sort(key=lambda sample: sample[0])
+        self.device_samples.sort(key=lambda sample: sample[0])
+        self.device_times = [timestamp for timestamp, _ in self.device_samples]
+        for timestamp, body in self.playback_samples:
+            origin_time = timestamp
+            if body == None:
+                key = ("idle",)
+            elif 'error' in body:
+                key = ("error", body['error'])
+            else:
+                if body.get('device') != None:
+                    self.playback_devices[body['device']['id']] = body['device']
+                item = body['item']
+                key = (body['currently_playing_type'],
+                    item['id'] if item != None else None, body['is_playing'])
+                if body['is_playing'] == True and body['progress_ms'] != None:
+                    origin_time = timestamp - body['progress_ms'] / 1000
+            previous = self.segments[-1] if len(self.segments) > 0 else None
+            if previous != None and previous.key == key and \
+                    (previous.is_playing_item() == False or abs(origin_time -
+                    previous.origin_time) <= SAME_PLAYTHROUGH_TOLERANCE_S):
+                previous.last_sample_time = timestamp
+                continue
+            # A new item started at its origin, but not before the previous
+            #   segment was last seen
+            begin_time = origin_time
+            if previous != None:
+                begin_time = max([begin_time, previous.last_sample_time])
+            self.segments.append(Segment(begin_time, origin_time, key, body,
+                timestamp))
+            self.begin_times.append(begin_time)
+        devices = list(self.playback_devices.values())
+        if len(self.device_samples) > 0:
+            devices = self.device_samples[0][1].get('devices', []) + devices
+        for device in devices:
+            if device['name'].lower() == self.target_device_name:
+                self.device = device
+                break
+
+    def get_segment_end_time(self, index):
+        if index + 1 < len(self.segments):
+            return self.segments[index + 1].begin_time
+        return self.end_time
+
+    # Get the intervals during which the segments matching a condition played
+    def get_intervals(self, condition):
+        intervals = []
+        for index, segment in enumerate(self.segments):
+            if condition(segment) == False:
+                continue
+            start_time = max([segment.begin_time, self.start_time])
+            end_time = self.get_segment_end_time(index)
+            if len(intervals) > 0 and intervals[-1][1] >= start_time:
+                intervals[-1] = (intervals[-1][0], end_time)
+            elif end_time > start_time:
+                intervals.append((start_time, end_time))
+        return intervals
+
+    def __raise_error(self, error):
+        if error['error'] == None:
+            raise ConnectionError("Recorded request failure")
+        headers = None
+        if error.get('retry_after') != None:
+            headers = {'Retry-After': error['retry_after']}
+        raise spotipy.SpotifyException(error['error'], -1, "Recorded error",
+            headers=headers)
+
+    # Get the playback state at the given time, with the progress of a playing
+    #   item advanced from its origin
+    def get_playback_state(self, now, is_device_included=True):
+        index = max([0, bisect.bisect_right(self.begin_times, now) - 1])
+        segment = self.segments[index]
+        if segment.body == None:
+            return None
+        if 'error' in segment.body:
+            self.__raise_error(segment.body)
+        playback_state = dict(segment.body)
+        if segment.is_playing_item() == True and playback_state['progress_ms'] != None:
+            progress_ms = int((now - segment.origin_time) * 1000)
+            item = playback_state['item']
+            if item != None and item['duration_ms'] != None:
+                progress_ms = min([progress_ms, item['duration_ms']])
+            playback_state['progress_ms'] = max([0, progress_ms])
+        if is_device_included == True:
+            if playback_state.get('device') == None:
+                playback_state['device'] = self.device
+        elif 'device' in playback_state:
+            del playback_state['device']
+        return playback_state
+
+    def get_devices(self, now):
+        if len(self.device_samples) == 0:
+            if len(self.playback_devices) == 0:
+                return {'devices': [self.device]}
+            return {'devices': list(self.playback_devices.values())}
+        index = max([0, bisect.bisect_right(self.device_times, now) - 1])
+        devices = self.device_samples[index][1]
+        if 'error' in devices:
+            self.__raise_error(devices)
+        return devices
+
+
+# Read the sessions of all or of one account from a capture file, in the order
+#   in which they were recorded
+def load_timelines(capture_file_path, account=None):
+    timelines = []
+    current_timelines = {}
+    for timestamp, record_account, kind, body in \
+            recorder.read_capture(capture_file_path):
+        if account != None and record_account != account:
+            continue
+        timeline = current_timelines.get(record_account)
+        if kind == recorder.KIND_START or timeline == None:
+            target_device_name = body if kind == recorder.KIND_START else \
+                record_account
+            timeline = Timeline(record_account, target_device_name.lower(),
+                timestamp)
+            timelines.append(timeline)
+            current_timelines[record_account] = timeline
+        if kind != recorder.KIND_START:
+            timeline.add_sample(timestamp, kind, body)
+    for timeline in timelines:
+        timeline.build()
+    return [timeline for timeline in timelines if len(timeline.segments) > 0]
+
+
+# Spotify client which answers the requests of the polling loop from a timeline
+#   at the virtual time
+class ReplayClient(object):
+
+    def __init__(self, timeline, clock_obj, request_latency_s=0):
+        self.timeline = timeline
+        self.clock = clock_obj
+        # Simulated time taken by each request
+        self.request_latency_s = request_latency_s
+        self.request_counts = {}
+
+    def __request(self, kind):
+        self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+        self.clock.sleep(self.request_latency_s)
+
+    def current_playback(self, *args, **kwargs):
+        self.__request(recorder.KIND_PLAYBACK)
+        return self.timeline.get_playback_state(self.clock.now)
+
+    def currently_playing(self, *args, **kwargs):
+        self.__request(recorder.KIND_CURRENTLY_PLAYING)
+        return self.timeline.get_playback_state(self.clock.now,
+            is_device_included=False)
+
+    def devices(self):
+        self.__request(recorder.KIND_DEVICES)
+        return self.timeline.get_devices(self.clock.now)
+
+
+# Process watcher which reports Spotify as running until the session ends
+class ReplayProcessWatcher(object):
+
+    def __init__(self, clock_obj, end_time):
+        self.clock = clock_obj
+        self.end_time = end_time
+
+    def is_alive(self):
+        return self.clock.now < self.end_time
+
+
+class NullLogger(object):
+
+    def write(self, message):
+        pass
+
+
+# Mixer of which the volume changes are kept as a timeline, including the
+#   changes scheduled by a running volume ramp
+class ReplayVolumeControl(object):
+
+    def __init__(self, clock_obj, volume=NORMAL_VOLUME):
+        self.clock = clock_obj
+        self.initial_volume = volume
+        self.write_times = []
+        self.write_volumes = []
+
+    def get_volume_at(self, timestamp):
+        index = bisect.bisect_right(self.write_times, timestamp) - 1
+        return self.write_volumes[index] if index >= 0 else self.initial_volume
+
+    def get_system_volume(self):
+        return self.get_volume_at(self.clock.now)
+
+    def set_system_volume(self, volume):
+        self.schedule(self.clock.now, volume)
+
+    def schedule(self, timestamp, volume):
+        index = bisect.bisect_right(self.write_times, timestamp)
+        self.write_times.insert(index, timestamp)
+        self.write_volumes.insert(index, volume)
+
+    # Drop the changes scheduled after the given time and return their number
+    def cancel_after(self, timestamp):
+        index = bisect.bisect_right(self.write_times, timestamp)
+        cancel_count = len(self.write_times) - index
+        del self.write_times[index:]
+        del self.write_volumes[index:]
+        return cancel_count
+
+    # Get the time within the given interval during which the volume was at
+    #   most the given volume
+    def get_time_at_most(self, volume, start_time, end_time):
+        time_s = 0
+        segment_start_time = start_time
+        segment_volume = self.get_volume_at(start_time)
+        index = bisect.bisect_right(self.write_times, start_time)
+        while index < len(self.write_times) and self.write_times[index] < end_time:
+            if segment_volume <= volume:
+                time_s += self.write_times[index] - segment_start_time
+            segment_start_time = self.write_times[index]
+            segment_volume = self.write_volumes[index]
+            index += 1
+        if segment_volume <= volume:
+            time_s += end_time - segment_start_time
+        return time_s
+
+
+# Volume ramp which schedules its steps on the replayed mixer in virtual time,
+#   instead of applying them from a thread
+class VirtualVolumeRamp(volume_control.VolumeRamp):
+
+    def __init__(self, volume_controller, clock_obj, step_count=10):
+        volume_control.VolumeRamp.__init__(self, volume_controller, step_count,
+            clock_obj)
+        self.end_time = None
+
+    def start(self, target_volume, duration_s, curve="s-curve", start_volume=None,
+            start_time=None):
+        self.cancel()
+        if start_volume == None:
+            start_volume = self.volume_controller.get_system_volume()
+        self.target_volume = target_volume
+        start_time = self.clock.now if start_time == None else \
+            max([self.clock.now, start_time])
+        fractions = self.curve_fractions[curve]
+        step_period_s = duration_s / len(fractions)
+        volume = start_volume
+        for i, fraction in enumerate(fractions):
+            next_volume = int(round(start_volume +
+                (target_volume - start_volume) * fraction))
+            if next_volume != volume:
+                self.volume_controller.schedule(start_time + i * step_period_s,
+                    next_volume)
+                self.write_count += 1
+                volume = next_volume
+        self.end_time = start_time + (len(fractions) - 1) * step_period_s
+
+    def is_running(self):
+        return self.end_time != None and self.clock.now < self.end_time
+
+    def cancel(self):
+        if self.is_running() == False:
+            return False
+        self.write_count -= self.volume_controller.cancel_after(self.clock.now)
+        self.end_time = None
+        return True
+
+    def wait(self):
+        if self.is_running() == True:
+            self.clock.sleep(self.end_time - self.clock.now)
+
+
+# Configuration of a replayed account, with the program's default polling
+#   periods overridden by the settings of a strategy
+class ReplayConfig(object):
+
+    def __init__(self, name, target_device_name, poll_mode="single", settings=None):
+        self.NAME = name
+        self.TARGET_DEVICE_NAME = target_device_name
+        # Stop once the session ends, as if Spotify was closed
+        self.AUTOMATIC_CLOSING = True
+        self.POLL_MODE = poll_mode
+        self.AD_VOLUME_PERCENTAGE = AD_VOLUME_PERCENTAGE
+        for setting_name in program_config.CONFIG_FILE_SETTINGS.values():
+            if hasattr(program_config, setting_name):
+                setattr(self, setting_name, getattr(program_config, setting_name))
+        if settings != None:
+            for setting_name, value in settings.items():
+                setattr(self, setting_name, value)
+
+
+# Outcome of replaying the sessions of a capture with one strategy
+class ReplayResult(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.session_count = 0
+        self.duration_s = 0
+        self.ad_s = 0
+        self.missed_ad_s = 0
+        self.muted_track_s = 0
+        self.api_call_count = 0
+        self.poll_count = 0
+        self.premute_hit_count = 0
+        self.premute_miss_count = 0
+        self.replay_time_s = 0
+
+    def add_session(self, timeline, loop, client, volume_controller):
+        self.session_count += 1
+        self.duration_s += timeline.end_time - timeline.start_time
+        ad_volume = loop.config.AD_VOLUME_PERCENTAGE
+        # An ad is missed for as long as the volume was above the ad volume, and
+        #   a track is muted for as long as it was at most the ad volume
+        for start_time, end_time in timeline.get_intervals(
+                lambda segment: segment.is_ad()):
+            self.ad_s += end_time - start_time
+            self.missed_ad_s += end_time - start_time - \
+                volume_controller.get_time_at_most(ad_volume, start_time, end_time)
+        for start_time, end_time in timeline.get_intervals(
+                lambda segment: segment.is_track()):
+            self.muted_track_s += volume_controller.get_time_at_most(ad_volume,
+                start_time, end_time)
+        self.api_call_count += sum(client.request_counts.values())
+        self.poll_count += loop.poll_scheduler.iteration_count
+        self.premute_hit_count += loop.poll_scheduler.premute_hit_count
+        self.premute_miss_count += loop.poll_scheduler.premute_miss_count
+
+
+# Run the polling loop against a single session in virtual time
+def replay_session(timeline, config, index=None, request_latency_s=0):
+    clock_obj = VirtualClock(timeline.start_time)
+    log = NullLogger()
+    poll_scheduler = scheduler.PollScheduler(clock_obj=clock_obj)
+    spotify_ad_muter.configure_poll_scheduler(poll_scheduler, config)
+    client = ReplayClient(timeline, clock_obj, request_latency_s)
+    activity_checker = activity_check.ActivityCheck(log, client,
+        request_counter=poll_scheduler.record_api_call, clock_obj=clock_obj)
+    activity_checker.spotify_watcher = ReplayProcessWatcher(clock_obj,
+        timeline.end_time)
+    volume_controller = ReplayVolumeControl(clock_obj)
+    loop = poll_loop.PollLoop(config, client, log, activity_checker,
+        volume_controller, poll_scheduler, ad_index=index, clock_obj=clock_obj)
+    loop.volume_ramp = VirtualVolumeRamp(volume_controller, clock_obj,
+        poll_loop.RAMP_STEP_COUNT)
+    loop.run()
+    return loop, client, volume_controller
+
+
+# Replay all sessions with a strategy, given as the settings of a configuration
+#   file, seeding the backoff jitter such that strategies are compared on the
+#   same random sequence
+def replay_timelines(timelines, name, settings=None, poll_mode="single",
+        is_ad_index_enabled=False, request_latency_s=0, seed=0):
+    random.seed(seed)
+    result = ReplayResult(name)
+    # The ad index learns from the sessions in the order in which they were
+    #   recorded
+    index = ad_index.AdIndex() if is_ad_index_enabled == True else None
+    start_time = time.perf_counter()
+    for timeline in timelines:
+        config = ReplayConfig(timeline.account, timeline.target_device_name,
+            poll_mode, settings)
+        loop, client, volume_controller = replay_session(timeline, config, index,
+            request_latency_s)
+        result.add_session(timeline, loop, client, volume_controller)
+    result.replay_time_s = time.perf_counter() - start_time
+    return result
+
+
+def print_results(results):
+    print("%-24s %8s %8s %11s %13s %9s %10s %9s" % ("strategy", "hours",
+        "ad s", "missed ad s", "muted track s", "api calls", "calls/hour",
+        "replay s"))
+    for result in results:
+        duration_h = max([1e-9, result.duration_s / 3600])
+        print("%-24s %8.2f %8.1f %11.2f %13.2f %9d %10.0f %9.2f" % (
+            result.name[-24:], result.duration_s / 3600, result.ad_s,
+            result.missed_ad_s, result.muted_track_s, result.api_call_count,
+            result.api_call_count / duration_h, result.replay_time_s))
+
+
+if __name__ == "__main__":
+    # Specify the format of the command line arguments
+    arg_parser = argparse.ArgumentParser(
+        prog="replay",
+        description="Replay a capture recorded with the '--record' option " +
+            "against the polling loop in virtual time, and compare polling " +
+            "strategies on missed ad seconds and API calls.")
+    arg_parser.add_argument('capture_file_path',
+        help="File path of the capture file")
+    arg_parser.add_argument('-C', '--config',
+        default=[], action='append',
+        help="File path of a JSON or TOML configuration file with the polling " +
+            "periods of a strategy to compare, may be given several times; the " +
+            "program's defaults are replayed as well",
+        dest='config_file_paths')
+    arg_parser.add_argument('-A', '--account',
+        default=None,
+        help="Only replay the sessions of the given account",
+        dest='account')
+    arg_parser.add_argument('-m', '--poll_mode',
+        default="single", choices=["single", "dual"],
+        help="Polling mode of the replayed polling loop",
+        dest='poll_mode')
+    arg_parser.add_argument('-i', '--ad_index',
+        action='store_true',
+        help="Pre-mute likely ads using an ad index learned during the replay",
+        dest='is_ad_index_enabled')
+    arg_parser.add_argument('-L', '--latency',
+        default=0, type=float,
+        help="Simulated time taken by each API request in seconds",
+        dest='request_latency_s')
+    # Parse the command line arguments
+    args = arg_parser.parse_args()
+    # Read the strategies before the capture, such that invalid files are
+    #   reported right away
+    strategies = [("defaults", {})]
+    for config_file_path in args.config_file_paths:
+        try:
+            strategies.append((os.path.basename(config_file_path),
+                program_config.parse_config_settings(
+                    program_config.read_config_file(config_file_path))))
+        except Exception as ex:
+            print("Error: Could not load configuration file '%s': %s" %
+                (config_file_path, str(ex)))
+            exit(1)
+    try:
+        timelines = load_timelines(args.capture_file_path, args.account)
+    except Exception as ex:
+        print("Error: Could not load capture file '%s': %s" %
+            (args.capture_file_path, str(ex)))
+        exit(1)
+    if len(timelines) == 0:
+        print("Error: capture file contains no sessions")
+        exit(1)
+    print_results([replay_timelines(timelines, name, settings, args.poll_mode,
+        args.is_ad_index_enabled, args.request_latency_s)
+        for name, settings in strategies])
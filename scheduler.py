@@ -0,0 +1,243 @@
+import math
+import random
+# Import user modules
+import clock
+import metrics
+
+
+class PollScheduler(object):
+
+    def __init__(self,
+            track_sleep_max_s=10,
+            ad_sleep_s=1,
+            paused_sleep_min_s=5,
+            paused_sleep_max_s=20,
+            error_sleep_min_s=1,
+            error_sleep_s=60,
+            inactive_sleep_s=60,
+            probe_lead_s=1.0,
+            probe_period_s=0.5,
+            premute_threshold=0.7,
+            metrics_registry=None,
+            clock_obj=None):
+        # Store the bounds between which the sleep periods are chosen
+        self.track_sleep_max_s = track_sleep_max_s
+        self.ad_sleep_s = ad_sleep_s
+        self.paused_sleep_min_s = paused_sleep_min_s
+        self.paused_sleep_max_s = paused_sleep_max_s
+        self.error_sleep_min_s = error_sleep_min_s
+        self.error_sleep_s = error_sleep_s
+        self.inactive_sleep_s = inactive_sleep_s
+        # Number of consecutive errors, used for exponential backoff
+        self.error_count = 0
+        # Store the length of the fine-grained probe window right before a
+        #   predicted boundary and the polling period within that window
+        self.probe_lead_s = probe_lead_s
+        self.probe_period_s = probe_period_s
+        # Minimum probability of an ad following the current track for which the
+        #   volume is reduced at the predicted end of the track
+        self.premute_threshold = premute_threshold
+        # Clock from which the monotonic time is read, the real time by default
+        self.clock = clock_obj
+        if clock_obj == None:
+            self.clock = clock.Clock()
+        # Predicted monotonic time at which the currently playing item ends
+        self.boundary_time = None
+        # Statistics for reporting the scheduler's cost and responsiveness
+        self.start_time = self.clock.monotonic()
+        self.api_call_count = 0
+        self.iteration_count = 0
+        # Running totals of the mute and unmute latencies, such that the
+        #   statistics take constant memory however long the program runs
+        self.mute_count = 0
+        self.mute_latency_sum_s = 0
+        self.mute_latency_max_s = 0
+        self.unmute_count = 0
+        self.unmute_latency_sum_s = 0
+        self.unmute_latency_max_s = 0
+        self.backoff_count = 0
+        self.backoff_time_s = 0
+        self.premute_hit_count = 0
+        self.premute_miss_count = 0
+        self.premute_saved_s = 0
+        # Metrics of the polls and their outcomes, which do nothing if disabled
+        if metrics_registry == None:
+            metrics_registry = metrics.NullRegistry()
+        self.poll_counter = metrics_registry.counter("polls_total",
+            "Number of polls per observed playback state", ("state",))
+        self.mute_latency_histogram = metrics_registry.histogram(
+            "mute_latency_seconds", "Time an ad was audible before it was muted")
+        self.unmute_latency_histogram = metrics_registry.histogram(
+            "unmute_latency_seconds", "Time a track played at ad volume")
+        self.backoff_counter = metrics_registry.counter("backoff_seconds_total",
+            "Time spent backing off after errors")
+
+    def record_api_call(self, count=1):
+        self.api_call_count += count
+
+    def record_iteration(self):
+        self.iteration_count += 1
+
+    # Register the moment an ad is detected, the progress of that ad is the
+    #   time for which it was audible before the volume was reduced
+    def record_mute(self, ad_progress_ms):
+        if ad_progress_ms != None:
+            latency_s = ad_progress_ms / 1000
+            self.mute_count += 1
+            self.mute_latency_sum_s += latency_s
+            self.mute_latency_max_s = max([self.mute_latency_max_s, latency_s])
+            self.mute_latency_histogram.observe(latency_s)
+
+    # Register the outcome of reducing the volume at a predicted track end, and
+    #   if an ad did follow, the time it would otherwise have been audible
+    def record_premute(self, is_hit, saved_s=0):
+        if is_hit == True:
+            self.premute_hit_count += 1
+            self.premute_saved_s += saved_s
+        else:
+            self.premute_miss_count += 1
+
+    # Register the moment a track is detected after an ad, the progress of
+    #   that track is the time for which it played at ad volume
+    def record_unmute(self, track_progress_ms):
+        if track_progress_ms != None:
+            latency_s = track_progress_ms / 1000
+            self.unmute_count += 1
+            self.unmute_latency_sum_s += latency_s
+            self.unmute_latency_max_s = max([self.unmute_latency_max_s, latency_s])
+            self.unmute_latency_histogram.observe(latency_s)
+
+    # Get the length of the probe window before the end of a track, which is
+    #   widened if the track is more likely to be followed by an ad, but never
+    #   narrower than the configured probe window. It is widened by whole probe
+    #   periods, such that the last probe still falls on the predicted boundary
+    def get_probe_lead_s(self, ad_probability=0.5):
+        widening_s = self.probe_lead_s * (ad_probability - 0.5)
+        if widening_s <= 0 or self.probe_period_s <= 0:
+            return self.probe_lead_s
+        return self.probe_lead_s + \
+            math.ceil(widening_s / self.probe_period_s) * self.probe_period_s
+
+    def next_track_sleep_period(self, progress_ms, duration_ms, is_playing,
+            ad_probability=0.5):
+        self.error_count = 0
+        remaining_s = (duration_ms - progress_ms) / 1000
+        # A paused track has no upcoming boundary, poll at a relaxed rate
+        if is_playing == False:
+            self.poll_counter.inc(("paused",))
+            self.boundary_time = None
+            return max([self.paused_sleep_min_s,
+                min([self.paused_sleep_max_s, remaining_s])])
+        self.poll_counter.inc(("track",))
+        return self.__next_boundary_sleep_period(remaining_s,
+            self.track_sleep_max_s, self.get_probe_lead_s(ad_probability))
+
+    # Check if the volume should be reduced at the predicted end of the current
+    #   track, which is done once within the probe window if an ad is likely
+    def should_premute(self, ad_probability):
+        if self.boundary_time == None or self.premute_threshold == None:
+            return False
+        return ad_probability >= self.premute_threshold and \
+            self.boundary_time - self.clock.monotonic() <= \
+                self.get_probe_lead_s(ad_probability)
+
+    def next_ad_sleep_period(self, progress_ms, duration_ms, is_playing,
+            block_remaining_s=None):
+        self.error_count = 0
+        if is_playing == False:
+            self.poll_counter.inc(("paused",))
+            self.boundary_time = None
+            return self.paused_sleep_min_s
+        self.poll_counter.inc(("ad",))
+        # The API does not always provide ad details, fall back to fixed polling
+        if progress_ms == None or duration_ms == None:
+            self.boundary_time = None
+            return self.ad_sleep_s
+        remaining_s = (duration_ms - progress_ms) / 1000
+        # If the block of ads is expected to last past the end of this ad, the
+        #   next item is likely another ad, which needs no volume change. Skip the
+        #   probe window and poll once right after the boundary instead
+        if block_remaining_s != None and \
+                block_remaining_s > remaining_s + self.probe_lead_s:
+            self.boundary_time = self.clock.monotonic() + remaining_s
+            return remaining_s + self.probe_period_s
+        return self.__next_boundary_sleep_period(remaining_s, remaining_s)
+
+    def next_error_sleep_period(self, ex=None):
+        self.boundary_time = None
+        # Honour the delay requested by the Spotify API when rate limited
+        sleep_period_s = self.__get_retry_after(ex)
+        # Otherwise back off exponentially with the number of consecutive errors,
+        #   with jitter to spread out the retries
+        if sleep_period_s == None:
+            backoff_max_s = min([self.error_sleep_s,
+                self.error_sleep_min_s * 2 ** min([self.error_count, 32])])
+            sleep_period_s = random.uniform(backoff_max_s / 2, backoff_max_s)
+        self.error_count += 1
+        self.backoff_count += 1
+        self.backoff_time_s += sleep_period_s
+        self.poll_counter.inc(("error",))
+        self.backoff_counter.inc(amount=sleep_period_s)
+        return sleep_period_s
+
+    # Nothing is playing on the target device, which is not an error and is
+    #   polled at a fixed relaxed rate rather than backed off from
+    def next_inactive_sleep_period(self):
+        self.error_count = 0
+        self.boundary_time = None
+        self.poll_counter.inc(("inactive",))
+        return self.inactive_sleep_s
+
+    def __get_retry_after(self, ex):
+        headers = getattr(ex, 'headers', None)
+        if getattr(ex, 'http_status', None) != 429 or headers == None:
+            return None
+        try:
+            return max([0, float(headers.get('Retry-After'))])
+        except (TypeError, ValueError):
+            return None
+
+    def __next_boundary_sleep_period(self, remaining_s, sleep_max_s,
+            probe_lead_s=None):
+        if probe_lead_s == None:
+            probe_lead_s = self.probe_lead_s
+        # Predict the instant at which the playing item ends
+        self.boundary_time = self.clock.monotonic() + remaining_s
+        # Within the probe window, poll at a fine-grained period until the next
+        #   item is reported
+        if remaining_s <= probe_lead_s:
+            return self.probe_period_s
+        # Otherwise sleep long, but wake up right before the predicted boundary
+        return max([self.probe_period_s,
+            min([sleep_max_s, remaining_s - probe_lead_s])])
+
+    def get_statistics(self):
+        elapsed_h = max([1e-9, (self.clock.monotonic() - self.start_time) / 3600])
+        statistics = {
+            'api_calls': self.api_call_count,
+            'api_calls_per_hour': self.api_call_count / elapsed_h,
+            'api_calls_per_iteration':
+                self.api_call_count / max([1, self.iteration_count]),
+            'mute_count': self.mute_count,
+            'unmute_count': self.unmute_count,
+            'backoff_count': self.backoff_count,
+            'backoff_s': float(self.backoff_time_s),
+            'premute_hits': self.premute_hit_count,
+            'premute_misses': self.premute_miss_count,
+            'premute_saved_s': float(self.premute_saved_s)}
+        # Summarize the latencies between a boundary and the volume change
+        for name, count, latency_sum_s, latency_max_s in [
+                ('mute', self.mute_count, self.mute_latency_sum_s,
+                    self.mute_latency_max_s),
+                ('unmute', self.unmute_count, self.unmute_latency_sum_s,
+                    self.unmute_latency_max_s)]:
+            if count > 0:
+                statistics['%s_latency_mean_s' % name] = latency_sum_s / count
+                statistics['%s_latency_max_s' % name] = float(latency_max_s)
+        return statistics
+
+    def format_statistics(self):
+        statistics = self.get_statistics()
+        return ", ".join(
+            ("%s = %.2f" if isinstance(value, float) else "%s = %d") %
+            (name, value) for name, value in statistics.items())
@@ -1,21 +1,63 @@
 # Import python libraries
 import argparse
 import atexit
-import spotipy
 import time
-# Import user modules
-import activity_check
+# Import user modules which are light to load; the modules which pull in heavy
+#   libraries (e.g. 'spotipy' and 'requests') are imported after the lock check,
+#   such that a duplicate instance exits without paying for them
+import instance_lock
 import logger
 import program_config
-import volume_control
+import scheduler
 
 
-# Set program constants
-SLEEP_PERIOD_ERROR_S = 60
-SLEEP_PERIOD_PAUSED_MIN_S = 5
-SLEEP_PERIOD_PAUSED_MAX_S = 20
-SLEEP_PERIOD_PLAYING_TRACK_S = 10
-SLEEP_PERIOD_PLAYING_AD_S = 1
+# Set program constants, the polling periods are part of the program
+#   configuration, see 'program_config'
+HTTP_CONNECT_TIMEOUT_S = 3.05
+HTTP_READ_TIMEOUT_S = 6
+DAEMON_WORKER_COUNT = 8
+
+
+# Create scheduler object which predicts the sleep period until the next track
+#   or ad boundary, using the polling periods of the given program configuration
+#   or by default those of the 'program_config' module
+def create_poll_scheduler(config=program_config, metrics_registry=None):
+    poll_scheduler = scheduler.PollScheduler(metrics_registry=metrics_registry)
+    configure_poll_scheduler(poll_scheduler, config)
+    return poll_scheduler
+
+
+# Set the polling periods of a scheduler in place, which keeps its statistics
+#   and its prediction of the next boundary
+def configure_poll_scheduler(poll_scheduler, config):
+    poll_scheduler.track_sleep_max_s = config.SLEEP_PERIOD_PLAYING_TRACK_MAX_S
+    poll_scheduler.ad_sleep_s = config.SLEEP_PERIOD_PLAYING_AD_S
+    poll_scheduler.paused_sleep_min_s = config.SLEEP_PERIOD_PAUSED_MIN_S
+    poll_scheduler.paused_sleep_max_s = config.SLEEP_PERIOD_PAUSED_MAX_S
+    poll_scheduler.error_sleep_min_s = config.SLEEP_PERIOD_ERROR_MIN_S
+    poll_scheduler.error_sleep_s = config.SLEEP_PERIOD_ERROR_S
+    poll_scheduler.inactive_sleep_s = config.SLEEP_PERIOD_INACTIVE_S
+    poll_scheduler.probe_lead_s = config.PROBE_LEAD_S
+    poll_scheduler.probe_period_s = config.SLEEP_PERIOD_PROBE_S
+
+
+# Reload the configuration file and apply it in place to the program
+#   configuration and the schedulers, keeping the HTTP session, the mute state
+#   and the lock, and return the time it took
+def reload_config(config, poll_schedulers, log):
+    start_time = time.perf_counter()
+    try:
+        config.load_config_file()
+    except Exception as ex:
+        log.write("Error: Could not reload configuration file '%s', keeping " %
+            config.CONFIG_FILE_PATH + "the previous configuration: %s" % str(ex))
+        return None
+    for poll_scheduler in poll_schedulers:
+        configure_poll_scheduler(poll_scheduler, config)
+    reload_time_s = time.perf_counter() - start_time
+    log.write("Reloaded configuration file '%s' in %.2f ms" %
+        (config.CONFIG_FILE_PATH, reload_time_s * 1000))
+    return reload_time_s
 
 
 if __name__ == "__main__":
@@ -46,6 +88,47 @@ if __name__ == "__main__":
         default=None,
         help="File path of the file in which to store program log information",
         dest='log_file_path')
+    arg_parser.add_argument('-m', '--poll_mode',
+        default="single", choices=["single", "dual"],
+        help="Request the playback state and active device in a single API " +
+            "request or in two separate requests",
+        dest='poll_mode')
+    arg_parser.add_argument('-r', '--run_mode',
+        default="async", choices=["async", "sync"],
+        help="Run the API requests, process check and volume changes as " +
+            "concurrent tasks with deadlines or one after the other",
+        dest='run_mode')
+    arg_parser.add_argument('-D', '--accounts',
+        default=None,
+        help="File path of a JSON file listing the accounts, devices and " +
+            "volume sinks to watch from a single daemon process",
+        dest='accounts_file_path')
+    arg_parser.add_argument('-M', '--metrics_port',
+        default=None, type=int,
+        help="Local port on which to serve metrics in the Prometheus text " +
+            "format at '/metrics'",
+        dest='metrics_port')
+    arg_parser.add_argument('-F', '--metrics_file',
+        default=None,
+        help="File path of the file to which to periodically write metrics in " +
+            "the Prometheus text format",
+        dest='metrics_file_path')
+    arg_parser.add_argument('-C', '--config',
+        default=None,
+        help="File path of a JSON or TOML configuration file with the ad " +
+            "volume, target device and polling periods, which is reloaded " +
+            "whenever it changes",
+        dest='config_file_path')
+    arg_parser.add_argument('-b', '--volume_backend',
+        default="auto", choices=["auto", "pulse", "alsa"],
+        help="Turn down only Spotify's stream on the PulseAudio or PipeWire " +
+            "sound server, or the ALSA mixer control, on Linux",
+        dest='volume_backend')
+    arg_parser.add_argument('-R', '--record',
+        default=None,
+        help="File path of the file to which to append every playback state " +
+            "and device response, for replaying them offline with 'replay.py'",
+        dest='record_file_path')
     # Parse the command line arguments
     args = arg_parser.parse_args()
     # Validate the arguments as and generate a program configuration
@@ -54,122 +137,145 @@ if __name__ == "__main__":
         args.ad_volume_percentage,
         args.target_device_name,
         args.auth_cache_path,
-        args.log_file_path)
+        args.log_file_path,
+        args.poll_mode,
+        args.run_mode,
+        args.accounts_file_path,
+        args.metrics_port,
+        args.metrics_file_path,
+        args.config_file_path,
+        args.volume_backend,
+        args.record_file_path)
 
     # Create a logger object and redirect STDOUT to the object for writes,
     #   causing all 'print' statements to print both to STDOUT and the log file
     log = logger.Logger(config.LOG_FILE_PATH)
-    # Initialize Spotify client object
-    try:
-        sp = spotipy.Spotify(
-            auth_manager=config.CLIENT_CREDENTIAL_MANAGER,
-            requests_timeout=30,
-            backoff_factor=0.6)
-    except Exception as ex:
-        logger.write("Error: Could not initialize Spotify object: %s" % str(ex))
-        exit(1)
-    # Create activity checker object for tracking process and device activity
-    activity_checker = activity_check.ActivityCheck(log, sp)
     # Check if instance of this program is already running:
     #   > if true, exit
-    #   > else, create a lock file
-    if (activity_checker.lock_activities(config.LOCK_FILE_PATH) == False):
+    #   > else, hold the lock until this process exits
+    lock = instance_lock.InstanceLock(log, config.LOCK_FILE_PATH)
+    if lock.lock() == False:
         log.write("Error: Instance already running")
         exit(1)
-    # Register the unlock function as function handler on program exit
-    atexit.register(activity_checker.unlock_activities, config.LOCK_FILE_PATH)
-    # Create volume control object for system independent volume control
-    volume_controller = volume_control.VolumeControl(log)
-    # Get initial system volume
-    normal_volume = volume_controller.get_system_volume()
-    is_ad = False
-
-    while config.AUTOMATIC_CLOSING == False or activity_checker.is_spotify_active() == True:
-        # Reset next sleep period
-        sleep_period_s = SLEEP_PERIOD_ERROR_S
-        # Check if target device is currently active
-        if activity_checker.is_target_device_active(config.TARGET_DEVICE_NAME) == False:
-            if is_ad == True:
-                volume_controller.set_system_volume(normal_volume)
-                is_ad = False
-            log.write("Error: Target device is not currently active")
-            time.sleep(sleep_period_s)
-            continue
-        # Attempt to extract current playback state information
+    # Import the remaining python libraries and user modules
+    import asyncio
+    import spotipy
+    import activity_check
+    import ad_index
+    import config_watcher
+    import daemon
+    import http_session
+    import metrics
+    import poll_loop
+    import volume_control
+    # Collect metrics only if they are served or written to a file
+    metrics_registry = None
+    if config.METRICS_ENABLED == True:
+        metrics_registry = metrics.MetricsRegistry()
+    if config.METRICS_PORT != None:
         try:
-            playback_state = sp.currently_playing(additional_types='track,episode')
-        # Report specific Spotify API error
-        except spotipy.client.SpotifyException as ex:
-            if is_ad == True:
-                volume_controller.set_system_volume(normal_volume)
-                is_ad = False
-            log.write("Error: {HTTP status = %d; HTTP message = %s;}" %
-                (ex.http_status, ex.msg))
-            time.sleep(sleep_period_s)
-            continue
-        # Report any other random error
+            metrics.MetricsServer(metrics_registry, config.METRICS_PORT).start()
         except Exception as ex:
-            if is_ad == True:
-                volume_controller.set_system_volume(normal_volume)
-                is_ad = False
-            log.write("Error: unexpected error occurred: %s" % str(ex))
-            time.sleep(sleep_period_s)
-            continue
-        # Print error if playback state is empty
-        if playback_state == None:
-            if is_ad == True:
-                volume_controller.set_system_volume(normal_volume)
-                is_ad = False
-            log.write("No playback state found")
-            time.sleep(sleep_period_s)
-            continue
-
-        # Extract useful information from obtained Spotify playback state
-        currently_playing_type = playback_state['currently_playing_type']
-        is_playing = playback_state['is_playing']
-        # If Spotify is currently playing a track...
-        if currently_playing_type == "track" or currently_playing_type == "episode":
-            # If on the iteration before an ad was playing, restore the system volume
-            if is_ad == True:
-                # Add a small delay before resetting the volume, playback on device may
-                #   lag slightly compared to the Spotify API requests
-                time.sleep(1)
-                volume_controller.set_system_volume(normal_volume)
-                is_ad = False
-            track_progress_ms = playback_state['progress_ms']
-            track_duration_ms = playback_state['item']['duration_ms']
-            track_remaining_s = (track_duration_ms - track_progress_ms) / 1000
-            # Set sleep period based on if track is paused or, if active, its
-            #   remaining play time
-            if is_playing == False:
-                sleep_period_s = max([SLEEP_PERIOD_PAUSED_MIN_S,
-                    min([SLEEP_PERIOD_PAUSED_MAX_S, track_remaining_s])])
-                log.write("track is active, but paused")
-            else:
-                sleep_period_s = min([SLEEP_PERIOD_PLAYING_TRACK_S, track_remaining_s])
-                log.write("track is active, with %ds remaining" % track_remaining_s)
-        # If Spotify is currently playing an ad...
-        elif currently_playing_type == "ad":
-            # If on the iteration before a track was playing, reduce the system volume
-            if is_ad == False:
-                # Save the current volume to restore later after ads are done playing
-                normal_volume = volume_controller.get_system_volume()
-                volume_controller.set_system_volume(config.AD_VOLUME_PERCENTAGE)
-                is_ad = True
-            # Set sleep period based on if ad is paused or not
-            if is_playing == False:
-                sleep_period_s = SLEEP_PERIOD_PAUSED_MIN_S
-                log.write("ad is active, but paused")
-            else:
-                sleep_period_s = SLEEP_PERIOD_PLAYING_AD_S
-                log.write("ad is active")
-        else:
-            log.write("Error: Unknown type playing")
-        # Suspend program for previously determined period
-        time.sleep(sleep_period_s)
-
-    # Exit gracefully if Spotify is not running on this device by returning
-    #   the system volume to normal and quiting execution
-    log.write("Spotify is not a running process; quitting...")
-    volume_controller.set_system_volume(normal_volume)
+            log.write("Error: Could not serve metrics on port %d: %s" %
+                (config.METRICS_PORT, str(ex)))
+            exit(1)
+    if config.METRICS_FILE_PATH != None:
+        metrics_file_writer = metrics.MetricsFileWriter(metrics_registry,
+            config.METRICS_FILE_PATH)
+        metrics_file_writer.start()
+        # Write the final metrics on program exit
+        atexit.register(metrics_file_writer.stop)
+    # Append the responses of all accounts to the capture file, if specified
+    capture_recorder = None
+    if config.RECORD_FILE_PATH != None:
+        import recorder
+        try:
+            capture_recorder = recorder.Recorder(config.RECORD_FILE_PATH)
+        except Exception as ex:
+            log.write("Error: Could not open capture file '%s': %s" %
+                (config.RECORD_FILE_PATH, str(ex)))
+            exit(1)
+        atexit.register(capture_recorder.close)
+    # Share a connection-pooled session between the Spotify client objects, of
+    #   which failed requests are retried by the poll scheduler
+    session = http_session.HttpSession(
+        pool_maxsize=DAEMON_WORKER_COUNT,
+        connect_timeout_s=HTTP_CONNECT_TIMEOUT_S,
+        read_timeout_s=HTTP_READ_TIMEOUT_S,
+        metrics_registry=metrics_registry)
+    # Load the index of previously seen ads, which is shared by all accounts
+    index = ad_index.AdIndex(config.AD_INDEX_PATH)
+    # Reload the configuration file in place whenever it changes, applying the
+    #   polling periods to the schedulers of all accounts
+    poll_schedulers = []
+    if config.CONFIG_FILE_PATH != None:
+        config_watcher.ConfigWatcher(config.CONFIG_FILE_PATH,
+            lambda: reload_config(config, poll_schedulers, log)).start()
+    # In daemon mode, watch every account from a single dispatcher, sharing the
+    #   connection pool and worker threads, until the program is stopped
+    if config.ACCOUNTS != None:
+        poll_loops = {}
+        for account in config.ACCOUNTS:
+            account_log = logger.PrefixLogger(log, account.NAME)
+            try:
+                account_sp = spotipy.Spotify(
+                    auth_manager=account.CLIENT_CREDENTIAL_MANAGER,
+                    requests_session=session.session,
+                    requests_timeout=session.timeout)
+            except Exception as ex:
+                account_log.write("Error: Could not initialize Spotify object: %s" %
+                    str(ex))
+                exit(1)
+            if capture_recorder != None:
+                account_sp = recorder.RecordingClient(account_sp, capture_recorder,
+                    account.NAME, account.TARGET_DEVICE_NAME)
+            account_scheduler = create_poll_scheduler(config, metrics_registry)
+            poll_schedulers.append(account_scheduler)
+            account_activity_checker = activity_check.ActivityCheck(account_log,
+                account_sp, request_counter=account_scheduler.record_api_call,
+                metrics_registry=metrics_registry)
+            poll_loops[account.NAME] = poll_loop.PollLoop(account, account_sp,
+                account_log, account_activity_checker,
+                volume_control.VolumeControl(account_log, account.VOLUME_SINK,
+                    metrics_registry, account.VOLUME_BACKEND,
+                    pid_source=account_activity_checker.spotify_watcher.get_pid),
+                account_scheduler, session, ad_index=index)
+        try:
+            asyncio.run(daemon.Daemon(log, poll_loops, DAEMON_WORKER_COUNT).run())
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+    # Initialize the Spotify client object and the scheduler of the single
+    #   account, which are only needed outside of daemon mode
+    try:
+        sp = spotipy.Spotify(
+            auth_manager=config.CLIENT_CREDENTIAL_MANAGER,
+            requests_session=session.session,
+            requests_timeout=session.timeout)
+    except Exception as ex:
+        log.write("Error: Could not initialize Spotify object: %s" % str(ex))
+        exit(1)
+    if capture_recorder != None:
+        sp = recorder.RecordingClient(sp, capture_recorder, config.NAME,
+            config.TARGET_DEVICE_NAME)
+    poll_scheduler = create_poll_scheduler(config, metrics_registry)
+    poll_schedulers.append(poll_scheduler)
+    # Create activity checker object for tracking process and device activity
+    activity_checker = activity_check.ActivityCheck(log, sp,
+        request_counter=poll_scheduler.record_api_call,
+        metrics_registry=metrics_registry)
+    # Create volume control object for system independent volume control, which
+    #   changes the volume of the watched Spotify process on Windows
+    volume_controller = volume_control.VolumeControl(log,
+        metrics_registry=metrics_registry, backend=config.VOLUME_BACKEND,
+        pid_source=activity_checker.spotify_watcher.get_pid)
+    # Create the polling loop, which gets the initial system volume, and run it
+    #   either synchronously or as concurrent asynchronous tasks until Spotify is
+    #   no longer active
+    loop = poll_loop.PollLoop(config, sp, log, activity_checker,
+        volume_controller, poll_scheduler, session, ad_index=index)
+    if config.RUN_MODE == "async":
+        asyncio.run(loop.run_async())
+    else:
+        loop.run()
     exit(0)
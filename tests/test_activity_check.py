@@ -0,0 +1,91 @@
+import unittest
+# Import user modules
+import activity_check
+
+
+# Spotify client which returns a fixed device list and counts the requests
+class FakeSpotify(object):
+
+    def __init__(self, devices):
+        self.devices_list = devices
+        self.request_count = 0
+
+    def devices(self):
+        self.request_count += 1
+        return {'devices': self.devices_list}
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeLogger(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message):
+        self.messages.append(message)
+
+
+def create_device(device_id, name, is_active=True):
+    return {'id': device_id, 'name': name, 'type': "Computer",
+        'is_active': is_active, 'is_restricted': device_id == None}
+
+
+class PlaybackDeviceTest(unittest.TestCase):
+
+    def create_activity_check(self, devices):
+        self.sp = FakeSpotify(devices)
+        self.clock = FakeClock()
+        self.log = FakeLogger()
+        return activity_check.ActivityCheck(self.log, self.sp,
+            device_cache_ttl_s=300, clock_obj=self.clock)
+
+    def test_known_device_is_served_from_cache(self):
+        checker = self.create_activity_check([create_device("id-1", "Desk"),
+            create_device("id-2", "Phone", is_active=False)])
+        for i in range(10):
+            self.assertTrue(checker.is_playback_device_target(
+                {'device': create_device("id-1", "Desk")}, "desk"))
+            self.assertFalse(checker.is_playback_device_target(
+                {'device': create_device("id-2", "Phone")}, "desk"))
+        self.assertEqual(self.sp.request_count, 1)
+        # The cache is refreshed once it goes stale
+        self.clock.now = 301
+        checker.is_playback_device_target({'device': create_device("id-1", "Desk")},
+            "desk")
+        self.assertEqual(self.sp.request_count, 2)
+
+    def test_unknown_device_refreshes_cache_once(self):
+        checker = self.create_activity_check([create_device("id-1", "Desk")])
+        self.assertFalse(checker.is_playback_device_target(
+            {'device': create_device("id-3", "Speaker")}, "desk"))
+        self.assertEqual(self.sp.request_count, 2)
+        self.assertEqual(self.log.messages, ["Error: Unknown device 'Speaker' is active"])
+
+    def test_device_without_id_does_not_refresh_cache(self):
+        restricted_device = create_device(None, "Desk")
+        checker = self.create_activity_check([restricted_device,
+            create_device("id-2", "Phone", is_active=False)])
+        for i in range(10):
+            self.assertTrue(checker.is_playback_device_target(
+                {'device': restricted_device}, "desk"))
+            self.assertFalse(checker.is_playback_device_target(
+                {'device': restricted_device}, "phone"))
+        self.assertEqual(self.sp.request_count, 0)
+        self.assertEqual(self.log.messages, [])
+
+    def test_no_device(self):
+        checker = self.create_activity_check([])
+        self.assertFalse(checker.is_playback_device_target({}, "desk"))
+        self.assertEqual(self.sp.request_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
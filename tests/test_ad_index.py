@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+# Import user modules
+import ad_index
+import scheduler
+
+
+class AdIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_file_path = os.path.join(self.directory, "ad_index.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        index = ad_index.AdIndex(self.index_file_path)
+        index.record_ad("ad-1", 15000)
+        index.record_ad_block("account", 1000, 30)
+        index.save()
+        loaded_index = ad_index.AdIndex(self.index_file_path)
+        self.assertEqual(loaded_index.get_ad_duration_ms("ad-1"), 15000)
+        self.assertEqual(loaded_index.get_ad_block_length_s("account"), 30)
+        self.assertFalse(os.path.exists("%s.tmp" % self.index_file_path))
+
+    def write_index_file(self, index):
+        with open(self.index_file_path, "w") as index_file:
+            json.dump(index, index_file)
+
+    def create_index_document(self):
+        return {
+            'ads': [["ad-1", {'duration_ms': 15000, 'count': 2}],
+                ["ad-2", {'duration_ms': None, 'count': 1}]],
+            'track_end_counts': [2] * 24,
+            'ad_follow_counts': [1] * 24,
+            'accounts': [["account", {'block_length_s': 30,
+                'block_interval_s': 300, 'last_block_timestamp': 1000}]]}
+
+    def test_valid_document_is_loaded(self):
+        self.write_index_file(self.create_index_document())
+        index = ad_index.AdIndex(self.index_file_path)
+        self.assertEqual(index.get_ad_duration_ms("ad-1"), 15000)
+        self.assertEqual(index.track_end_counts, [2] * 24)
+        self.assertEqual(index.get_ad_block_length_s("account"), 30)
+        # The least recently used entries are evicted if the index is smaller
+        index = ad_index.AdIndex(self.index_file_path, max_ad_count=1)
+        self.assertEqual(list(index.ads), ["ad-2"])
+
+    def test_invalid_document_starts_empty(self):
+        invalid_documents = [[], {}]
+        for key, value in [
+                ('ads', {"ad-1": {'duration_ms': 15000, 'count': 2}}),
+                ('ads', [["ad-1", {'duration_ms': "15000", 'count': 2}]]),
+                ('ads', [["ad-1", {'duration_ms': 15000}]]),
+                ('track_end_counts', [2] * 23),
+                ('track_end_counts', [2] * 25),
+                ('ad_follow_counts', [1] * 23 + [-1]),
+                ('ad_follow_counts', [1] * 23 + [None]),
+                ('accounts', [["account", {'block_length_s': None,
+                    'block_interval_s': 300, 'last_block_timestamp': 1000}]]),
+                ('accounts', [["account", None]])]:
+            document = self.create_index_document()
+            document[key] = value
+            invalid_documents.append(document)
+        for document in invalid_documents:
+            self.write_index_file(document)
+            index = ad_index.AdIndex(self.index_file_path)
+            self.assertEqual(len(index.ads), 0)
+            self.assertEqual(index.track_end_counts, [0] * 24)
+            self.assertEqual(index.ad_follow_counts, [0] * 24)
+            self.assertEqual(len(index.accounts), 0)
+            # The empty index can be used
+            index.record_track_end(True, 0)
+            index.get_ad_probability("account", 0)
+
+    def test_concurrent_saves(self):
+        index = ad_index.AdIndex(self.index_file_path)
+        errors = []
+        def record_and_save(thread_index):
+            for i in range(100):
+                index.record_ad("ad-%d-%d" % (thread_index, i), 15000)
+                try:
+                    index.save()
+                except Exception as ex:
+                    errors.append(ex)
+        threads = [threading.Thread(target=record_and_save, args=(i,))
+            for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(ad_index.AdIndex(self.index_file_path).ads), 512)
+
+    def test_ads_are_evicted_in_least_recently_used_order(self):
+        index = ad_index.AdIndex(max_ad_count=2)
+        index.record_ad("ad-1", 10000)
+        index.record_ad("ad-2", 20000)
+        index.record_ad("ad-1", None)
+        index.record_ad("ad-3", 30000)
+        self.assertEqual(index.get_ad_duration_ms("ad-1"), 10000)
+        self.assertEqual(index.get_ad_duration_ms("ad-2"), None)
+        self.assertEqual(index.get_ad_duration_ms("ad-3"), 30000)
+
+    def test_ad_probability_rises_until_next_block_is_due(self):
+        index = ad_index.AdIndex()
+        # Blocks of 30 s every 300 s, leaving 270 s between them
+        for i in range(3):
+            index.record_ad_block("account", i * 300, 30)
+        prior_probability = index.get_ad_probability("other account", 630)
+        self.assertEqual(index.get_ad_probability("account", 630), prior_probability)
+        probabilities = [index.get_ad_probability("account", timestamp)
+            for timestamp in [630, 700, 800, 900]]
+        self.assertEqual(probabilities, sorted(probabilities))
+        self.assertEqual(index.get_ad_probability("account", 900), 1)
+
+
+class ProbeWindowTest(unittest.TestCase):
+
+    def test_probe_window_is_only_widened(self):
+        poll_scheduler = scheduler.PollScheduler(probe_lead_s=1.0,
+            probe_period_s=0.5)
+        for ad_probability in [0, 0.2, 0.5]:
+            self.assertEqual(poll_scheduler.get_probe_lead_s(ad_probability), 1.0)
+        self.assertEqual(poll_scheduler.get_probe_lead_s(0.6), 1.5)
+        self.assertEqual(poll_scheduler.get_probe_lead_s(1), 1.5)
+
+    def test_ad_block_skips_probe_window(self):
+        poll_scheduler = scheduler.PollScheduler(probe_lead_s=1.0,
+            probe_period_s=0.5)
+        # Another ad is expected after this one, poll right after the boundary
+        self.assertEqual(poll_scheduler.next_ad_sleep_period(5000, 15000, True,
+            block_remaining_s=20), 10.5)
+        # The block is expected to end with this ad, probe before the boundary
+        self.assertEqual(poll_scheduler.next_ad_sleep_period(5000, 15000, True,
+            block_remaining_s=10), 9.0)
+        self.assertEqual(poll_scheduler.next_ad_sleep_period(5000, 15000, True), 9.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+# Import user modules
+import volume_control
+
+
+# Volume interface of a fake audio session, which fails the given number of
+#   calls
+class FakeVolumeInterface(object):
+
+    def __init__(self, volume=1.0):
+        self.volume = volume
+        self.failure_count = 0
+
+    def __check_failure(self):
+        if self.failure_count > 0:
+            self.failure_count -= 1
+            raise OSError("session disconnected")
+
+    def GetMasterVolume(self):
+        self.__check_failure()
+        return self.volume
+
+    def SetMasterVolume(self, volume, event_context):
+        self.__check_failure()
+        self.volume = volume
+
+
+# Session provider which lists fake audio sessions instead of those of Windows
+class FakeSessionProvider(object):
+
+    def __init__(self):
+        self.sessions = []
+        self.expired_interfaces = []
+
+    def add_session(self, pid, process_name, volume=1.0):
+        volume_interface = FakeVolumeInterface(volume)
+        self.sessions.append(volume_control.AudioSession(pid, process_name,
+            lambda: volume_interface,
+            lambda: volume_interface in self.expired_interfaces))
+        return volume_interface
+
+    # Expire the session with the given volume interface and list a new session
+    #   of the same process instead
+    def replace_session(self, volume_interface):
+        self.expired_interfaces.append(volume_interface)
+        for i, session in enumerate(self.sessions):
+            if session.get_volume_interface() is volume_interface:
+                self.sessions.pop(i)
+                return self.add_session(session.pid, session.process_name)
+
+    def get_sessions(self):
+        return iter(self.sessions)
+
+
+class AudioSessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.provider = FakeSessionProvider()
+        self.other_interface = self.provider.add_session(10, "firefox.exe")
+        self.spotify_interface = self.provider.add_session(20, "Spotify.exe", 0.5)
+        self.cache = volume_control.AudioSessionCache(self.provider)
+
+    def test_only_spotify_session_is_changed(self):
+        self.assertEqual(self.cache.get_volume(20), 50)
+        self.cache.set_volume(10, 20)
+        self.assertEqual(self.spotify_interface.volume, 0.1)
+        self.assertEqual(self.other_interface.volume, 1.0)
+
+    def test_session_is_resolved_once(self):
+        for volume in range(10):
+            self.cache.set_volume(volume, 20)
+            self.assertEqual(self.cache.get_volume(20), volume)
+        self.assertEqual(self.cache.resolve_count, 1)
+
+    def test_expired_session_is_resolved_again(self):
+        self.cache.set_volume(10, 20)
+        spotify_interface = self.provider.replace_session(self.spotify_interface)
+        self.cache.set_volume(20, 20)
+        self.assertEqual(spotify_interface.volume, 0.2)
+        self.assertEqual(self.spotify_interface.volume, 0.1)
+        self.assertEqual(self.cache.resolve_count, 2)
+
+    def test_pid_change_resolves_new_session(self):
+        self.cache.set_volume(10, 20)
+        spotify_interface = self.provider.add_session(30, "Spotify.exe")
+        self.cache.set_volume(20, 30)
+        self.assertEqual(spotify_interface.volume, 0.2)
+        self.assertEqual(self.spotify_interface.volume, 0.1)
+        self.assertEqual(self.cache.resolve_count, 2)
+
+    def test_failed_call_is_retried_on_resolved_session(self):
+        self.cache.set_volume(10, 20)
+        self.spotify_interface.failure_count = 1
+        self.cache.set_volume(20, 20)
+        self.assertEqual(self.spotify_interface.volume, 0.2)
+        self.assertEqual(self.cache.resolve_count, 2)
+
+    def test_failure_after_resolving_again_is_raised(self):
+        self.cache.set_volume(10, 20)
+        self.spotify_interface.failure_count = 2
+        with self.assertRaises(OSError):
+            self.cache.set_volume(20, 20)
+
+    def test_other_spotify_session_is_used_for_unknown_pid(self):
+        # Spotify may play audio from another of its processes than the watched
+        #   one
+        self.cache.set_volume(10, 40)
+        self.assertEqual(self.spotify_interface.volume, 0.1)
+        self.cache.set_volume(20, 40)
+        self.assertEqual(self.cache.resolve_count, 1)
+        self.assertEqual(self.cache.get_volume(), 20)
+
+    def test_missing_session_is_raised(self):
+        self.provider.sessions.pop()
+        with self.assertRaises(LookupError):
+            self.cache.get_volume(20)
+
+
+if __name__ == "__main__":
+    unittest.main()
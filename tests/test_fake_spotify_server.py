@@ -0,0 +1,54 @@
+import unittest
+# Import user modules
+import fake_spotify_server
+
+
+class FakePlayerTest(unittest.TestCase):
+
+    TIMELINE = [("track", 10), ("ad", 5), ("pause", 5)]
+
+    def get_reported_item(self, player, now):
+        playback_state = player.get_playback_state(now)
+        if playback_state == None:
+            return None
+        return (playback_state['item']['id'], playback_state['is_playing'],
+            playback_state['progress_ms'])
+
+    def test_timeline_played_once(self):
+        player = fake_spotify_server.FakePlayer("device", self.TIMELINE,
+            start_time=100, is_looping=False)
+        self.assertEqual(player.get_segment(112.5), (1, "ad", 5, 2.5))
+        self.assertEqual([self.get_reported_item(player, now)
+            for now in [99, 100, 104, 110, 114.5, 115, 120]], [
+            None,
+            ("track-0-0", True, 0),
+            ("track-0-0", True, 4000),
+            ("ad-0-1", True, 0),
+            ("ad-0-1", True, 4500),
+            ("track-0-2", False, 60000),
+            None])
+        self.assertEqual(player.get_intervals("ad"), [(110, 115)])
+        self.assertEqual(player.get_end_time(), 120)
+
+    def test_looped_timeline(self):
+        player = fake_spotify_server.FakePlayer("device", self.TIMELINE,
+            start_time=100)
+        self.assertEqual([self.get_reported_item(player, now)
+            for now in [99.5, 100, 121, 131, 142]], [
+            None,
+            ("track-0-0", True, 0),
+            ("track-1-0", True, 1000),
+            ("ad-1-1", True, 1000),
+            ("track-2-0", True, 2000)])
+
+    def test_no_playback_before_start_time(self):
+        for is_looping in [True, False]:
+            player = fake_spotify_server.FakePlayer("device", self.TIMELINE,
+                start_time=100, is_looping=is_looping)
+            for now in [0, 85, 99.9]:
+                self.assertEqual(player.get_segment(now), None)
+                self.assertEqual(player.get_playback_state(now), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
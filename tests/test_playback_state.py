@@ -0,0 +1,120 @@
+import tracemalloc
+import unittest
+# Import user modules
+import playback_state
+
+
+def create_playback_state(item_type, item_id, is_playing=True, progress_ms=1000,
+        duration_ms=180000):
+    return {
+        'currently_playing_type': item_type,
+        'is_playing': is_playing,
+        'progress_ms': progress_ms,
+        'item': {'id': item_id, 'type': item_type, 'duration_ms': duration_ms}}
+
+
+class PlaybackStateTest(unittest.TestCase):
+
+    STATE_CHANGED = playback_state.PlaybackState.STATE_CHANGED
+    ITEM_CHANGED = playback_state.PlaybackState.ITEM_CHANGED
+
+    def setUp(self):
+        self.playback = playback_state.PlaybackState()
+
+    def test_initial_state_is_idle(self):
+        self.assertEqual(self.playback.state, self.playback.IDLE)
+        self.assertFalse(self.playback.is_playing())
+
+    def test_transitions(self):
+        playback = self.playback
+        for sample, state, changes in [
+                (create_playback_state("track", "track-1"), playback.TRACK,
+                    self.STATE_CHANGED | self.ITEM_CHANGED),
+                (create_playback_state("track", "track-1", progress_ms=2000),
+                    playback.TRACK, 0),
+                (create_playback_state("track", "track-1", is_playing=False),
+                    playback.PAUSED, self.STATE_CHANGED),
+                (create_playback_state("track", "track-1"), playback.TRACK,
+                    self.STATE_CHANGED),
+                (create_playback_state("track", "track-2"), playback.TRACK,
+                    self.ITEM_CHANGED),
+                (create_playback_state("ad", "ad-1"), playback.AD,
+                    self.STATE_CHANGED | self.ITEM_CHANGED),
+                (create_playback_state("ad", "ad-2"), playback.AD,
+                    self.ITEM_CHANGED),
+                (create_playback_state("ad", "ad-2", is_playing=False),
+                    playback.PAUSED, self.STATE_CHANGED),
+                (create_playback_state("episode", "episode-1"), playback.TRACK,
+                    self.STATE_CHANGED | self.ITEM_CHANGED),
+                (None, playback.IDLE, self.STATE_CHANGED),
+                (None, playback.IDLE, 0),
+                (create_playback_state("unknown", "item-1"), playback.ERROR,
+                    self.STATE_CHANGED | self.ITEM_CHANGED)]:
+            self.assertEqual(playback.update(sample), changes)
+            self.assertEqual(playback.state, state)
+
+    def test_item_fields(self):
+        playback = self.playback
+        playback.update(create_playback_state("track", "track-1", progress_ms=5000,
+            duration_ms=200000))
+        self.assertTrue(playback.is_track())
+        self.assertFalse(playback.is_ad())
+        self.assertTrue(playback.is_playing())
+        self.assertEqual((playback.item_id, playback.progress_ms,
+            playback.duration_ms), ("track-1", 5000, 200000))
+        playback.update(create_playback_state("ad", "ad-1"))
+        self.assertTrue(playback.is_ad())
+        self.assertEqual((playback.previous_state, playback.previous_item_type,
+            playback.previous_item_id), (playback.TRACK, "track", "track-1"))
+
+    def test_ad_without_item(self):
+        playback = self.playback
+        changes = playback.update({'currently_playing_type': "ad",
+            'is_playing': True, 'progress_ms': None, 'item': None})
+        self.assertEqual(changes, self.STATE_CHANGED | self.ITEM_CHANGED)
+        self.assertEqual(playback.state, playback.AD)
+        self.assertEqual((playback.item_id, playback.duration_ms), (None, None))
+
+    def test_set_error_keeps_last_item(self):
+        playback = self.playback
+        playback.update(create_playback_state("track", "track-1"))
+        self.assertEqual(playback.set_error(), self.STATE_CHANGED)
+        self.assertEqual(playback.state, playback.ERROR)
+        self.assertEqual((playback.item_type, playback.item_id),
+            ("track", "track-1"))
+        self.assertEqual(playback.set_error(), 0)
+        # The same item after the error is not a new item
+        self.assertEqual(playback.update(create_playback_state("track", "track-1")),
+            self.STATE_CHANGED)
+        # An ad after the error is compared to the track before it
+        playback.set_error()
+        self.assertEqual(playback.update(create_playback_state("ad", "ad-1")),
+            self.STATE_CHANGED | self.ITEM_CHANGED)
+        self.assertEqual(playback.previous_item_type, "track")
+
+    def test_steady_state_update_does_not_allocate(self):
+        playback = self.playback
+        samples = [create_playback_state("track", "track-1", progress_ms=i * 1000)
+            for i in range(1000)]
+        # Measure the peak memory allocated during each update, after a few
+        #   updates to warm up
+        tracemalloc.start()
+        try:
+            for sample in samples[:10]:
+                playback.update(sample)
+            allocated_sizes = []
+            for sample in samples:
+                current_size = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                playback.update(sample)
+                allocated_sizes.append(tracemalloc.get_traced_memory()[1] -
+                    current_size)
+        finally:
+            tracemalloc.stop()
+        # Allocating even a single object per update would take at least as
+        #   many bytes as there are updates
+        self.assertLess(sum(allocated_sizes), len(samples))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import concurrent.futures
+import threading
+import unittest
+# Import user modules
+import poll_loop
+import scheduler
+
+
+class FakeConfig(object):
+
+    AUTOMATIC_CLOSING = True
+    POLL_MODE = "single"
+    TARGET_DEVICE_NAME = "device"
+
+
+# Spotify client which reports the given playback state, or fails with the
+#   given exception
+class FakeSpotify(object):
+
+    def __init__(self, playback_state=None, failure=None):
+        self.playback_state = playback_state
+        self.failure = failure
+
+    def current_playback(self, additional_types=None):
+        if self.failure != None:
+            raise self.failure
+        return self.playback_state
+
+
+# Activity checker of which Spotify is no longer running, such that the
+#   polling loop quits on its first poll, and of which the target device is
+#   active as given
+class FakeActivityCheck(object):
+
+    def __init__(self, is_device_active=True):
+        self.is_device_active = is_device_active
+
+    def is_spotify_active(self):
+        return False
+
+    def is_playback_device_target(self, playback_state, target_device_name):
+        return self.is_device_active
+
+
+# Mixer which records the names of the threads from which it was called
+class FakeMixer(object):
+
+    def __init__(self):
+        self.volume = 50
+        self.thread_names = []
+
+    def get_system_volume(self):
+        return self.volume
+
+    def set_system_volume(self, volume):
+        self.volume = volume
+        self.thread_names.append(threading.current_thread().name)
+
+
+class FakeLogger(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message):
+        self.messages.append(message)
+
+
+class RunAsyncTest(unittest.TestCase):
+
+    def create_poll_loop(self, volume_executor=None):
+        self.mixer = FakeMixer()
+        return poll_loop.PollLoop(FakeConfig(), FakeSpotify(), FakeLogger(),
+            FakeActivityCheck(), self.mixer, scheduler.PollScheduler(),
+            volume_executor=volume_executor)
+
+    def test_given_volume_executor_is_used_and_kept(self):
+        volume_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+            thread_name_prefix="given-volume-worker")
+        try:
+            loop = self.create_poll_loop(volume_executor)
+            asyncio.run(loop.run_async())
+            self.assertEqual(len(self.mixer.thread_names), 1)
+            self.assertTrue(self.mixer.thread_names[0].startswith(
+                "given-volume-worker"))
+            self.assertIs(loop.volume_executor, volume_executor)
+            # The executor is not shut down by the polling loop
+            self.assertEqual(volume_executor.submit(lambda: 1).result(), 1)
+        finally:
+            volume_executor.shutdown()
+
+    def test_own_volume_executor_is_shut_down(self):
+        loop = self.create_poll_loop()
+        asyncio.run(loop.run_async())
+        self.assertEqual(len(self.mixer.thread_names), 1)
+        self.assertNotEqual(self.mixer.thread_names[0],
+            threading.current_thread().name)
+        self.assertEqual(loop.volume_executor, None)
+
+
+class InactiveStateTest(unittest.TestCase):
+
+    def create_poll_loop(self, sp, activity_checker=None):
+        if activity_checker == None:
+            activity_checker = FakeActivityCheck()
+        self.poll_scheduler = scheduler.PollScheduler(error_sleep_min_s=1,
+            error_sleep_s=60, inactive_sleep_s=30)
+        self.log = FakeLogger()
+        return poll_loop.PollLoop(FakeConfig(), sp, self.log, activity_checker,
+            FakeMixer(), self.poll_scheduler)
+
+    def test_idle_state_is_polled_at_relaxed_period(self):
+        loop = self.create_poll_loop(FakeSpotify())
+        self.assertEqual([loop.poll() for i in range(5)], [30] * 5)
+        self.assertEqual(self.poll_scheduler.backoff_count, 0)
+        self.assertEqual(self.log.messages, ["No playback state found"] * 5)
+
+    def test_inactive_device_is_polled_at_relaxed_period(self):
+        loop = self.create_poll_loop(FakeSpotify({}), FakeActivityCheck(False))
+        self.assertEqual([loop.poll() for i in range(5)], [30] * 5)
+        self.assertEqual(self.poll_scheduler.backoff_count, 0)
+
+    def test_errors_are_backed_off(self):
+        sp = FakeSpotify(failure=OSError("connection reset"))
+        loop = self.create_poll_loop(sp)
+        sleep_periods_s = [loop.poll() for i in range(8)]
+        # The backoff starts at the minimum error period and is doubled after
+        #   every consecutive error, up to the maximum
+        for i, sleep_period_s in enumerate(sleep_periods_s):
+            backoff_max_s = min([60, 2 ** i])
+            self.assertGreaterEqual(sleep_period_s, backoff_max_s / 2)
+            self.assertLessEqual(sleep_period_s, backoff_max_s)
+        self.assertEqual(self.poll_scheduler.backoff_count, 8)
+        # Nothing playing is not an error and starts the backoff over
+        sp.failure = None
+        self.assertEqual(loop.poll(), 30)
+        sp.failure = OSError("connection reset")
+        self.assertLessEqual(loop.poll(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
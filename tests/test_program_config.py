@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+# Import user modules
+import program_config
+import spotify_ad_muter
+
+
+class FakeLogger(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message):
+        self.messages.append(message)
+
+
+class ParseConfigSettingsTest(unittest.TestCase):
+
+    def test_settings_are_indexed_by_attribute_name(self):
+        settings = program_config.parse_config_settings({
+            'ad_volume_percentage': 12.6,
+            'target_device_name': "My-Computer",
+            'sleep_period_playing_ad_s': 2,
+            'probe_lead_s': 0})
+        self.assertEqual(settings, {
+            'AD_VOLUME_PERCENTAGE': 13,
+            'TARGET_DEVICE_NAME': "my-computer",
+            'SLEEP_PERIOD_PLAYING_AD_S': 2,
+            'PROBE_LEAD_S': 0})
+
+    def test_ad_volume_is_clamped(self):
+        self.assertEqual(program_config.parse_config_settings(
+            {'ad_volume_percentage': 150}), {'AD_VOLUME_PERCENTAGE': 100})
+        self.assertEqual(program_config.parse_config_settings(
+            {'ad_volume_percentage': -5}), {'AD_VOLUME_PERCENTAGE': 0})
+
+    def test_invalid_settings_are_rejected(self):
+        for values in [
+                {'unknown_setting': 1},
+                {'target_device_name': 1},
+                {'sleep_period_playing_ad_s': "1"},
+                {'sleep_period_playing_ad_s': True},
+                {'probe_lead_s': -1}]:
+            with self.assertRaises(ValueError):
+                program_config.parse_config_settings(values)
+
+    def test_zero_polling_periods_are_rejected(self):
+        for key, name in program_config.CONFIG_FILE_SETTINGS.items():
+            if name.startswith("SLEEP_PERIOD_") == False:
+                continue
+            with self.assertRaises(ValueError):
+                program_config.parse_config_settings({key: 0})
+
+    def test_minimum_may_not_exceed_maximum(self):
+        for values in [
+                {'sleep_period_error_min_s': 10, 'sleep_period_error_s': 5},
+                {'sleep_period_paused_min_s': 30},
+                {'sleep_period_paused_max_s': 1},
+                {'sleep_period_probe_s': 40}]:
+            with self.assertRaises(ValueError):
+                program_config.parse_config_settings(values)
+        # The bounds which the file does not contain are taken from the given
+        #   configuration
+        config = type("Config", (object,), dict((name,
+            getattr(program_config, name, None))
+            for name in program_config.CONFIG_FILE_SETTINGS.values()))
+        config.SLEEP_PERIOD_PAUSED_MIN_S = 1
+        config.SLEEP_PERIOD_PAUSED_MAX_S = 2
+        self.assertEqual(program_config.parse_config_settings(
+            {'sleep_period_paused_min_s': 2}, config),
+            {'SLEEP_PERIOD_PAUSED_MIN_S': 2})
+        with self.assertRaises(ValueError):
+            program_config.parse_config_settings(
+                {'sleep_period_paused_min_s': 3}, config)
+
+    def test_toml_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            config_file_path = os.path.join(directory, "config.toml")
+            with open(config_file_path, "w") as config_file:
+                config_file.write("sleep_period_playing_ad_s = 2\n")
+            self.assertEqual(program_config.read_config_file(config_file_path),
+                {'sleep_period_playing_ad_s': 2})
+        finally:
+            shutil.rmtree(directory)
+
+
+class ReloadConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_file_path = os.path.join(self.directory, "config.json")
+        self.write_config_file({'sleep_period_playing_ad_s': 2})
+        self.config = program_config.ProgramConfig(
+            ad_volume_percentage=10,
+            target_device_name="device",
+            auth_cache_path=os.path.join(self.directory, ".cache"),
+            log_file_path=os.path.join(self.directory, "log"),
+            config_file_path=self.config_file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_config_file(self, values):
+        with open(self.config_file_path, "w") as config_file:
+            json.dump(values, config_file)
+
+    def test_file_overrides_defaults(self):
+        self.assertEqual(self.config.SLEEP_PERIOD_PLAYING_AD_S, 2)
+        self.assertEqual(self.config.SLEEP_PERIOD_ERROR_S,
+            program_config.SLEEP_PERIOD_ERROR_S)
+
+    def test_reload_applies_settings_to_schedulers(self):
+        poll_scheduler = spotify_ad_muter.create_poll_scheduler(self.config)
+        self.write_config_file({'sleep_period_playing_ad_s': 3,
+            'ad_volume_percentage': 20, 'probe_lead_s': 2})
+        log = FakeLogger()
+        self.assertNotEqual(spotify_ad_muter.reload_config(self.config,
+            [poll_scheduler], log), None)
+        self.assertEqual(self.config.AD_VOLUME_PERCENTAGE, 20)
+        self.assertEqual(poll_scheduler.ad_sleep_s, 3)
+        self.assertEqual(poll_scheduler.probe_lead_s, 2)
+
+    def test_invalid_reload_changes_nothing(self):
+        poll_scheduler = spotify_ad_muter.create_poll_scheduler(self.config)
+        self.write_config_file({'sleep_period_playing_ad_s': 3,
+            'sleep_period_error_s': 0})
+        log = FakeLogger()
+        self.assertEqual(spotify_ad_muter.reload_config(self.config,
+            [poll_scheduler], log), None)
+        self.assertTrue(log.messages[0].startswith("Error: Could not reload"))
+        self.assertEqual(self.config.SLEEP_PERIOD_PLAYING_AD_S, 2)
+        self.assertEqual(self.config.SLEEP_PERIOD_ERROR_S,
+            program_config.SLEEP_PERIOD_ERROR_S)
+        self.assertEqual(poll_scheduler.ad_sleep_s, 2)
+
+    def test_removed_settings_return_to_defaults(self):
+        self.write_config_file({'ad_volume_percentage': 30})
+        self.config.load_config_file()
+        self.assertEqual(self.config.AD_VOLUME_PERCENTAGE, 30)
+        self.assertEqual(self.config.SLEEP_PERIOD_PLAYING_AD_S,
+            program_config.SLEEP_PERIOD_PLAYING_AD_S)
+        self.write_config_file({})
+        self.config.load_config_file()
+        # The ad volume returns to its value from the command line
+        self.assertEqual(self.config.AD_VOLUME_PERCENTAGE, 10)
+        self.assertEqual(self.config.TARGET_DEVICE_NAME, "device")
+
+
+class AccountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.accounts_file_path = os.path.join(self.directory, "accounts.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load_accounts(self, accounts):
+        with open(self.accounts_file_path, "w") as accounts_file:
+            json.dump(accounts, accounts_file)
+        return program_config.ProgramConfig(
+            auth_cache_path=os.path.join(self.directory, ".cache"),
+            log_file_path=os.path.join(self.directory, "log"),
+            accounts_file_path=self.accounts_file_path).ACCOUNTS
+
+    def create_account(self, name):
+        return {'name': name, 'target_device_name': "Speaker-%s" % name,
+            'auth_cache_path': os.path.join(self.directory, ".cache-%s" % name)}
+
+    def test_accounts_are_loaded(self):
+        accounts = self.load_accounts([self.create_account("room-1"),
+            self.create_account("room-2")])
+        self.assertEqual([(account.NAME, account.TARGET_DEVICE_NAME)
+            for account in accounts],
+            [("room-1", "speaker-room-1"), ("room-2", "speaker-room-2")])
+
+    def test_invalid_accounts_are_rejected(self):
+        account_without_name = self.create_account("room-1")
+        del account_without_name['name']
+        account_without_cache = self.create_account("room-1")
+        account_without_cache['auth_cache_path'] = ""
+        for accounts in [
+                [account_without_name],
+                [account_without_cache],
+                [self.create_account("room-1"), self.create_account("room-1")]]:
+            with self.assertRaises(SystemExit):
+                self.load_accounts(accounts)
+
+
+if __name__ == "__main__":
+    unittest.main()
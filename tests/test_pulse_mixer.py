@@ -0,0 +1,81 @@
+import os
+import unittest
+# Import user modules
+import fake_pulse_server
+import pulse_mixer
+
+
+class PulseStreamMixerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fake_pulse_server.FakePulseServer()
+        self.server.start()
+        self.socket_path = self.server.socket_path
+        self.other_index = self.server.add_stream("firefox", "Firefox")
+        self.spotify_index = self.server.add_stream("spotify", "Spotify")
+        self.mixer = pulse_mixer.PulseStreamMixer(client_factory=lambda:
+            fake_pulse_server.FakePulseClient(self.socket_path))
+
+    def tearDown(self):
+        try:
+            self.mixer.close()
+        except Exception:
+            pass
+        if os.path.exists(self.socket_path) == True:
+            self.server.stop()
+
+    def get_stream_volume(self, index):
+        return round(self.server.streams[index]['volumes'][0] * 100)
+
+    # Stop the sound server and start a new one on the same socket, of which the
+    #   stream indexes differ from those of the previous server
+    def restart_server(self):
+        self.server.stop()
+        self.server = fake_pulse_server.FakePulseServer(self.socket_path)
+        self.server.next_index = 10
+        self.server.start()
+
+    def test_only_spotify_stream_is_changed(self):
+        self.mixer.set_volume(10)
+        self.assertEqual(self.get_stream_volume(self.spotify_index), 10)
+        self.assertEqual(self.get_stream_volume(self.other_index), 100)
+        self.assertEqual(self.mixer.get_volume(), 10)
+
+    def test_reconnects_after_server_restart(self):
+        self.mixer.set_volume(10)
+        self.restart_server()
+        spotify_index = self.server.add_stream("spotify", "Spotify")
+        self.mixer.set_volume(20)
+        self.assertEqual(self.get_stream_volume(spotify_index), 20)
+        self.assertEqual(self.mixer.get_volume(), 20)
+        self.assertEqual(self.mixer.reconnect_count, 1)
+
+    def test_volume_is_applied_once_stream_appears_after_restart(self):
+        self.restart_server()
+        self.mixer.set_volume(10)
+        self.assertTrue(self.mixer.is_volume_pending)
+        spotify_index = self.server.add_stream("spotify", "Spotify")
+        self.assertEqual(self.mixer.get_volume(), 10)
+        self.assertEqual(self.get_stream_volume(spotify_index), 10)
+        self.assertEqual(self.mixer.reconnect_count, 1)
+
+    def test_gives_up_if_server_is_gone(self):
+        self.mixer.get_volume()
+        self.server.stop()
+        with self.assertRaises(OSError):
+            self.mixer.set_volume(10)
+        self.assertEqual(self.mixer.reconnect_count, 1)
+
+    def test_given_client_is_not_replaced(self):
+        client = fake_pulse_server.FakePulseClient(self.socket_path)
+        mixer = pulse_mixer.PulseStreamMixer(client=client)
+        mixer.set_volume(10)
+        self.restart_server()
+        with self.assertRaises(Exception):
+            mixer.set_volume(20)
+        self.assertIs(mixer.client, client)
+        self.assertEqual(mixer.reconnect_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+# Import user modules
+import scheduler
+
+
+class LatencyStatisticsTest(unittest.TestCase):
+
+    def test_latencies_are_summarized(self):
+        poll_scheduler = scheduler.PollScheduler()
+        for ad_progress_ms in [500, 1500, None, 1000]:
+            poll_scheduler.record_mute(ad_progress_ms)
+        poll_scheduler.record_unmute(2000)
+        statistics = poll_scheduler.get_statistics()
+        self.assertEqual((statistics['mute_count'],
+            statistics['mute_latency_mean_s'], statistics['mute_latency_max_s']),
+            (3, 1.0, 1.5))
+        self.assertEqual((statistics['unmute_count'],
+            statistics['unmute_latency_mean_s'],
+            statistics['unmute_latency_max_s']), (1, 2.0, 2.0))
+        self.assertIn("mute_latency_max_s = 1.50",
+            poll_scheduler.format_statistics())
+
+    def test_no_latencies_without_mutes(self):
+        statistics = scheduler.PollScheduler().get_statistics()
+        self.assertEqual(statistics['mute_count'], 0)
+        self.assertNotIn('mute_latency_mean_s', statistics)
+        self.assertNotIn('unmute_latency_max_s', statistics)
+
+    def test_memory_does_not_grow_with_mutes(self):
+        poll_scheduler = scheduler.PollScheduler()
+        attributes = dict(vars(poll_scheduler))
+        for i in range(10000):
+            poll_scheduler.record_mute(i)
+            poll_scheduler.record_unmute(i)
+        for name, value in vars(poll_scheduler).items():
+            if isinstance(value, (list, dict)):
+                self.assertEqual(len(value), len(attributes[name]))
+        self.assertEqual(poll_scheduler.mute_count, 10000)
+        self.assertEqual(poll_scheduler.unmute_latency_max_s, 9.999)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import threading
+import unittest
+# Import user modules
+import poll_loop
+import volume_control
+
+
+# Virtual clock which advances right away when the ramp waits, such that a ramp
+#   runs without sleeping. Once the hold time is reached, the ramp is held until
+#   it is cancelled
+class FakeClock(object):
+
+    def __init__(self, now=0, hold_time=None):
+        self.now = now
+        self.hold_time = hold_time
+        self.is_holding = threading.Event()
+
+    def monotonic(self):
+        return self.now
+
+    def wait(self, event, period_s):
+        if event.is_set() == True:
+            return True
+        if self.hold_time != None and self.now + period_s > self.hold_time:
+            self.now = self.hold_time
+            self.is_holding.set()
+            event.wait()
+            return True
+        self.now += period_s
+        return event.is_set()
+
+
+# Mixer which records the virtual time and volume of every write, and fails the
+#   given number of writes with the given exception
+class FakeMixer(object):
+
+    def __init__(self, clock_obj, volume=50, failure=None, failure_count=0):
+        self.clock = clock_obj
+        self.volume = volume
+        self.writes = []
+        self.failure = failure
+        self.failure_count = failure_count
+
+    def get_system_volume(self):
+        return self.volume
+
+    def set_system_volume(self, volume):
+        if self.failure_count > 0:
+            self.failure_count -= 1
+            raise self.failure
+        self.volume = volume
+        self.writes.append((self.clock.monotonic(), volume))
+
+
+class FakeLogger(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message):
+        self.messages.append(message)
+
+
+class VolumeRampTest(unittest.TestCase):
+
+    STEP_COUNT = 10
+
+    def create_ramp(self, clock_obj=None, **kwargs):
+        self.clock = clock_obj if clock_obj != None else FakeClock()
+        self.mixer = FakeMixer(self.clock, **kwargs)
+        self.ramp = volume_control.VolumeRamp(self.mixer, self.STEP_COUNT,
+            self.clock)
+        return self.ramp
+
+    def tearDown(self):
+        self.ramp.cancel()
+
+    def test_write_count_is_bounded_by_step_count(self):
+        ramp = self.create_ramp()
+        for curve in volume_control.VolumeRamp.CURVES:
+            for start_volume, target_volume in [(100, 0), (50, 10), (10, 50),
+                    (50, 48), (50, 50)]:
+                self.mixer.writes = []
+                write_count = ramp.write_count
+                ramp.start(target_volume, 1.0, curve, start_volume=start_volume)
+                ramp.wait()
+                self.assertLessEqual(len(self.mixer.writes), self.STEP_COUNT)
+                self.assertEqual(ramp.write_count - write_count,
+                    len(self.mixer.writes))
+                # Only changes of the rounded volume are written, and the ramp
+                #   ends at the target volume
+                self.assertEqual(len(self.mixer.writes),
+                    min([self.STEP_COUNT, abs(target_volume - start_volume)]))
+                if start_volume != target_volume:
+                    self.assertEqual(self.mixer.writes[-1][1], target_volume)
+
+    def test_volumes_move_monotonically_towards_target(self):
+        ramp = self.create_ramp()
+        for curve in volume_control.VolumeRamp.CURVES:
+            self.mixer.writes = []
+            ramp.start(10, 1.0, curve, start_volume=80)
+            ramp.wait()
+            volumes = [volume for _, volume in self.mixer.writes]
+            self.assertEqual(volumes, sorted(volumes, reverse=True))
+
+    def test_start_volume_defaults_to_mixer_volume(self):
+        ramp = self.create_ramp(volume=30)
+        ramp.start(20, 1.0, "linear")
+        ramp.wait()
+        self.assertEqual([volume for _, volume in self.mixer.writes],
+            list(range(29, 19, -1)))
+
+    def test_steps_are_spread_over_duration(self):
+        ramp = self.create_ramp()
+        ramp.start(0, 2.0, "linear", start_volume=100)
+        ramp.wait()
+        self.assertEqual([round(write_time, 6) for write_time, _ in self.mixer.writes],
+            [round(i * 0.2, 6) for i in range(self.STEP_COUNT)])
+
+    def test_delayed_start_time(self):
+        ramp = self.create_ramp(FakeClock(now=10))
+        ramp.start(10, 1.0, "s-curve", start_volume=50, start_time=15)
+        ramp.wait()
+        self.assertEqual(self.mixer.writes[0][0], 15)
+
+    def test_ramp_waits_for_start_time_without_writing(self):
+        ramp = self.create_ramp(FakeClock(now=10, hold_time=12))
+        ramp.start(10, 1.0, "linear", start_volume=50, start_time=15)
+        self.clock.is_holding.wait()
+        self.assertTrue(ramp.is_running())
+        self.assertTrue(ramp.cancel())
+        self.assertEqual(self.mixer.writes, [])
+        self.assertEqual(self.mixer.volume, 50)
+
+    def test_start_time_in_the_past_starts_immediately(self):
+        ramp = self.create_ramp(FakeClock(now=10))
+        ramp.start(10, 1.0, "linear", start_volume=50, start_time=5)
+        ramp.wait()
+        self.assertEqual(self.mixer.writes[0][0], 10)
+        self.assertEqual(self.mixer.writes[-1][1], 10)
+
+    def test_cancel_mid_ramp_stops_writes(self):
+        ramp = self.create_ramp(FakeClock(hold_time=0.45))
+        ramp.start(0, 1.0, "linear", start_volume=100)
+        self.clock.is_holding.wait()
+        self.assertTrue(ramp.cancel())
+        # The steps at 0, 0.1, 0.2, 0.3 and 0.4 s were written before the cancel
+        self.assertEqual([volume for _, volume in self.mixer.writes],
+            [90, 80, 70, 60, 50])
+        self.assertFalse(ramp.is_running())
+        self.assertEqual(len(self.mixer.writes), 5)
+        self.assertEqual(self.mixer.volume, 50)
+
+    def test_new_ramp_cancels_running_ramp(self):
+        ramp = self.create_ramp(FakeClock(hold_time=0.15))
+        ramp.start(0, 1.0, "linear", start_volume=100)
+        self.clock.is_holding.wait()
+        self.clock.hold_time = None
+        ramp.start(100, 1.0, "linear")
+        ramp.wait()
+        self.assertEqual(self.mixer.volume, 100)
+        self.assertEqual([volume for _, volume in self.mixer.writes][:2], [90, 80])
+
+    def test_cancel_return_value(self):
+        ramp = self.create_ramp(FakeClock(hold_time=0))
+        # No ramp was started
+        self.assertFalse(ramp.cancel())
+        # The ramp is running
+        ramp.start(0, 1.0, "linear", start_volume=100)
+        self.clock.is_holding.wait()
+        self.assertTrue(ramp.cancel())
+        # The ramp was already cancelled
+        self.assertFalse(ramp.cancel())
+        # The ramp has finished
+        self.clock.hold_time = None
+        ramp.start(0, 1.0, "linear", start_volume=100)
+        ramp.wait()
+        self.assertFalse(ramp.cancel())
+
+    def test_mixer_failure_is_kept_for_polling_loop(self):
+        ramp = self.create_ramp(failure=SystemExit(1), failure_count=1)
+        ramp.start(0, 1.0, "linear", start_volume=100)
+        ramp.wait()
+        self.assertFalse(ramp.is_running())
+        self.assertIsInstance(ramp.pop_error(), SystemExit)
+        self.assertEqual(ramp.pop_error(), None)
+        self.assertEqual(self.mixer.writes, [])
+
+    def test_polling_loop_retries_failed_ramp(self):
+        self.create_ramp(failure=OSError("mixer gone"), failure_count=1)
+        log = FakeLogger()
+        loop = poll_loop.PollLoop(None, None, log, None, self.mixer, None,
+            clock_obj=self.clock)
+        self.ramp = loop.volume_ramp
+        loop.volume_ramp.start(10, 1.0, "linear", start_volume=50)
+        loop.volume_ramp.wait()
+        loop.check_volume_ramp()
+        self.assertEqual(self.mixer.volume, 10)
+        self.assertEqual(log.messages,
+            ["Error: volume ramp to 10% failed, retrying: mixer gone"])
+        # The failure is only handled once
+        loop.check_volume_ramp()
+        self.assertEqual(len(log.messages), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
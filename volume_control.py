@@ -1,8 +1,14 @@
+import math
 import platform
-if platform.system().lower() != "linux":
-    from pycaw import pycaw
 import re
 import subprocess
+import threading
+import time
+# Import user modules
+import alsa_mixer
+import clock
+import metrics
+import pulse_mixer
 
 
 class VolumeControl(object):
@@ -11,95 +17,353 @@ class VolumeControl(object):
     __WINDOWS = 2
     __MAC = 3
 
-    def __init__(self, logger):
+    def __init__(self, logger, mixer_control="Master", metrics_registry=None,
+            backend="alsa", stream_client=None, pid_source=None):
         self.logger = logger
+        # Function which returns the PID of the watched Spotify process, or None
+        #   if it is unknown, of which the audio session is used on Windows
+        self.pid_source = pid_source
+        if pid_source == None:
+            self.pid_source = lambda: None
+        if metrics_registry == None:
+            metrics_registry = metrics.NullRegistry()
+        self.mixer_histogram = metrics_registry.histogram("mixer_call_seconds",
+            "Duration of a call to the system mixer", ("operation",))
+        # Name of the ALSA mixer control of which the volume is changed on Linux
+        self.mixer_control = mixer_control
         # Store 'easy to read' variable with OS type
         kernel_str = platform.system().lower()
         if kernel_str == "linux":
             self.kernel = self.__LINUX
+            # Change only the volume of Spotify's streams on the PulseAudio or
+            #   PipeWire sound server if possible ('pulse'), or that of the ALSA
+            #   mixer control, which affects all sounds on the machine ('alsa').
+            #   The 'auto' backend falls back to ALSA without a sound server
+            self.stream_mixer = None
+            if backend in ["auto", "pulse"]:
+                try:
+                    self.stream_mixer = pulse_mixer.PulseStreamMixer(
+                        client=stream_client)
+                except Exception as ex:
+                    if backend == "pulse":
+                        self.logger.write("Error: Could not connect to the " +
+                            "PulseAudio sound server: %s" % str(ex))
+                        exit(1)
+                    self.logger.write("Warning: Could not connect to the " +
+                        "PulseAudio sound server, falling back to ALSA: %s" %
+                        str(ex))
+            # Keep a mixer handle open in-process, or fall back to calling the
+            #   'amixer' binary for every volume change if ALSA is unavailable
+            self.alsa_mixer = None
+            if self.stream_mixer == None:
+                try:
+                    self.alsa_mixer = alsa_mixer.AlsaMixer(mixer_control)
+                except Exception as ex:
+                    self.logger.write("Warning: Could not open ALSA mixer, " +
+                        "falling back to 'amixer': %s" % str(ex))
         elif kernel_str == "windows":
             self.kernel = self.__WINDOWS
+            # Resolve the Spotify audio session once and reuse it for every call
+            self.session_cache = AudioSessionCache(PycawSessionProvider())
         elif kernel_str == "darwin":
             self.kernel = self.__MAC
-            self.logger("Error: Mac is currently unsupported")
+            self.logger.write("Error: Mac is currently unsupported")
             exit(1)
         else:
-            self.logger("Error: unknown and unsupported system")
+            self.logger.write("Error: unknown and unsupported system")
             exit(1)
 
     def get_system_volume(self):
-        if self.kernel == self.__LINUX:
-            return self.__get_alsa_system_volume()
+        start_time = time.perf_counter()
+        if self.kernel == self.__LINUX and self.stream_mixer != None:
+            volume = self.__get_pulse_stream_volume()
+        elif self.kernel == self.__LINUX:
+            volume = self.__get_alsa_system_volume()
         elif self.kernel == self.__WINDOWS:
-            return self.__get_windows_system_volume()
+            volume = self.__get_windows_system_volume()
+        self.mixer_histogram.observe(time.perf_counter() - start_time, ("get",))
+        return volume
 
     def set_system_volume(self, volume):
-        if self.kernel == self.__LINUX:
+        start_time = time.perf_counter()
+        if self.kernel == self.__LINUX and self.stream_mixer != None:
+            self.__set_pulse_stream_volume(volume)
+        elif self.kernel == self.__LINUX:
             self.__set_alsa_system_volume(volume)
         elif self.kernel == self.__WINDOWS:
             self.__set_windows_system_volume(volume)
+        self.mixer_histogram.observe(time.perf_counter() - start_time, ("set",))
 
-    # Use 'amixer' program to get general system volume
+    # Use the ALSA mixer to get general system volume
     def __get_alsa_system_volume(self):
         try:
+            if self.alsa_mixer != None:
+                return self.alsa_mixer.get_volume()
             # Directly use the 'amixer' binary to get the system volume
-            proc = subprocess.Popen(["/usr/bin/amixer", "sget", "Master"],
+            proc = subprocess.Popen(["/usr/bin/amixer", "sget", self.mixer_control],
                 shell=False, stdout=subprocess.PIPE)
-            # Pass the program output to variable
-            amixer_output = str(proc.communicate()[0])
+            # Pass the decoded program output to variable
+            amixer_output = proc.communicate()[0].decode(errors="replace")
             # Extract the first encountered volume value (front left volume) from the
-            #   program output string using regular expression for "[<volume>%]"
-            return int(re.search(r"\[([0-9]+)\%\]", amixer_output).group(1))
+            #   program output using regular expression for "[<volume>%]"
+            return int(re.search(r"\[([0-9]+)%\]", amixer_output).group(1))
         except Exception as ex:
             self.logger.write("Error: Could not get ALSA system volume: %s" %
                 str(ex))
             exit(1)
 
-    # Use 'pycaw' to find and return 'Spotify' audio process volume
+    # Use the persistent sound server connection to get the volume of Spotify's
+    #   stream
+    def __get_pulse_stream_volume(self):
+        try:
+            return self.stream_mixer.get_volume()
+        except Exception as ex:
+            self.logger.write("Error: Could not get PulseAudio stream volume: %s" %
+                str(ex))
+            exit(1)
+
+    # Use the cached 'Spotify' audio session to return its volume
     def __get_windows_system_volume(self):
         try:
-            # Iterate through all active audio processes to find 'Spotify'
-            sessions = pycaw.AudioUtilities.GetAllSessions()
-            volume = -1
-            for session in sessions:
-                audio_volume_interface = session._ctl.QueryInterface(pycaw.ISimpleAudioVolume)
-                volume = int(audio_volume_interface.GetMasterVolume() * 100)
-                if session.Process and "spotify" in session.Process.name().lower().split('.')[0]:
-                    break
-            if volume != -1:
-                return volume
-            error_message = "Could not find Spotify process"
+            return self.session_cache.get_volume(self.pid_source())
         except Exception as ex:
-            error_message = ex
-        self.logger.write("Error: Could not get Windows system volume: %s" %
-            str(error_message))
-        exit(1)
+            self.logger.write("Error: Could not get Windows system volume: %s" %
+                str(ex))
+            exit(1)
 
-    # Use 'amixer' program to set the general system volume
+    # Use the ALSA mixer to set the general system volume
     def __set_alsa_system_volume(self, volume):
         try:
-            # Directly use the 'amixer' binary to set the system volume
+            if self.alsa_mixer != None:
+                self.alsa_mixer.set_volume(volume)
+                return
+            # Directly use the 'amixer' binary to set the system volume and wait
+            #   for it to finish, such that consecutive changes are applied in order
             proc = subprocess.Popen(
-                ["/usr/bin/amixer", "sset", "Master", "%d%%" % volume],
+                ["/usr/bin/amixer", "sset", self.mixer_control, "%d%%" % volume],
                 shell=False, stdout=subprocess.DEVNULL)
+            if proc.wait() != 0:
+                raise OSError("'amixer' exited with code %d" % proc.returncode)
         except Exception as ex:
             self.logger.write("Error: Could not set ALSA system volume: %s" %
                 str(ex))
             exit(1)
 
-    # Use 'pycaw' to find and set the relative volume for the 'Spotify' audio process
+    # Use the persistent sound server connection to set the volume of Spotify's
+    #   streams only, in a single request per stream
+    def __set_pulse_stream_volume(self, volume):
+        try:
+            self.stream_mixer.set_volume(volume)
+        except Exception as ex:
+            self.logger.write("Error: Could not set PulseAudio stream volume: %s" %
+                str(ex))
+            exit(1)
+
+    # Use the cached 'Spotify' audio session to set its relative volume
     def __set_windows_system_volume(self, volume):
         try:
-            # Iterate through all active audio processes to find 'Spotify'
-            sessions = pycaw.AudioUtilities.GetAllSessions()
-            for session in sessions:
-                if session.Process and "spotify" in session.Process.name().lower().split('.')[0]:
-                    audio_volume = session._ctl.QueryInterface(pycaw.ISimpleAudioVolume)
-                    audio_volume.SetMasterVolume(volume / 100, None)
-                    return
-            error_message = "Could not find Spotify process"
+            self.session_cache.set_volume(volume, self.pid_source())
         except Exception as ex:
-            error_message = ex
-        self.logger.write("Error: Could not set Windows system volume: %s" %
-            str(error_message))
-        exit(1)
+            self.logger.write("Error: Could not set Windows system volume: %s" %
+                str(ex))
+            exit(1)
+
+
+# Audio session of a single process, as listed by a session provider
+class AudioSession(object):
+
+    def __init__(self, pid, process_name, get_volume_interface, is_expired):
+        self.pid = pid
+        self.process_name = process_name
+        # Function which returns the session's 'ISimpleAudioVolume' interface
+        self.get_volume_interface = get_volume_interface
+        # Function which returns if the session has expired
+        self.is_expired = is_expired
+
+
+# Session provider which lists the audio sessions on Windows using 'pycaw'
+class PycawSessionProvider(object):
+
+    # Session state of an expired session, see 'AudioSessionState'
+    __STATE_EXPIRED = 2
+
+    def __init__(self):
+        # Import 'pycaw' only when the Windows volume control is used, as it
+        #   pulls in COM support which is slow to load
+        from pycaw import pycaw
+        self.pycaw = pycaw
+
+    def get_sessions(self):
+        pycaw = self.pycaw
+        for session in pycaw.AudioUtilities.GetAllSessions():
+            if session.Process:
+                yield AudioSession(session.ProcessId, session.Process.name(),
+                    lambda session=session:
+                        session._ctl.QueryInterface(pycaw.ISimpleAudioVolume),
+                    lambda session=session:
+                        session._ctl.GetState() == self.__STATE_EXPIRED)
+
+
+class AudioSessionCache(object):
+
+    def __init__(self, session_provider, process_name="spotify"):
+        self.session_provider = session_provider
+        self.process_name = process_name
+        # Resolved audio session and its volume interface, keyed by the PID for
+        #   which it was resolved
+        self.pid = None
+        self.session = None
+        self.volume_interface = None
+        # Number of times the sessions were enumerated to resolve the session
+        self.resolve_count = 0
+
+    def __is_target_name(self, name):
+        return self.process_name in name.lower().split('.')[0]
+
+    def __resolve(self, pid=None):
+        self.resolve_count += 1
+        self.pid = pid
+        self.session = None
+        self.volume_interface = None
+        # Iterate through all active audio sessions to find the session of the
+        #   process with the given PID. Spotify may play audio from another of its
+        #   processes than the watched one, in which case any Spotify session is
+        #   used
+        target_session = None
+        for session in self.session_provider.get_sessions():
+            if self.__is_target_name(session.process_name) == False:
+                continue
+            if pid == None or session.pid == pid:
+                target_session = session
+                break
+            if target_session == None:
+                target_session = session
+        if target_session == None:
+            raise LookupError("Could not find %s process" %
+                self.process_name.capitalize())
+        self.session = target_session
+        self.volume_interface = target_session.get_volume_interface()
+
+    # Call a function on the volume interface of the cached session, resolving
+    #   the session again if the PID changed, the session expired or the call fails
+    def __call(self, function, pid=None):
+        if self.session == None or pid != self.pid or \
+                self.session.is_expired() == True:
+            self.__resolve(pid)
+            return function(self.volume_interface)
+        try:
+            return function(self.volume_interface)
+        except Exception:
+            self.__resolve(pid)
+            return function(self.volume_interface)
+
+    def get_volume(self, pid=None):
+        return int(round(self.__call(
+            lambda volume_interface: volume_interface.GetMasterVolume(), pid) * 100))
+
+    def set_volume(self, volume, pid=None):
+        self.__call(lambda volume_interface:
+            volume_interface.SetMasterVolume(volume / 100, None), pid)
+
+
+class VolumeRamp(object):
+
+    # Perceptual curves mapping the ramp's progress [0-1] to the fraction [0-1]
+    #   of the volume change that has been applied
+    CURVES = {
+        'linear': lambda x: x,
+        'logarithmic': lambda x: math.log10(1 + 9 * x),
+        's-curve': lambda x: (1 - math.cos(math.pi * x)) / 2}
+
+    def __init__(self, volume_controller, step_count=10, clock_obj=None):
+        self.volume_controller = volume_controller
+        # Precompute each curve for the given number of steps, which bounds the
+        #   number of mixer writes per ramp
+        self.step_count = max([1, step_count])
+        self.curve_fractions = {}
+        for name, curve in self.CURVES.items():
+            self.curve_fractions[name] = [curve((i + 1) / self.step_count)
+                for i in range(self.step_count)]
+        # Clock from which the monotonic time is read and with which the ramp
+        #   waits between steps, the real time by default
+        self.clock = clock_obj
+        if clock_obj == None:
+            self.clock = clock.Clock()
+        # Currently running ramp, the event used to cancel it and its target
+        self.thread = None
+        self.cancel_event = None
+        self.target_volume = None
+        # Exception raised by the mixer in the ramp's thread, kept until the
+        #   polling loop handles it, as it would otherwise only end the thread
+        self.error = None
+        # Number of mixer writes performed by all ramps
+        self.write_count = 0
+
+    # Start ramping the volume to the target volume in the background, starting
+    #   at the given monotonic time or immediately, cancelling any running ramp
+    def start(self, target_volume, duration_s, curve="s-curve", start_volume=None,
+            start_time=None):
+        self.cancel()
+        if start_volume == None:
+            start_volume = self.volume_controller.get_system_volume()
+        self.target_volume = target_volume
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.__run,
+            args=(start_volume, target_volume, duration_s,
+                self.curve_fractions[curve], start_time, self.cancel_event),
+            daemon=True)
+        self.thread.start()
+
+    def __run(self, start_volume, target_volume, duration_s, fractions, start_time,
+            cancel_event):
+        # A failing mixer exits the program from the main thread only, so keep
+        #   the exception, including 'SystemExit', for the polling loop
+        try:
+            self.__apply_steps(start_volume, target_volume, duration_s, fractions,
+                start_time, cancel_event)
+        except BaseException as ex:
+            self.error = ex
+
+    def __apply_steps(self, start_volume, target_volume, duration_s, fractions,
+            start_time, cancel_event):
+        # Wait for the start time, unless the ramp is cancelled in the meantime
+        if start_time != None:
+            delay_s = start_time - self.clock.monotonic()
+            if delay_s > 0 and self.clock.wait(cancel_event, delay_s) == True:
+                return
+        step_period_s = duration_s / len(fractions)
+        volume = start_volume
+        for i, fraction in enumerate(fractions):
+            if cancel_event.is_set() == True:
+                return
+            # Only write to the mixer if the rounded volume actually changes
+            next_volume = int(round(start_volume +
+                (target_volume - start_volume) * fraction))
+            if next_volume != volume:
+                self.volume_controller.set_system_volume(next_volume)
+                self.write_count += 1
+                volume = next_volume
+            if i < len(fractions) - 1 and \
+                    self.clock.wait(cancel_event, step_period_s) == True:
+                return
+
+    # Return the exception with which the last ramp failed, if any, and forget it
+    def pop_error(self):
+        error = self.error
+        self.error = None
+        return error
+
+    def is_running(self):
+        return self.thread != None and self.thread.is_alive()
+
+    # Cancel the running ramp, if any, and return whether it had not finished
+    def cancel(self):
+        if self.is_running() == False:
+            return False
+        self.cancel_event.set()
+        self.thread.join()
+        return True
+
+    def wait(self):
+        if self.thread != None:
+            self.thread.join()